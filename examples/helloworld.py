@@ -33,7 +33,7 @@ class HelloFlow(FlowSpec):
         print("HelloFlow is starting.")
         self.next(self.hello)
 
-    @nuvolaris(namespace="nuvolaris", action="mf")
+    @nuvolaris(namespace="nuvolaris", action="mf", image="slim")
     @step
     def hello(self):
         """
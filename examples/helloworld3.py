@@ -33,12 +33,13 @@ class ForeachFlow(FlowSpec):
                        'Rogue']
         self.next(self.a, foreach='titles')
 
-    @nuvolaris(namespace="nuvolaris", action="each", memory=512, timeout=120000)
+    @nuvolaris(namespace="nuvolaris", action="each", memory=512, timeout=120000, prewarm=9)
     @step
     def a(self):
         self.title = '%s processed' % self.input
         self.next(self.join)
 
+    @nuvolaris(namespace="nuvolaris", action="each", memory=512, timeout=120000, gather=["title"])
     @step
     def join(self, inputs):
         self.results = [input.title for input in inputs]
@@ -0,0 +1,55 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from metaflow import FlowSpec, step, nuvolaris
+
+class KindsFlow(FlowSpec):
+    """
+    A flow running the same step with the go and the python action launcher.
+    Run it twice in a row: the first run measures cold starts (action creation and
+    init time), the second one warm starts. Activation timings are printed at the
+    end of each task and recorded as nuvolaris-activation-* task metadata.
+    """
+
+    @step
+    def start(self):
+        self.next(self.go, self.python)
+
+    @nuvolaris(namespace="nuvolaris", action="kind_go", kind="go")
+    @step
+    def go(self):
+        self.launcher = "go"
+        self.next(self.join)
+
+    @nuvolaris(namespace="nuvolaris", action="kind_python", kind="python")
+    @step
+    def python(self):
+        self.launcher = "python"
+        self.next(self.join)
+
+    @step
+    def join(self, inputs):
+        print('launchers executed: %s' % ", ".join(input.launcher for input in inputs))
+        self.next(self.end)
+
+    @step
+    def end(self):
+        pass
+
+if __name__ == '__main__':
+    KindsFlow()
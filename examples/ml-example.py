@@ -16,8 +16,9 @@
 # under the License.
 #
 
-import json
-from metaflow import FlowSpec, S3, IncludeFile, step, nuvolaris
+import numpy as np
+from metaflow import FlowSpec, step, nuvolaris
+from metaflow.datatools import S3StreamWriter, load_s3_array
 from sklearn import datasets
 from sklearn.model_selection import train_test_split
 from sklearn import linear_model, metrics
@@ -33,19 +34,11 @@ class TrainingExampleFlow(FlowSpec):
 
     def _train_from__dataset(self, test_size=0.30, random_state=42):
         print(f"using s3 bucket {self._s3_tmp_folder}")
-        Xs = []
-        Ys = []
-
-        with S3(s3root=self._s3_tmp_folder) as s3:            
-            path = s3.get(self._s3_dataset_file).path
-            print(f"Downloaded dataset file to {path}")
-
-            with open(path) as f:
-                lines = f.readlines()
-                for line in lines:
-                    x, y = line.split('\t')
-                    Xs.append([float(x)])
-                    Ys.append(float(y))
+        # the dataset is parsed while it is streamed, straight into an array
+        dataset = load_s3_array(self._s3_tmp_folder + "/" + self._s3_dataset_file)
+        print(f"Loaded dataset of {len(dataset)} samples")
+        Xs = dataset[:, :1]
+        Ys = dataset[:, 1]
 
         X_train, X_test, y_train, y_test = train_test_split(Xs, Ys, test_size=test_size, random_state=random_state)
         print(len(X_train), len(X_test))
@@ -77,23 +70,19 @@ class TrainingExampleFlow(FlowSpec):
             coef=True,
             random_state=42)
 
-        dataset = ""
-        for _x, _y in zip(x, y):
-            dataset = dataset + '{}\t{}\n'.format(_x[0], _y)
-                        
-        with S3(s3root=self._s3_tmp_folder) as s3:            
-            url = s3.put(self._s3_dataset_file, dataset)
-            print("Dataset saved at", url)
+        with S3StreamWriter(self._s3_tmp_folder + "/" + self._s3_dataset_file) as out:
+            out.write_array(np.column_stack((x[:, 0], y)))
+            print("Dataset saved at", out.url)
 
         self.next(self.a, self.b)        
     
-    @nuvolaris(namespace="nuvolaris", action="train_a", timeout=240000, memory=512)
+    @nuvolaris(namespace="nuvolaris", timeout=240000, memory=512, image="ml", pool=True)
     @step
     def a(self):
         self.mse, self.r2 = self._train_from__dataset(0.10,42)
         self.next(self.join)
 
-    @nuvolaris(namespace="nuvolaris", action="train_b", timeout=240000, memory=512)
+    @nuvolaris(namespace="nuvolaris", timeout=240000, memory=512, image="ml", pool=True)
     @step
     def b(self):
         self.mse, self.r2 = self._train_from__dataset(0.30,42)
@@ -37,9 +37,112 @@ DEFAULT_DATASTORE = "s3"
 DATASTORE_SYSROOT_S3 = cfg.from_conf("NUVOLARIS_DATASTORE_SYSROOT_S3","s3://mlflowtest123456")
 
 # CUSTOM ACTION IMAGE LAUNCHER
-NUVOLARIS_METAFLOW_IMAGE = cfg.from_conf("NUVOLARIS_METAFLOW_RUNTIME_IMAGE","ghcr.io/nuvolaris/go-nuvolaris-metaflow:d928f4c")
+# The default images are tagged with the last commit changing runtime/ or templates/:
+# the launcher sent with the action must match the one prebuilt in the image.
+NUVOLARIS_METAFLOW_IMAGE = cfg.from_conf("NUVOLARIS_METAFLOW_RUNTIME_IMAGE","ghcr.io/nuvolaris/go-nuvolaris-metaflow:5b30096")
 NUVOLARIS_METAFLOW_OW_KIND = cfg.from_conf("NUVOLARIS_METAFLOW_RUNTIMEKIND","go:1.20mf")
 
+# RUNTIME IMAGE PROFILES (selected with @nuvolaris(image=...)), built as layers of runtime/Dockerfile.
+# It can be overridden with a json object mapping profile names to images.
+NUVOLARIS_METAFLOW_IMAGE_PROFILES = cfg.from_conf("NUVOLARIS_METAFLOW_IMAGE_PROFILES", {
+    "slim": NUVOLARIS_METAFLOW_IMAGE + "-slim",
+    "ml": NUVOLARIS_METAFLOW_IMAGE + "-ml",
+    "full": NUVOLARIS_METAFLOW_IMAGE
+})
+
+# PYTHON NATIVE ACTION LAUNCHER (selected with @nuvolaris(kind="python"))
+NUVOLARIS_METAFLOW_PYTHON_IMAGE = cfg.from_conf("NUVOLARIS_METAFLOW_PYTHON_RUNTIME_IMAGE","ghcr.io/nuvolaris/python-nuvolaris-metaflow:5b30096")
+NUVOLARIS_METAFLOW_PYTHON_OW_KIND = cfg.from_conf("NUVOLARIS_METAFLOW_PYTHON_RUNTIMEKIND","python:3.10mf")
+
+# CODE PACKAGE COMPRESSION: gzip (as built by metaflow), xz or zstd (requires the zstandard package).
+# Note that the metaflow client can only inspect gzip code packages (Task.code).
+NUVOLARIS_PACKAGE_COMPRESSION = cfg.from_conf("NUVOLARIS_PACKAGE_COMPRESSION", "gzip")
+
+# CODE PACKAGE FORMAT: tar (a single tarball) or delta (content addressed file chunks, only the
+# chunks changed since the last run are uploaded and downloaded). Task.code is not available for delta.
+NUVOLARIS_PACKAGE_FORMAT = cfg.from_conf("NUVOLARIS_PACKAGE_FORMAT", "tar")
+
+# LAUNCHER SPEC: when true the task is sent to the action as a structured list of phases run natively by the
+# launcher (no bash command line), and each phase is timed. Requires runtime images with /lib/fetch_package.py.
+NUVOLARIS_LAUNCHER_SPEC = cfg.from_conf("NUVOLARIS_LAUNCHER_SPEC", False)
+
+# TASK COORDINATOR: when true the @nuvolaris tasks are submitted and monitored by threads of the Metaflow
+# runtime process (at most NUVOLARIS_COORDINATOR_THREADS at a time) instead of a `nuvolaris step` process
+# each, the runtime only follows a lightweight waiter process per task.
+NUVOLARIS_COORDINATOR = cfg.from_conf("NUVOLARIS_COORDINATOR", False)
+NUVOLARIS_COORDINATOR_THREADS = cfg.from_conf("NUVOLARIS_COORDINATOR_THREADS", 256)
+
+# ACTION POOLING (enabled with @nuvolaris(pool=True), or for every step setting NUVOLARIS_ACTION_POOLING=true):
+# steps are routed to shared actions named after their resource shape, sharing the warm containers.
+NUVOLARIS_ACTION_POOLING = cfg.from_conf("NUVOLARIS_ACTION_POOLING", False)
+NUVOLARIS_ACTION_POOL_PREFIX = cfg.from_conf("NUVOLARIS_ACTION_POOL_PREFIX", "mf-pool")
+
+# ACTION PREWARM (enabled with @nuvolaris(prewarm=N) on the steps of a foreach): how long each warm up
+# invocation keeps its container busy, long enough for the invocations to overlap.
+NUVOLARIS_PREWARM_HOLD_MS = cfg.from_conf("NUVOLARIS_PREWARM_HOLD_MS", 2000)
+
+# LIVE LOGS RELAY (started with `python <flow> nuvolaris log-relay`): url the actions push the task logs to,
+# the url the client reads them from when the relay is reached through a different address, and the token
+# the relay requires from both (sent to the actions with the url). If not set the logs are tailed from the datastore.
+NUVOLARIS_LOG_RELAY_URL = cfg.from_conf("NUVOLARIS_LOG_RELAY_URL")
+NUVOLARIS_LOG_RELAY_CLIENT_URL = cfg.from_conf("NUVOLARIS_LOG_RELAY_CLIENT_URL", NUVOLARIS_LOG_RELAY_URL)
+NUVOLARIS_LOG_RELAY_TOKEN = cfg.from_conf("NUVOLARIS_LOG_RELAY_TOKEN")
+
+# CONCURRENCY LIMIT of the namespace (concurrent activations allowed by OpenWhisk), used by
+# `python <flow> nuvolaris plan` to project the schedule of the foreach steps.
+NUVOLARIS_CONCURRENCY_LIMIT = cfg.from_conf("NUVOLARIS_CONCURRENCY_LIMIT", 100)
+
+# SCRATCH ARTIFACT CACHE (enabled with @nuvolaris(scratch=True)): directory of the action containers
+# caching the artifacts in front of the datastore, private to each container by default or a volume shared
+# by the cluster nodes, and its size in megabytes.
+NUVOLARIS_SCRATCH_DIR = cfg.from_conf("NUVOLARIS_SCRATCH_DIR", "/tmp/nuvolaris/scratch")
+NUVOLARIS_SCRATCH_MAX_SIZE = cfg.from_conf("NUVOLARIS_SCRATCH_MAX_SIZE", 1024)
+
+# STAGED ARRAYS (metaflow.datatools.stage_array): local directory the staged arrays are downloaded to and
+# memory mapped from, kept across the activations of a warm container, and its size in megabytes beyond which
+# the least recently used arrays are removed.
+NUVOLARIS_STAGING_DIR = cfg.from_conf("NUVOLARIS_STAGING_DIR", "/tmp/nuvolaris/staged")
+NUVOLARIS_STAGING_MAX_SIZE = cfg.from_conf("NUVOLARIS_STAGING_MAX_SIZE", 1024)
+
+# JOIN GATHER (enabled with @nuvolaris(gather=...)): threads loading the input artifacts of a join step
+# concurrently, and artifacts loaded by each batched datastore request.
+NUVOLARIS_GATHER_THREADS = cfg.from_conf("NUVOLARIS_GATHER_THREADS", 16)
+NUVOLARIS_GATHER_BATCH_SIZE = cfg.from_conf("NUVOLARIS_GATHER_BATCH_SIZE", 32)
+
+# INPUT PREFETCH (disabled with @nuvolaris(prefetch=False)): local directory of the action containers the
+# input artifacts read by a step are downloaded to, with the gather threads and batches, before it runs.
+NUVOLARIS_PREFETCH_DIR = cfg.from_conf("NUVOLARIS_PREFETCH_DIR", "/tmp/nuvolaris/prefetch")
+
+# PIPELINED PERSIST (enabled with @nuvolaris(pipeline=True)): threads uploading the artifacts of a task while
+# the next ones are packed, and megabytes of packed artifacts allowed to wait for upload.
+NUVOLARIS_PIPELINE_THREADS = cfg.from_conf("NUVOLARIS_PIPELINE_THREADS", 8)
+NUVOLARIS_PIPELINE_MAX_PENDING = cfg.from_conf("NUVOLARIS_PIPELINE_MAX_PENDING", 256)
+
+# HEARTBEAT of the tasks: seconds between the beats written by a task to the datastore (0, the default,
+# disables it), beats missed before the client declares the task lost, and seconds allowed before the first
+# beat (the action timeout if not set, as the first beat comes only once the step starts).
+NUVOLARIS_HEARTBEAT_INTERVAL = cfg.from_conf("NUVOLARIS_HEARTBEAT_INTERVAL", 0)
+NUVOLARIS_HEARTBEAT_MAX_MISSED = cfg.from_conf("NUVOLARIS_HEARTBEAT_MAX_MISSED", 3)
+NUVOLARIS_HEARTBEAT_GRACE = cfg.from_conf("NUVOLARIS_HEARTBEAT_GRACE")
+
+# SPECULATIVE EXECUTION (enabled with @nuvolaris(speculate=True)): fraction of the tasks of a foreach that
+# must have finished, and multiple of their median duration a task must exceed, to launch its duplicate.
+NUVOLARIS_SPECULATION_QUANTILE = cfg.from_conf("NUVOLARIS_SPECULATION_QUANTILE", 0.9)
+NUVOLARIS_SPECULATION_MULTIPLIER = cfg.from_conf("NUVOLARIS_SPECULATION_MULTIPLIER", 2.0)
+
+# POLLS of the running activations: bounds in seconds of the delay between two polls of a task (before the
+# slow down under controller load), and previous successful runs the expected duration of a step is read from
+# (0 disables the history).
+NUVOLARIS_POLL_MIN = cfg.from_conf("NUVOLARIS_POLL_MIN", 0.5)
+NUVOLARIS_POLL_MAX = cfg.from_conf("NUVOLARIS_POLL_MAX", 10)
+NUVOLARIS_POLL_HISTORY = cfg.from_conf("NUVOLARIS_POLL_HISTORY", 5)
+
+# BLOCKING INVOCATIONS: steps whose median duration in the history is within NUVOLARIS_BLOCKING_MAX_DURATION
+# seconds (0 disables it) are invoked blocking, waiting up to NUVOLARIS_BLOCKING_WAIT seconds (at most 60, the
+# controller limit) for the result before falling back to the polls of the activation.
+NUVOLARIS_BLOCKING_MAX_DURATION = cfg.from_conf("NUVOLARIS_BLOCKING_MAX_DURATION", 5)
+NUVOLARIS_BLOCKING_WAIT = cfg.from_conf("NUVOLARIS_BLOCKING_WAIT", 15)
+
 ###
 # CONFIGURE: You can override any conda dependencies when a Conda environment is created
 ###
@@ -0,0 +1,62 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Runs a chunk of nuvolaris_map inside an activation, from the extracted code
+package:
+
+    python -m metaflow_extensions.nuvolaris.datatools.map_worker \\
+        <datastore type> <flow module> <input path> <output path>
+
+The output is the pickle of (True, results) or (False, formatted traceback).
+"""
+import importlib
+import os
+import pickle
+import sys
+import traceback
+from io import BytesIO
+
+from .staging import _get_storage
+
+
+def _load(storage, path):
+    with storage.load_bytes([path]) as loaded:
+        for _, local_path, _ in loaded:
+            with open(local_path, "rb") as f:
+                return pickle.load(f)
+
+
+def main(datastore_type, main_module, in_path, out_path):
+    sys.path.insert(0, os.getcwd())
+    storage = _get_storage(datastore_type)
+    try:
+        # functions of the flow file were pickled from __main__
+        sys.modules["__main__"] = importlib.import_module(main_module)
+        fn, chunk = _load(storage, in_path)
+        out = (True, [fn(item) for item in chunk])
+    except Exception:
+        out = (False, traceback.format_exc())
+    try:
+        data = pickle.dumps(out)
+    except Exception:
+        data = pickle.dumps((False, traceback.format_exc()))
+    storage.save_bytes([(out_path, BytesIO(data))], overwrite=True, len_hint=1)
+    return 0 if out[0] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(*sys.argv[1:5]))
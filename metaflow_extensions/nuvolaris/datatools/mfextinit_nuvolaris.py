@@ -22,4 +22,14 @@
 #            as metaflow.datatools.*. In this example, a user would be able to import
 #            metaflow.datatools.my_value (as well as metaflow.datatools.imported.my_value)
 ###
-from .imported import nuv_value
\ No newline at end of file
+from .imported import nuv_value
+from .s3stream import (
+    S3StreamWriter,
+    iter_s3_chunks,
+    iter_s3_lines,
+    load_s3_array,
+    read_s3_arrays,
+    read_s3_arrow_batches,
+)
+from .staging import StagedArray, stage_array
+from .nuvolaris_map import nuvolaris_map, nuvolaris_reduce
@@ -0,0 +1,322 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Fan out of a python function over Nuvolaris activations, from a step.
+
+Each chunk of the input is pickled with the function to the datastore, and an
+activation of the action of the step fetches the code package (where the
+function is imported from), applies the function to the chunk with
+map_worker.py and saves the pickled results back; both objects are deleted
+once the results are loaded. At most max_in_flight
+activations run at a time and the results are yielded in the input order, as
+soon as the chunks complete.
+
+nuvolaris_reduce builds a reduction tree of such maps over the inputs of a join,
+each activation combining fan_in values: a fan in of N inputs takes about
+log(N) / log(fan_in) activation rounds instead of N artifact loads.
+"""
+import os
+import pickle
+import shlex
+import sys
+import time
+import uuid
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from itertools import islice
+
+from metaflow import current
+from metaflow.datatools.s3util import get_s3_client
+from metaflow.exception import NuvolarisException
+from metaflow.metaflow_config import (
+    AZURE_STORAGE_BLOB_SERVICE_ENDPOINT,
+    DATASTORE_SYSROOT_AZURE,
+    DATASTORE_SYSROOT_S3,
+    DEFAULT_DATASTORE,
+    NUVOLARIS_DEFAULT_NAMESPACE,
+    NUVOLARIS_PACKAGE_COMPRESSION,
+    NUVOLARIS_PACKAGE_FORMAT,
+    S3_ENDPOINT_URL,
+)
+
+from .s3stream import _bucket_key
+from .staging import _get_storage
+
+POLL_INTERVAL_SECONDS = 1
+
+
+def _chunks(iterable, chunk_size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _main_module():
+    # functions defined in the flow file are pickled as __main__.<name>, the
+    # worker imports the flow file under its module name in its place
+    return os.path.splitext(os.path.basename(sys.argv[0]))[0]
+
+
+def _invocation_env(datastore_type):
+    env = {
+        "METAFLOW_DEFAULT_DATASTORE": datastore_type,
+        "METAFLOW_DATASTORE_SYSROOT_S3": DATASTORE_SYSROOT_S3,
+        "METAFLOW_DATASTORE_SYSROOT_AZURE": DATASTORE_SYSROOT_AZURE,
+        "METAFLOW_S3_ENDPOINT_URL": S3_ENDPOINT_URL,
+        "METAFLOW_AZURE_STORAGE_BLOB_SERVICE_ENDPOINT": AZURE_STORAGE_BLOB_SERVICE_ENDPOINT,
+        "PYTHONUNBUFFERED": "x",
+    }
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        env[name] = os.environ.get(name)
+    if not env["AWS_ACCESS_KEY_ID"] and datastore_type == "s3":
+        # same as the tasks launched from the client
+        try:
+            import boto3
+
+            credentials = boto3.Session(profile_name="default").get_credentials()
+            env["AWS_ACCESS_KEY_ID"] = credentials.access_key
+            env["AWS_SECRET_ACCESS_KEY"] = credentials.secret_key
+        except Exception:
+            pass
+    return {k: v for k, v in env.items() if v is not None}
+
+
+def _delete_objects(storage, datastore_type, paths):
+    # The storage implementations of Metaflow can't delete: best effort, a
+    # leftover object only takes space.
+    try:
+        if datastore_type == "s3":
+            client, _ = get_s3_client()
+            for path in paths:
+                bucket, key = _bucket_key(storage.full_uri(path))
+                client.delete_object(Bucket=bucket, Key=key)
+        elif datastore_type == "azure":
+            for path in paths:
+                storage.root_client.get_blob_client(path).delete_blob()
+    except Exception:
+        pass
+
+
+class _MapRunner(object):
+    def __init__(self, action, namespace, memory, timeout):
+        from metaflow_extensions.nuvolaris.plugins.nuvolaris_client import NuvolarisClient
+        from metaflow_extensions.nuvolaris.plugins.nuvolaris_environment import (
+            NuvolarisEnvironment,
+        )
+
+        code_package_url = os.environ.get("METAFLOW_CODE_URL")
+        if not code_package_url:
+            raise NuvolarisException(
+                "nuvolaris_map needs the code package of the task, call it from a "
+                "@nuvolaris step"
+            )
+        if os.environ.get("NUVOLARIS_TASK_ACTION") and "NUVOLARIS_API_AUTH" not in os.environ:
+            raise NuvolarisException(
+                "nuvolaris_map invokes actions from the task, which needs the credentials "
+                "of the Nuvolaris API: use @nuvolaris(api_access=True) on the step"
+            )
+        self._datastore_type = os.environ.get("METAFLOW_CODE_DS", DEFAULT_DATASTORE)
+        self._storage = _get_storage(self._datastore_type)
+        self._root = self._storage.path_join(
+            current.flow_name, "nuvolaris", "map", uuid.uuid4().hex
+        )
+        self._client = NuvolarisClient()
+        self._action = action
+        self._namespace = namespace
+        self._memory = memory
+        self._timeout = timeout
+        self._env = _invocation_env(self._datastore_type)
+
+        fetch_cmds = NuvolarisEnvironment().get_fetch_package_commands(
+            code_package_url,
+            self._datastore_type,
+            NUVOLARIS_PACKAGE_COMPRESSION,
+            NUVOLARIS_PACKAGE_FORMAT,
+        )
+        self._cmd_prefix = " && ".join(
+            ["rm -Rf nuvolaris_map", "mkdir -p nuvolaris_map/.metaflow", "cd nuvolaris_map"]
+            + fetch_cmds
+        )
+
+    def _command(self, in_path, out_path):
+        worker = "python -m metaflow_extensions.nuvolaris.datatools.map_worker %s %s %s %s" % (
+            self._datastore_type,
+            _main_module(),
+            in_path,
+            out_path,
+        )
+        return shlex.split("%s && %s" % (self._cmd_prefix, worker))
+
+    def run_chunk(self, index, fn, chunk):
+        in_path = self._storage.path_join(self._root, "%d.in" % index)
+        out_path = self._storage.path_join(self._root, "%d.out" % index)
+        self._storage.save_bytes(
+            [(in_path, BytesIO(pickle.dumps((fn, chunk))))], overwrite=True, len_hint=1
+        )
+        job = self._client.job(
+            action=self._action,
+            namespace=self._namespace,
+            memory=self._memory,
+            timeout=self._timeout,
+            command=self._command(in_path, out_path),
+            environment_variables=dict(self._env),
+        )
+        try:
+            running = job.execute()
+            while not running.is_done:
+                time.sleep(POLL_INTERVAL_SECONDS)
+
+            with self._storage.load_bytes([out_path]) as loaded:
+                for _, path, _ in loaded:
+                    if path is None:
+                        exit_code, _ = running.reason
+                        raise NuvolarisException(
+                            "nuvolaris_map chunk %d failed in %s (exit code %s)"
+                            % (index, running.id, exit_code)
+                        )
+                    with open(path, "rb") as f:
+                        ok, result = pickle.load(f)
+        finally:
+            _delete_objects(self._storage, self._datastore_type, [in_path, out_path])
+        if not ok:
+            raise NuvolarisException(
+                "nuvolaris_map chunk %d raised in %s:\n%s"
+                % (index, running.id, result)
+            )
+        return result
+
+
+def nuvolaris_map(
+    fn,
+    iterable,
+    chunk_size=1,
+    max_in_flight=16,
+    action=None,
+    namespace=None,
+    memory=256,
+    timeout=60000,
+):
+    """Applies fn to every item of iterable on Nuvolaris activations, chunk_size
+    items per activation, and yields the results in order.
+
+    fn must be picklable by reference, i.e. a function defined at the top level
+    of the flow file or of a module of the code package. The activations run on
+    the action of the current @nuvolaris step, unless another (already
+    deployed) action is given; outside of a Nuvolaris task a pooled action of
+    the given memory and timeout is used, deployed if needed. At most
+    max_in_flight activations are running at any time.
+    """
+    from metaflow_extensions.nuvolaris.plugins.openwhisk_client import (
+        get_pooled_action_name,
+    )
+
+    deploy = False
+    if action is None:
+        action = os.environ.get("NUVOLARIS_TASK_ACTION")
+    if action is None:
+        action = get_pooled_action_name(memory, timeout)
+        deploy = True
+    runner = _MapRunner(
+        action, namespace or NUVOLARIS_DEFAULT_NAMESPACE, memory, timeout
+    )
+    if deploy:
+        runner._client.job(
+            action=action,
+            namespace=runner._namespace,
+            memory=memory,
+            timeout=timeout,
+        ).create()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        pending = deque()
+        for index, chunk in enumerate(_chunks(iterable, chunk_size)):
+            if len(pending) == max_in_flight:
+                for result in pending.popleft().result():
+                    yield result
+            pending.append(pool.submit(runner.run_chunk, index, fn, chunk))
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+
+
+def _reduce_artifacts(fn, flow_name, datastore_type, keys):
+    # first level of nuvolaris_reduce, run by the activations: the artifacts are
+    # loaded by content key, in a single batched request
+    from metaflow.datastore import FlowDataStore
+
+    storage = _get_storage(datastore_type)
+    flow_datastore = FlowDataStore(
+        flow_name, None, storage_impl=type(storage), ds_root=storage.datastore_root
+    )
+    blobs = dict(flow_datastore.ca_store.load_blobs(set(keys)))
+    return fn([pickle.loads(blobs[key]) for key in keys])
+
+
+def _reduce_values(fn, values):
+    return fn(values)
+
+
+def _groups(items, fan_in):
+    return [items[i : i + fan_in] for i in range(0, len(items), fan_in)]
+
+
+def nuvolaris_reduce(fn, inputs, artifact, fan_in=16, **map_args):
+    """Reduces the artifact of the inputs of a join step on Nuvolaris
+    activations, as a tree of fan_in wide levels, and returns the result.
+
+    fn takes a list of values (artifacts or partial results) and returns their
+    combination, e.g. sum: it must be associative and picklable by reference as
+    for nuvolaris_map, whose arguments (max_in_flight, action, ...) are accepted.
+    The artifacts are not loaded by the join task, only the partial results of
+    the last level are.
+    """
+    if fan_in < 2:
+        raise NuvolarisException("nuvolaris_reduce needs a fan_in of at least 2")
+    datastores = [inp._datastore for inp in inputs]
+    keys = []
+    for ds in datastores:
+        key = ds.keys_for_artifacts([artifact])[0]
+        if key is None:
+            raise NuvolarisException(
+                "Input *%s* of the join has no artifact *%s*" % (ds.pathspec, artifact)
+            )
+        keys.append(key)
+    if len(keys) <= fan_in:
+        return fn([getattr(inp, artifact) for inp in inputs])
+
+    values = list(
+        nuvolaris_map(
+            partial(
+                _reduce_artifacts,
+                fn,
+                current.flow_name,
+                datastores[0]._storage_impl.TYPE,
+            ),
+            _groups(keys, fan_in),
+            **map_args
+        )
+    )
+    while len(values) > fan_in:
+        values = list(
+            nuvolaris_map(partial(_reduce_values, fn), _groups(values, fan_in), **map_args)
+        )
+    return fn(values)
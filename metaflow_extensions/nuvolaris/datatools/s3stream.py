@@ -0,0 +1,231 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Streaming access to S3 objects for the memory capped Nuvolaris actions.
+
+S3.get downloads a whole object before it can be read, and reading a text
+dataset into python lists takes many times its size. These helpers read an
+object in chunks of CHUNK_SIZE bytes and parse it into NumPy arrays (or Arrow
+record batches) as it comes, and write an object in multipart chunks, so the
+memory used is bounded by the chunk size plus the result itself.
+"""
+from io import BytesIO
+from urllib.parse import urlparse
+
+from metaflow.datatools.s3util import get_s3_client
+from metaflow.exception import NuvolarisException
+
+CHUNK_SIZE = 8 * 1024 * 1024
+# S3 multipart uploads require parts of at least 5MB, but the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def _bucket_key(url):
+    parsed = urlparse(url)
+    if parsed.scheme != "s3":
+        raise NuvolarisException("Expected an s3:// url, got *%s*" % url)
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise NuvolarisException(
+            "Reading arrays requires numpy, use an image or packages providing it"
+        )
+    return numpy
+
+
+def iter_s3_chunks(url, chunk_size=CHUNK_SIZE):
+    """Yields the content of the object as bytes chunks of chunk_size."""
+    client, _ = get_s3_client()
+    bucket, key = _bucket_key(url)
+    body = client.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+    finally:
+        body.close()
+
+
+def iter_s3_lines(url, chunk_size=CHUNK_SIZE, batch=False):
+    """Yields the lines of the object as bytes, or lists of complete lines read
+    with a chunk (an efficient unit to parse) when batch is True.
+    """
+    tail = b""
+    for chunk in iter_s3_chunks(url, chunk_size):
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        if batch:
+            yield lines
+        else:
+            for line in lines:
+                yield line
+    if tail:
+        if batch:
+            yield [tail]
+        else:
+            yield tail
+
+
+def read_s3_arrays(url, delimiter="\t", dtype="float64", chunk_size=CHUNK_SIZE):
+    """Yields the rows of a delimited text object as 2-D NumPy arrays, one per
+    chunk read.
+    """
+    np = _import_numpy()
+    for lines in iter_s3_lines(url, chunk_size, batch=True):
+        lines = [line.decode("utf-8") for line in lines if line.strip()]
+        if lines:
+            yield np.loadtxt(lines, delimiter=delimiter, dtype=dtype, ndmin=2)
+
+
+def load_s3_array(url, delimiter="\t", dtype="float64", chunk_size=CHUNK_SIZE):
+    """Returns a delimited text object as a 2-D NumPy array. The array is
+    filled as the object is read and grown in place, never keeping more than a
+    chunk of text in memory.
+    """
+    np = _import_numpy()
+    out = None
+    rows = 0
+    for batch in read_s3_arrays(url, delimiter, dtype, chunk_size):
+        if out is None:
+            out = np.empty((len(batch), batch.shape[1]), dtype=dtype)
+        elif rows + len(batch) > len(out):
+            out.resize((max(2 * len(out), rows + len(batch)), out.shape[1]), refcheck=False)
+        out[rows : rows + len(batch)] = batch
+        rows += len(batch)
+    if out is None:
+        return np.empty((0, 0), dtype=dtype)
+    out.resize((rows, out.shape[1]), refcheck=False)
+    return out
+
+
+def read_s3_arrow_batches(url, column_names=None, delimiter="\t", chunk_size=CHUNK_SIZE):
+    """Yields the rows of a delimited text object as Arrow record batches of
+    about chunk_size bytes of text each, parsed while streaming the object.
+    """
+    try:
+        import pyarrow
+        from pyarrow import csv
+    except ImportError:
+        raise NuvolarisException(
+            "Reading Arrow batches requires pyarrow, use an image or packages providing it"
+        )
+    client, _ = get_s3_client()
+    bucket, key = _bucket_key(url)
+    body = client.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        reader = csv.open_csv(
+            pyarrow.PythonFile(body, mode="r"),
+            read_options=csv.ReadOptions(
+                block_size=chunk_size,
+                column_names=column_names,
+                autogenerate_column_names=column_names is None,
+            ),
+            parse_options=csv.ParseOptions(delimiter=delimiter),
+        )
+        for batch in reader:
+            yield batch
+    finally:
+        body.close()
+
+
+class S3StreamWriter(object):
+    """Writes an S3 object as a multipart upload of part_size parts, so that it
+    never has to be built in memory or on disk. Use it as a context manager: the
+    upload is completed on exit, or aborted if an exception was raised.
+
+        with S3StreamWriter("s3://bucket/dataset.tsv") as out:
+            for batch in batches:
+                out.write_array(batch)
+    """
+
+    def __init__(self, url, part_size=CHUNK_SIZE):
+        self._client, _ = get_s3_client()
+        self._bucket, self._key = _bucket_key(url)
+        self._part_size = max(part_size, MIN_PART_SIZE)
+        self._buffer = BytesIO()
+        self._upload_id = None
+        self._parts = []
+        self.url = url
+
+    def write(self, data):
+        self._buffer.write(data)
+        if self._buffer.tell() >= self._part_size:
+            self._upload_part()
+
+    def write_lines(self, lines):
+        for line in lines:
+            self.write(line if line.endswith(b"\n") else line + b"\n")
+
+    def write_array(self, array, delimiter="\t", fmt="%.17g"):
+        """Appends the rows of a NumPy array as delimited text, readable with
+        read_s3_arrays and load_s3_array.
+        """
+        np = _import_numpy()
+        buf = BytesIO()
+        np.savetxt(buf, array, delimiter=delimiter, fmt=fmt)
+        self.write(buf.getvalue())
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            self._upload_id = self._client.create_multipart_upload(
+                Bucket=self._bucket, Key=self._key
+            )["UploadId"]
+        part_number = len(self._parts) + 1
+        resp = self._client.upload_part(
+            Bucket=self._bucket,
+            Key=self._key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=self._buffer.getvalue(),
+        )
+        self._parts.append({"ETag": resp["ETag"], "PartNumber": part_number})
+        self._buffer = BytesIO()
+
+    def close(self):
+        if self._upload_id is None:
+            # small enough for a single request
+            self._client.put_object(
+                Bucket=self._bucket, Key=self._key, Body=self._buffer.getvalue()
+            )
+            return self.url
+        if self._buffer.tell():
+            self._upload_part()
+        self._client.complete_multipart_upload(
+            Bucket=self._bucket,
+            Key=self._key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+        return self.url
+
+    def abort(self):
+        if self._upload_id is not None:
+            self._client.abort_multipart_upload(
+                Bucket=self._bucket, Key=self._key, UploadId=self._upload_id
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
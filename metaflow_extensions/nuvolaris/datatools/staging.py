@@ -0,0 +1,201 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Memory mapped staging of large NumPy arrays.
+
+A regular artifact is unpickled in memory, with its compressed copy, so an
+array takes about twice its size of the action memory. A staged array is saved
+as an uncompressed .npy object of the datastore, and the artifact is just a
+small StagedArray handle: reading it downloads the object to the local
+NUVOLARIS_STAGING_DIR (kept across the activations of a warm container, trimmed
+to NUVOLARIS_STAGING_MAX_SIZE megabytes) and maps it in memory read only, so only
+the pages used are loaded.
+
+    self.features = stage_array(features)   # in a step
+    ...
+    X = self.features.array                 # numpy.memmap in the next ones
+"""
+import os
+import shutil
+import tempfile
+from hashlib import sha1
+
+from metaflow import current
+from metaflow.exception import NuvolarisException
+from metaflow.metaflow_config import (
+    DATASTORE_SYSROOT_AZURE,
+    DATASTORE_SYSROOT_S3,
+    DEFAULT_DATASTORE,
+    NUVOLARIS_STAGING_DIR,
+    NUVOLARIS_STAGING_MAX_SIZE,
+)
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise NuvolarisException(
+            "Staged arrays require numpy, use an image or packages providing it"
+        )
+    return numpy
+
+
+def _get_storage(datastore_type):
+    # imported here as the datatools are loaded while metaflow is initialized
+    from metaflow.datastore import DATASTORES
+
+    if datastore_type == "s3":
+        root = DATASTORE_SYSROOT_S3
+    elif datastore_type == "azure":
+        root = DATASTORE_SYSROOT_AZURE
+    else:
+        raise NuvolarisException(
+            "Staged arrays are not supported for datastore *%s*" % datastore_type
+        )
+    return DATASTORES[datastore_type](root)
+
+
+def _staged_path(storage, flow_name, key):
+    return storage.path_join(flow_name, "nuvolaris", "staged", key[:2], key + ".npy")
+
+
+def _evict_staged(keep):
+    # LRU as the scratch cache; the arrays already mapped by a step stay
+    # readable once their file is removed
+    from metaflow_extensions.nuvolaris.plugins.nuvolaris_scratch import evict_lru
+
+    entries = []
+    for name in os.listdir(NUVOLARIS_STAGING_DIR):
+        path = os.path.join(NUVOLARIS_STAGING_DIR, name)
+        if not name.endswith(".npy") or path == keep:
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, [path]))
+    evict_lru(
+        entries,
+        int(NUVOLARIS_STAGING_MAX_SIZE) * 1024 * 1024 - os.path.getsize(keep),
+    )
+
+
+class StagedArray(object):
+    """Handle of a staged array, pickled in place of the array itself. It
+    exposes the array as a read only numpy.memmap and can be passed to NumPy
+    functions directly.
+    """
+
+    def __init__(self, datastore_type, flow_name, key, shape, dtype):
+        self.datastore_type = datastore_type
+        self.flow_name = flow_name
+        self.key = key
+        self.shape = shape
+        self.dtype = dtype
+        self._array = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_array"] = None
+        return state
+
+    @property
+    def local_path(self):
+        return os.path.join(NUVOLARIS_STAGING_DIR, self.key + ".npy")
+
+    def _fetch(self):
+        local_path = self.local_path
+        if os.path.isfile(local_path):
+            # refresh the array for the LRU eviction
+            os.utime(local_path)
+            return local_path
+        os.makedirs(NUVOLARIS_STAGING_DIR, exist_ok=True)
+        storage = _get_storage(self.datastore_type)
+        path = _staged_path(storage, self.flow_name, self.key)
+        with storage.load_bytes([path]) as loaded:
+            for _, tmp_path, _ in loaded:
+                if tmp_path is None:
+                    raise NuvolarisException(
+                        "Staged array *%s* not found in the datastore" % self.key
+                    )
+                # the downloaded file is moved, never read in memory
+                tmp = "%s.%d" % (local_path, os.getpid())
+                shutil.move(tmp_path, tmp)
+                os.rename(tmp, local_path)
+        _evict_staged(local_path)
+        return local_path
+
+    @property
+    def array(self):
+        if self._array is None:
+            np = _import_numpy()
+            self._array = np.load(self._fetch(), mmap_mode="r")
+        return self._array
+
+    def __array__(self, dtype=None):
+        if dtype is None:
+            return self.array
+        return self.array.astype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        return self.array[index]
+
+    def __repr__(self):
+        return "StagedArray(key=%s, shape=%s, dtype=%s)" % (self.key, self.shape, self.dtype)
+
+
+def stage_array(array, datastore_type=None):
+    """Saves a NumPy array as a staged .npy object of the datastore of the
+    current flow and returns its StagedArray handle, to be assigned as artifact.
+    The array is written to local disk and uploaded from there, the object is
+    content addressed so the same array is uploaded only once.
+    """
+    np = _import_numpy()
+    array = np.asanyarray(array)
+    storage = _get_storage(datastore_type or DEFAULT_DATASTORE)
+    os.makedirs(NUVOLARIS_STAGING_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=NUVOLARIS_STAGING_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array, allow_pickle=False)
+        digest = sha1()
+        with open(tmp, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        key = digest.hexdigest()
+        path = _staged_path(storage, current.flow_name, key)
+        if not storage.is_file([path])[0]:
+            with open(tmp, "rb") as f:
+                storage.save_bytes([(path, f)], overwrite=True, len_hint=1)
+        local_path = os.path.join(NUVOLARIS_STAGING_DIR, key + ".npy")
+        # the local copy serves the next steps running in the same container
+        os.rename(tmp, local_path)
+        _evict_staged(local_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return StagedArray(
+        datastore_type or DEFAULT_DATASTORE,
+        current.flow_name,
+        key,
+        tuple(array.shape),
+        str(array.dtype),
+    )
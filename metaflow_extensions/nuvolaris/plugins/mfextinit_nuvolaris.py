@@ -51,7 +51,8 @@ METADATA_PROVIDERS = []
 ###
 # CONFIGURE: Various sidecars
 ###
-SIDECARS = {"name": None}
+from .nuvolaris_log_relay import PushLogsSidecar
+SIDECARS = {"nuvolaris_push_logs": PushLogsSidecar}
 
 LOGGING_SIDECARS = {"name": None}
 
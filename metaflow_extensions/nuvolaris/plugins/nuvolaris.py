@@ -16,9 +16,9 @@
 # under the License.
 #
 import json
-import math
 import os
 import shlex
+import threading
 import time
 import boto3
 
@@ -36,11 +36,38 @@ from metaflow.metaflow_config import (
     S3_ENDPOINT_URL,
     AZURE_STORAGE_BLOB_SERVICE_ENDPOINT,
     DATASTORE_SYSROOT_AZURE,
-    DATASTORE_CARD_AZUREROOT
+    DATASTORE_CARD_AZUREROOT,
+    NUVOLARIS_PACKAGE_COMPRESSION,
+    NUVOLARIS_PACKAGE_FORMAT,
+    NUVOLARIS_SCRATCH_DIR,
+    NUVOLARIS_SCRATCH_MAX_SIZE,
+    NUVOLARIS_STAGING_DIR,
+    NUVOLARIS_STAGING_MAX_SIZE,
+    NUVOLARIS_GATHER_THREADS,
+    NUVOLARIS_GATHER_BATCH_SIZE,
+    NUVOLARIS_PREFETCH_DIR,
+    NUVOLARIS_PIPELINE_THREADS,
+    NUVOLARIS_PIPELINE_MAX_PENDING,
+    NUVOLARIS_HEARTBEAT_INTERVAL,
+    NUVOLARIS_HEARTBEAT_MAX_MISSED,
+    NUVOLARIS_HEARTBEAT_GRACE,
+    NUVOLARIS_POLL_MIN,
+    NUVOLARIS_POLL_MAX,
+    NUVOLARIS_BLOCKING_MAX_DURATION,
+    NUVOLARIS_BLOCKING_WAIT,
+    NUVOLARIS_LOG_RELAY_URL,
+    NUVOLARIS_LOG_RELAY_CLIENT_URL,
+    NUVOLARIS_LOG_RELAY_TOKEN,
+    NUVOLARIS_LAUNCHER_SPEC,
+    NUVOLARIS_DEFAULT_API_URL,
+    NUVOLARIS_DEFAULT_API_USER,
+    NUVOLARIS_DEFAULT_API_AUTH,
 )
 
 from metaflow.mflog import (
     BASH_SAVE_LOGS,
+    BASH_SAVE_LOGS_ARGS,
+    TASK_LOG_SOURCE,
     BASH_MFLOG,
     bash_capture_logs,
     export_mflog_env_vars,
@@ -50,6 +77,15 @@ from metaflow.mflog import (
 
 from .nuvolaris_environment import NuvolarisEnvironment
 from .nuvolaris_client import NuvolarisClient
+from .nuvolaris_deps import PACKAGES_ENV_VAR
+from .nuvolaris_heartbeat import HeartbeatMonitor, heartbeat_path
+from .nuvolaris_poll import PollScheduler
+from .nuvolaris_log_relay import (
+    CatchUpTail,
+    RelayTail,
+    delete_relay_logs,
+    relay_log_key,
+)
 
 # Redirect structured logs to $PWD/.logs/
 LOGS_DIR = "$PWD/.logs"
@@ -58,12 +94,21 @@ STDERR_FILE = "mflog_stderr"
 STDOUT_PATH = os.path.join(LOGS_DIR, STDOUT_FILE)
 STDERR_PATH = os.path.join(LOGS_DIR, STDERR_FILE)
 
+# Version of the structured command understood by the action launchers
+LAUNCHER_SPEC_VERSION = 1
+
 class NuvolarisException(MetaflowException):
     headline = "Nuvolaris error"
 
 class NuvolarisKilledException(MetaflowException):
     headline = "Nuvolaris Batch job killed"
 
+class NuvolarisTaskLostException(MetaflowException):
+    headline = "Nuvolaris task lost"
+
+class NuvolarisTaskCancelledException(MetaflowException):
+    headline = "Nuvolaris task cancelled"
+
 class Nuvolaris(object):
     def __init__(
         self,
@@ -86,6 +131,7 @@ class Nuvolaris(object):
         attempt,
         code_package_url,
         step_cmds,
+        packages=None,
     ):
         nuv_env = NuvolarisEnvironment()
         mflog_expr = export_mflog_env_vars(
@@ -101,8 +147,13 @@ class Nuvolaris(object):
         
         # TODO We need to handle the package setup but we use a custom implementation to skip required dependecies
         init_cmds = nuv_env.get_package_commands(
-            code_package_url, self._datastore.TYPE
+            code_package_url,
+            self._datastore.TYPE,
+            NUVOLARIS_PACKAGE_COMPRESSION,
+            NUVOLARIS_PACKAGE_FORMAT,
         )
+        if packages:
+            init_cmds += nuv_env.get_deps_commands()
         init_expr = " && ".join(init_cmds)
         #init_expr = " && "
         step_expr = bash_capture_logs(
@@ -144,8 +195,123 @@ class Nuvolaris(object):
         #return shlex.split('/bin/bash -c "%s"' % cmd_str)
         return shlex.split(cmd_str)
 
-    def launch_job(self, **kwargs):
-        self._job = self.create_job(**kwargs).execute()
+    def _launcher_spec(
+        self,
+        flow_name,
+        run_id,
+        step_name,
+        task_id,
+        attempt,
+        code_package_url,
+        step_cmds,
+        packages=None,
+    ):
+        """Structured counterpart of _command, executed by the action launcher
+        without going through bash: phases run in order, each one timed, and the
+        final logs are saved whatever the outcome of the previous phases. Values
+        in env and argv may reference environment variables as $VAR or ${VAR},
+        unless the phase is raw.
+        """
+        nuv_env = NuvolarisEnvironment()
+        phases = nuv_env.get_package_phases(
+            code_package_url, NUVOLARIS_PACKAGE_COMPRESSION, NUVOLARIS_PACKAGE_FORMAT
+        )
+        if packages:
+            phases += nuv_env.get_deps_phases()
+        bootstrap_cmds = self._environment.bootstrap_commands(
+            step_name, self._datastore.TYPE
+        )
+        tee = {
+            stream: [
+                nuv_env._python(),
+                "-m",
+                "metaflow.mflog.tee",
+                TASK_LOG_SOURCE,
+                "$MFLOG_%s" % stream.upper(),
+            ]
+            for stream in ("stdout", "stderr")
+        }
+        if bootstrap_cmds:
+            # Environments only provide them as shell commands, whose exports
+            # (PATH, an activated conda environment) the step must see: they run
+            # with the step in the same bash, as in _command.
+            phases.append(
+                {
+                    "name": "step",
+                    "log": "Task is starting.",
+                    "argv": ["bash", "-c", " && ".join(bootstrap_cmds + step_cmds)],
+                    "raw": True,
+                    "tee": tee,
+                }
+            )
+        else:
+            for step_cmd in step_cmds:
+                phases.append(
+                    {
+                        "name": "step",
+                        "log": "Task is starting.",
+                        "argv": shlex.split(step_cmd),
+                        "tee": tee,
+                    }
+                )
+        phases.append({"name": "save_logs", "argv": BASH_SAVE_LOGS_ARGS, "always": True})
+        return {
+            "version": LAUNCHER_SPEC_VERSION,
+            "env": {
+                "PYTHONUNBUFFERED": "x",
+                "MF_PATHSPEC": "/".join((flow_name, str(run_id), step_name, str(task_id))),
+                "MF_DATASTORE": self._datastore.TYPE,
+                "MF_ATTEMPT": str(attempt),
+                "MFLOG_STDOUT": STDOUT_PATH,
+                "MFLOG_STDERR": STDERR_PATH,
+            },
+            "phases": phases,
+        }
+
+    def launch_job(self, expected_duration=None, **kwargs):
+        # expected_duration (seconds, from the history of the step) tunes the
+        # polls of the activation, and makes the invocation of short steps blocking
+        self._log_key = relay_log_key(
+            kwargs["flow_name"],
+            kwargs["run_id"],
+            kwargs["step_name"],
+            kwargs["task_id"],
+            kwargs["attempt"],
+        )
+        blocking_wait = None
+        max_duration = float(NUVOLARIS_BLOCKING_MAX_DURATION)
+        if (
+            expected_duration is not None
+            and max_duration > 0
+            and expected_duration <= max_duration
+        ):
+            # a short step, its result is awaited by the invocation itself
+            blocking_wait = min(float(NUVOLARIS_BLOCKING_WAIT), 60.0)
+        self._job = self.create_job(**kwargs).execute(
+            scheduler=PollScheduler(expected_duration), blocking_wait=blocking_wait
+        )
+        self._heartbeat = None
+        if int(NUVOLARIS_HEARTBEAT_INTERVAL) > 0:
+            # the first beat comes after the cold start, the code package and the
+            # dependency layer: by default it's awaited as long as the action runs
+            grace = NUVOLARIS_HEARTBEAT_GRACE
+            if grace is None:
+                grace = int(kwargs["timeout"]) // 1000
+            storage = self._datastore._storage_impl
+            self._heartbeat = HeartbeatMonitor(
+                storage,
+                heartbeat_path(
+                    storage,
+                    kwargs["flow_name"],
+                    kwargs["run_id"],
+                    kwargs["step_name"],
+                    kwargs["task_id"],
+                    kwargs["attempt"],
+                ),
+                int(NUVOLARIS_HEARTBEAT_INTERVAL),
+                int(NUVOLARIS_HEARTBEAT_MAX_MISSED),
+                int(grace),
+            )
 
     def create_job(
         self,
@@ -164,9 +330,24 @@ class Nuvolaris(object):
         action=None,
         memory=None,
         timeout=None,      
+        kind=None,
+        image=None,
+        packages=None,
+        api_access=False,
         env={},
     ):
 
+        command_args = dict(
+            flow_name=flow_name,
+            run_id=run_id,
+            step_name=step_name,
+            task_id=task_id,
+            attempt=attempt,
+            code_package_url=code_package_url,
+            step_cmds=[step_cli],
+            packages=packages,
+        )
+        use_spec = str(NUVOLARIS_LAUNCHER_SPEC).lower() in ("1", "true", "yes")
         job = (
             NuvolarisClient()
             .job(
@@ -175,15 +356,10 @@ class Nuvolaris(object):
                 action=action,
                 memory=memory,
                 timeout=timeout,
-                command=self._command(
-                    flow_name=flow_name,
-                    run_id=run_id,
-                    step_name=step_name,
-                    task_id=task_id,
-                    attempt=attempt,
-                    code_package_url=code_package_url,
-                    step_cmds=[step_cli],
-                ),
+                kind=kind,
+                image=image,
+                command=None if use_spec else self._command(**command_args),
+                spec=self._launcher_spec(**command_args) if use_spec else None,
                 timeout_in_seconds=run_time_limit,
                 # Retries are handled by Metaflow runtime
                 retries=0,
@@ -222,6 +398,40 @@ class Nuvolaris(object):
             .environment_variable(
                 "NUVOLARIS_DATASTORE_SYSROOT_S3", DATASTORE_SYSROOT_S3
             ) 
+            .environment_variable("NUVOLARIS_LOG_RELAY_URL", NUVOLARIS_LOG_RELAY_URL)
+            .environment_variable("NUVOLARIS_LOG_RELAY_TOKEN", NUVOLARIS_LOG_RELAY_TOKEN)
+            .environment_variable("NUVOLARIS_SCRATCH_DIR", NUVOLARIS_SCRATCH_DIR)
+            .environment_variable(
+                "NUVOLARIS_SCRATCH_MAX_SIZE", str(NUVOLARIS_SCRATCH_MAX_SIZE)
+            )
+            .environment_variable("NUVOLARIS_STAGING_DIR", NUVOLARIS_STAGING_DIR)
+            .environment_variable(
+                "NUVOLARIS_STAGING_MAX_SIZE", str(NUVOLARIS_STAGING_MAX_SIZE)
+            )
+            .environment_variable("NUVOLARIS_GATHER_THREADS", str(NUVOLARIS_GATHER_THREADS))
+            .environment_variable(
+                "NUVOLARIS_GATHER_BATCH_SIZE", str(NUVOLARIS_GATHER_BATCH_SIZE)
+            )
+            .environment_variable("NUVOLARIS_PREFETCH_DIR", NUVOLARIS_PREFETCH_DIR)
+            .environment_variable(
+                "NUVOLARIS_HEARTBEAT_INTERVAL", str(NUVOLARIS_HEARTBEAT_INTERVAL)
+            )
+            .environment_variable(
+                "NUVOLARIS_PIPELINE_THREADS", str(NUVOLARIS_PIPELINE_THREADS)
+            )
+            .environment_variable(
+                "NUVOLARIS_PIPELINE_MAX_PENDING", str(NUVOLARIS_PIPELINE_MAX_PENDING)
+            )
+            # polls of the activations of nuvolaris_map, run by the task
+            .environment_variable("NUVOLARIS_POLL_MIN", str(NUVOLARIS_POLL_MIN))
+            .environment_variable("NUVOLARIS_POLL_MAX", str(NUVOLARIS_POLL_MAX))
+            # used by nuvolaris_map to invoke the action of the task from the task
+            .environment_variable("NUVOLARIS_TASK_ACTION", action)
+            .environment_variable("NUVOLARIS_NAMESPACE", namespace)
+            .environment_variable(
+                "NUVOLARIS_PACKAGE_COMPRESSION", NUVOLARIS_PACKAGE_COMPRESSION
+            )
+            .environment_variable("NUVOLARIS_PACKAGE_FORMAT", NUVOLARIS_PACKAGE_FORMAT)
             #.environment_variable(
             #    "METAFLOW_DEBUG_S3CLIENT", "1"
             #)  
@@ -241,6 +451,9 @@ class Nuvolaris(object):
         for name, value in env.items():
             job.environment_variable(name, value)
 
+        if packages:
+            job.environment_variable(PACKAGES_ENV_VAR, json.dumps(packages))
+
         # Pass AWS credentials as environment_variable in a non blocking way
         try:
             session = boto3.Session(profile_name="default")
@@ -275,18 +488,21 @@ class Nuvolaris(object):
             .label("app.kubernetes.io/part-of", "metaflow")
         )
 
+        if api_access:
+            # the step invokes actions itself (nuvolaris_map), only then the
+            # credentials of the Nuvolaris API are sent to the task
+            (
+                job.environment_variable("NUVOLARIS_API_URL", NUVOLARIS_DEFAULT_API_URL)
+                .environment_variable("NUVOLARIS_API_USER", NUVOLARIS_DEFAULT_API_USER)
+                .environment_variable("NUVOLARIS_API_AUTH", NUVOLARIS_DEFAULT_API_AUTH)
+            )
+
         return job.create()
 
-    def wait(self, stdout_location, stderr_location, echo=None):
-        def update_delay(secs_since_start):
-            # this sigmoid function reaches
-            # - 0.1 after 11 minutes
-            # - 0.5 after 15 minutes
-            # - 1.0 after 23 minutes
-            # in other words, the user will see very frequent updates
-            # during the first 10 minutes
-            sigmoid = 1.0 / (1.0 + math.exp(-0.01 * secs_since_start + 9.0))
-            return 0.5 + sigmoid * 30.0
+    def wait(self, stdout_location, stderr_location, echo=None, stop=None):
+        # stop is set when the task is no longer awaited, e.g. the run is
+        # interrupted: waiting ends without waiting for the job
+        stop = stop or threading.Event()
 
         def wait_for_launch(job):
             status = job.status
@@ -296,8 +512,7 @@ class Nuvolaris(object):
                 job_id=job.id,
             )
             t = time.time()
-            start_time = time.time()
-            while job.is_waiting:
+            while job.is_waiting and not stop.is_set():
                 new_status = job.status
                 if status != new_status or (time.time() - t) > 30:
                     status = new_status
@@ -307,11 +522,17 @@ class Nuvolaris(object):
                         job_id=job.id,
                     )
                     t = time.time()
-                time.sleep(update_delay(time.time() - start_time))
+                # the polls of the job are spread by its scheduler
+                stop.wait(max(job.next_poll_in, 0.1))
 
         prefix = b"[%s] " % util.to_bytes(self._job.id)
-        stdout_tail = get_log_tailer(stdout_location, self._datastore.TYPE)
-        stderr_tail = get_log_tailer(stderr_location, self._datastore.TYPE)
+        if NUVOLARIS_LOG_RELAY_CLIENT_URL:
+            # logs are pushed live by the action, no datastore polling
+            stdout_tail = RelayTail(NUVOLARIS_LOG_RELAY_CLIENT_URL, self._log_key, "stdout")
+            stderr_tail = RelayTail(NUVOLARIS_LOG_RELAY_CLIENT_URL, self._log_key, "stderr")
+        else:
+            stdout_tail = get_log_tailer(stdout_location, self._datastore.TYPE)
+            stderr_tail = get_log_tailer(stderr_location, self._datastore.TYPE)
 
         # 1) Loop until the job has started
         wait_for_launch(self._job)
@@ -323,9 +544,39 @@ class Nuvolaris(object):
             stdout_tail=stdout_tail,
             stderr_tail=stderr_tail,
             echo=echo,
-            has_log_updates=lambda: self._job.is_running,
+            has_log_updates=lambda: (
+                self._job.is_running and not self._is_lost() and not stop.is_set()
+            ),
         )
+        if stop.is_set():
+            raise NuvolarisTaskCancelledException(
+                "Task cancelled, %s is no longer awaited." % self._job.id
+            )
+        if NUVOLARIS_LOG_RELAY_CLIENT_URL:
+            # Print what the relay missed from the durable copy in the datastore,
+            # saved at the end of the task
+            tail_logs(
+                prefix=prefix,
+                stdout_tail=CatchUpTail(
+                    get_log_tailer(stdout_location, self._datastore.TYPE),
+                    stdout_tail.bytes_read,
+                ),
+                stderr_tail=CatchUpTail(
+                    get_log_tailer(stderr_location, self._datastore.TYPE),
+                    stderr_tail.bytes_read,
+                ),
+                echo=echo,
+                has_log_updates=lambda: False,
+            )
+            delete_relay_logs(NUVOLARIS_LOG_RELAY_CLIENT_URL, self._log_key)
         # 3) Fetch remaining logs
+        if self._is_lost():
+            # OpenWhisk would record the failure only at the action timeout
+            raise NuvolarisTaskLostException(
+                "Task lost, %s: the container was likely killed (out of memory or "
+                "node lost). The task is retried if @retry is specified."
+                % self._heartbeat.lost_reason
+            )
         if self._job.has_failed:
             exit_code, reason = self._job.reason
             msg = next(
@@ -358,4 +609,36 @@ class Nuvolaris(object):
             "Task finished with exit code %s." % exit_code,
             "stderr",
             job_id=self._job.id,
-        ) 
+        )
+
+        stats = self._job.activation_stats
+        if stats:
+            echo(
+                "Activation took %s ms (kind %s, init %s ms, wait %s ms)."
+                % (
+                    stats.get("duration"),
+                    stats.get("kind"),
+                    stats.get("initTime", 0),
+                    stats.get("waitTime", 0),
+                ),
+                "stderr",
+                job_id=self._job.id,
+            )
+            phases = [
+                "%s %s ms" % (k[len("phase-") :], v)
+                for k, v in stats.items()
+                if k.startswith("phase-")
+            ]
+            if phases:
+                echo(
+                    "Launcher phases: %s." % ", ".join(phases),
+                    "stderr",
+                    job_id=self._job.id,
+                )
+
+    def _is_lost(self):
+        return self._heartbeat is not None and self._heartbeat.is_lost()
+
+    @property
+    def activation_stats(self):
+        return self._job.activation_stats
@@ -0,0 +1,85 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+from hashlib import sha1
+from io import BytesIO
+
+# Result cache of the @nuvolaris(cache=True) steps: the index maps the key of a
+# task (code, step, runtime environment and inputs) to the pathspec of a successful task computed
+# from them, whose artifacts are cloned instead of invoking the action again.
+CACHE_KEY_VERSION = 2
+
+
+def get_cache_root(flow_datastore):
+    return flow_datastore._storage_impl.path_join(
+        flow_datastore.flow_name, "nuvolaris", "cache"
+    )
+
+
+def task_cache_key(
+    flow_datastore, code_package_sha, step_name, input_paths, split_index, environment=None
+):
+    """Key of a task: the code package, the step, the split of a foreach, the
+    environment the step runs in (dependencies, image, launcher kind and
+    environment variables, as a JSON serializable dict) and every artifact of
+    the input tasks (by content hash, nothing is loaded).
+    """
+    inputs = []
+    for input_path in sorted(input_paths):
+        run_id, input_step, task_id = input_path.split("/")
+        ds = flow_datastore.get_task_datastore(run_id, input_step, task_id)
+        inputs.append([input_step, sorted(ds.items())])
+    spec = {
+        "version": CACHE_KEY_VERSION,
+        "code": code_package_sha,
+        "step": step_name,
+        "split_index": split_index,
+        "environment": environment or {},
+        "inputs": inputs,
+    }
+    return sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def lookup_cached_task(flow_datastore, key):
+    """Returns the pathspec (run/step/task) of the task cached with the key, if
+    it is still a successful task of the datastore.
+    """
+    storage = flow_datastore._storage_impl
+    path = storage.path_join(get_cache_root(flow_datastore), key)
+    if not storage.is_file([path])[0]:
+        return None
+    with storage.load_bytes([path]) as loaded:
+        for _, local_path, _ in loaded:
+            with open(local_path, "rb") as f:
+                pathspec = json.load(f)["pathspec"]
+    run_id, step_name, task_id = pathspec.split("/")
+    try:
+        ds = flow_datastore.get_task_datastore(run_id, step_name, task_id)
+        if not ds["_task_ok"]:
+            return None
+    except Exception:
+        # e.g. the run has been deleted from the datastore
+        return None
+    return pathspec
+
+
+def record_cached_task(flow_datastore, key, pathspec):
+    storage = flow_datastore._storage_impl
+    path = storage.path_join(get_cache_root(flow_datastore), key)
+    data = json.dumps({"pathspec": pathspec}).encode("utf-8")
+    storage.save_bytes([(path, BytesIO(data))], overwrite=True, len_hint=1)
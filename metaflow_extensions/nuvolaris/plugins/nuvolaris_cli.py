@@ -15,23 +15,22 @@
 # specific language governing permissions and limitations
 # under the License.
 #
-import os
+import json
+import secrets
 import sys
-import time
-import traceback
 
 from metaflow import util
 from metaflow._vendor import click
-from metaflow.exception import METAFLOW_EXIT_DISALLOW_RETRY, CommandException
-from metaflow.metadata.util import sync_local_metadata_from_datastore
-from metaflow.metaflow_config import DATASTORE_LOCAL_DIR
-from metaflow.mflog import TASK_LOG_SOURCE
 
 from metaflow.metaflow_config import (
-    NUVOLARIS_DEFAULT_NAMESPACE
+    NUVOLARIS_CONCURRENCY_LIMIT,
+    NUVOLARIS_DEFAULT_NAMESPACE,
+    NUVOLARIS_LOG_RELAY_TOKEN
 )
 
-from .nuvolaris import Nuvolaris
+from .nuvolaris_log_relay import serve as serve_log_relay
+from .nuvolaris_plan import load_history, plan_flow
+from .nuvolaris_task import get_step_cli, get_step_env, run_task, wait_before_retry
 
 @click.group()
 def cli():
@@ -41,6 +40,110 @@ def cli():
 def nuvolaris():
     pass
 
+@nuvolaris.command(
+    "log-relay",
+    help="Start the relay receiving the logs pushed live by the Nuvolaris actions. "
+    "Point NUVOLARIS_LOG_RELAY_URL to it to tail the task logs without polling the datastore."
+)
+@click.option("--host", default="127.0.0.1", help="Address to listen on, 0.0.0.0 to be reached by the actions directly.")
+@click.option("--port", default=8090, help="Port to listen on.")
+@click.option("--max-size", default=256, type=int, help="Megabytes of logs kept in memory. Default to 256.")
+@click.option("--ttl", default=3600, type=int, help="Seconds the logs of a task are kept without reads or writes. Default to 3600.")
+@click.pass_context
+def log_relay(ctx, host, port, max_size, ttl):
+    token = NUVOLARIS_LOG_RELAY_TOKEN
+    if not token:
+        token = secrets.token_urlsafe(32)
+        ctx.obj.echo_always(
+            "No NUVOLARIS_LOG_RELAY_TOKEN configured, set it for the runs using the relay:\n"
+            "NUVOLARIS_LOG_RELAY_TOKEN=%s" % token
+        )
+    ctx.obj.echo_always("Nuvolaris log relay listening on %s:%d" % (host, port))
+    serve_log_relay(host, port, token, max_size * 1024 * 1024, ttl)
+
+def _parse_splits(ctx, param, value):
+    splits = {}
+    for v in value:
+        name, _, count = v.partition("=")
+        if not count.isdigit():
+            raise click.BadParameter("expected <foreach step>=<number of splits>, got %s" % v)
+        splits[name] = int(count)
+    return splits
+
+@nuvolaris.command(
+    help="Project the schedule and the resource cost of a run of the flow on Nuvolaris, "
+    "from the @nuvolaris attributes and the task timings of the previous runs. Nothing is executed."
+)
+@click.option(
+    "--splits",
+    multiple=True,
+    callback=_parse_splits,
+    help="Expected number of splits of a foreach step, as <step>=<number>. "
+    "If not given the number of splits of the last run is used.",
+)
+@click.option(
+    "--concurrency",
+    default=NUVOLARIS_CONCURRENCY_LIMIT,
+    type=int,
+    help="Concurrent activations allowed in the namespace. Default to NUVOLARIS_CONCURRENCY_LIMIT.",
+)
+@click.option(
+    "--max-workers",
+    default=16,
+    type=int,
+    help="Number of concurrent tasks of the run, as the --max-workers option of run. Default to 16.",
+)
+@click.option("--history", default=5, type=int, help="Number of previous successful runs to read the timings from.")
+@click.option("--json", "as_json", is_flag=True, default=False, help="Print the plan as JSON.")
+@click.pass_context
+def plan(ctx, splits, concurrency, max_workers, history, as_json):
+    echo = ctx.obj.echo_always
+    past_runs = load_history(ctx.obj.flow.name, history, echo=echo) if history else []
+    result = plan_flow(ctx.obj.graph, past_runs, splits, concurrency, max_workers)
+    if as_json:
+        echo(json.dumps(result, indent=2))
+        return
+
+    echo(
+        "Plan of %s, from %d previous run(s), %d task(s) running at a time"
+        % (ctx.obj.flow.name, len(past_runs), result["parallelism"])
+    )
+    for name, (width, source) in result["foreach_widths"].items():
+        echo("  foreach %s: %d split(s) (%s)" % (name, width, source))
+    echo(
+        "%-20s %-22s %8s %8s %10s %-12s %10s %12s %10s"
+        % ("step", "action", "memory", "tasks", "task (s)", "from", "wall (s)", "GB-s", "MB")
+    )
+    for name, step in result["steps"].items():
+        echo(
+            "%-20s %-22s %8s %8d %10.1f %-12s %10.1f %12.1f %10.1f"
+            % (
+                name,
+                step.get("action", "(local)"),
+                step.get("memory", "-"),
+                step["invocations"],
+                step["duration_ms"] / 1000.0,
+                step["duration_source"],
+                step["wall_ms"] / 1000.0,
+                step["gb_seconds"],
+                step["payload_bytes"] / 1024.0 / 1024.0,
+            )
+        )
+    echo(
+        "Total: %d invocation(s), %.1f GB-s, %.1f MB of artifacts, about %.1f s of wall time."
+        % (
+            result["invocations"],
+            result["gb_seconds"],
+            result["payload_bytes"] / 1024.0 / 1024.0,
+            result["wall_ms"] / 1000.0,
+        )
+    )
+    if max_workers < concurrency:
+        echo(
+            "Tasks are limited by --max-workers %d rather than the namespace concurrency %d."
+            % (max_workers, concurrency)
+        )
+
 @nuvolaris.command(
     help="Execute a single task on Nuvolaris. This command calls the top-level step "
     "command inside a Nuvolaris OpenWhisk runtime with the given options. Typically you do not call "
@@ -78,6 +181,19 @@ def nuvolaris():
 @click.option("--action", default=None, help="Name of the nuvolaris action to be deployed.")
 @click.option("--memory", default=256, help="Memory that nuvolaris should assign in megabytes. Default to 256")
 @click.option("--timeout", default=60000, help="Nuvoalris deployed action timeout. Deafult to 60000 milliseconds")
+@click.option("--kind", default="go", help="Nuvolaris action launcher kind, go or python. Default to go")
+@click.option("--image", default=None, help="Runtime image profile (slim, ml, full) or image to deploy the action with.")
+@click.option("--packages", default=None, help="JSON encoded packages to install as step dependency layer.")
+@click.option("--scratch", is_flag=True, default=False, help="Cache the step artifacts in the action scratch directory.")
+@click.option("--pool", is_flag=True, default=False, help="The step runs on a pooled action (already resolved in --action).")
+@click.option("--prewarm", default=0, help="Containers warmed up before the step, handled by the runtime.")
+@click.option("--cache", is_flag=True, default=False, help="Cache the result of the step, handled by the runtime.")
+@click.option("--gather", default=None, help="JSON encoded artifacts gathered by a join step before it runs.")
+@click.option("--prefetch", is_flag=True, default=False, help="Prefetch the input artifacts read by the step.")
+@click.option("--pipeline", is_flag=True, default=False, help="Upload the artifacts while the task persists them.")
+@click.option("--api-access", is_flag=True, default=False, help="Send the Nuvolaris API credentials to the task.")
+@click.option("--cache-key", default=None, help="Key to record the task with in the result cache.")
+@click.option("--expected-duration", default=None, type=float, help="Expected duration of the task in seconds, from the history of the step.")
 @click.option("--namespace", default=None, help="Passed to the top-level 'step'.")
 @click.pass_context
 def step(
@@ -91,6 +207,19 @@ def step(
     action=None,
     memory=None,
     timeout=None,
+    kind=None,
+    image=None,
+    packages=None,
+    scratch=False,
+    pool=False,
+    prewarm=0,
+    cache=False,
+    gather=None,
+    prefetch=False,
+    pipeline=False,
+    api_access=False,
+    cache_key=None,
+    expected_duration=None,
     **kwargs
 ):
     def echo(msg, stream="stderr", job_id=None):
@@ -105,101 +234,41 @@ def step(
     if executable is None:
         executable = ctx.obj.environment.executable(step_name)
 
-    # Set environment
-    env = {}
-    env_deco = [deco for deco in node.decorators if deco.name == "environment"]
-    if env_deco:
-        env = env_deco[0].attributes["vars"]
-
-    # Set input paths.
-    input_paths = kwargs.get("input_paths")
-    split_vars = None
-    if input_paths:
-        max_size = 30 * 1024
-        split_vars = {
-            "METAFLOW_INPUT_PATHS_%d" % (i // max_size): input_paths[i : i + max_size]
-            for i in range(0, len(input_paths), max_size)
-        }
-        kwargs["input_paths"] = "".join("${%s}" % s for s in split_vars.keys())
-        env.update(split_vars)
+    # Set environment and input paths.
+    env, kwargs["input_paths"] = get_step_env(node, kwargs.get("input_paths"))
 
     # Set retry policy.
     retry_count = int(kwargs.get("retry_count", 0))
-    retry_deco = [deco for deco in node.decorators if deco.name == "retry"]
-    minutes_between_retries = None
-    if retry_deco:
-        minutes_between_retries = int(
-            retry_deco[0].attributes.get("minutes_between_retries", 2)
-        )
-    if retry_count:
-        ctx.obj.echo_always(
-            "Sleeping %d minutes before the next retry" % minutes_between_retries
-        )
-        time.sleep(minutes_between_retries * 60)
-        
-    step_cli = "{entrypoint} {top_args} step {step} {step_args}".format(
-        entrypoint="%s -u %s" % (executable, os.path.basename(sys.argv[0])),
-        top_args=" ".join(util.dict_to_cli_options(ctx.parent.parent.params)),
-        step=step_name,
-        step_args=" ".join(util.dict_to_cli_options(kwargs)),
-    )
+    wait_before_retry(node, retry_count, ctx.obj.echo_always)
 
-    # Set log tailing.
-    ds = ctx.obj.flow_datastore.get_task_datastore(
-        mode="w",
-        run_id=kwargs["run_id"],
+    step_cli = get_step_cli(executable, ctx.parent.parent.params, step_name, kwargs)
+
+    exit_code = run_task(
+        flow_name=ctx.obj.flow.name,
+        flow_datastore=ctx.obj.flow_datastore,
+        metadata=ctx.obj.metadata,
+        environment=ctx.obj.environment,
+        monitor=ctx.obj.monitor,
         step_name=step_name,
+        run_id=kwargs["run_id"],
         task_id=kwargs["task_id"],
-        attempt=int(retry_count),
+        retry_count=retry_count,
+        step_cli=step_cli,
+        env=env,
+        echo=echo,
+        code_package_sha=code_package_sha,
+        code_package_url=code_package_url,
+        run_time_limit=run_time_limit,
+        namespace=nuv_namespace,
+        action=action,
+        memory=memory,
+        timeout=timeout,
+        kind=kind,
+        image=image,
+        packages=json.loads(packages) if packages else None,
+        api_access=api_access,
+        cache_key=cache_key,
+        expected_duration=expected_duration,
     )
-
-    stdout_location = ds.get_log_location(TASK_LOG_SOURCE, "stdout")
-    stderr_location = ds.get_log_location(TASK_LOG_SOURCE, "stderr")
-
-    def _sync_metadata():
-        if ctx.obj.metadata.TYPE == "local":
-            sync_local_metadata_from_datastore(
-                DATASTORE_LOCAL_DIR,
-                ctx.obj.flow_datastore.get_task_datastore(
-                    kwargs["run_id"], step_name, kwargs["task_id"]
-                ),
-            )
-
-    try:
-        nuvolaris = Nuvolaris(
-            datastore=ctx.obj.flow_datastore,
-            metadata=ctx.obj.metadata,
-            environment=ctx.obj.environment,
-        )
-        # Configure and launch Nuvolaris action.
-        with ctx.obj.monitor.measure("metaflow.nuvolaris.launch_job"):
-            nuvolaris.launch_job(
-                flow_name=ctx.obj.flow.name,
-                run_id=kwargs["run_id"],
-                step_name=step_name,
-                task_id=kwargs["task_id"],
-                attempt=str(retry_count),
-                user=util.get_username(),
-                code_package_sha=code_package_sha,
-                code_package_url=code_package_url,
-                code_package_ds=ctx.obj.flow_datastore.TYPE,
-                step_cli=step_cli,
-                run_time_limit=run_time_limit,
-                namespace=nuv_namespace,
-                action=action,
-                memory=memory,
-                timeout=timeout,
-                env=env
-            )
-    except Exception as e:
-        traceback.print_exc(chain=False)
-        _sync_metadata()
-        sys.exit(METAFLOW_EXIT_DISALLOW_RETRY)
-    try:
-        nuvolaris.wait(stdout_location, stderr_location, echo=echo)        
-    except Exception:        
-        # don't retry abnormally terminated tasks
-        traceback.print_exc()
-        sys.exit(METAFLOW_EXIT_DISALLOW_RETRY)
-    finally:        
-        _sync_metadata()
+    if exit_code:
+        sys.exit(exit_code)
@@ -0,0 +1,194 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metaflow import util
+from metaflow.exception import METAFLOW_EXIT_DISALLOW_RETRY
+from metaflow.metaflow_config import NUVOLARIS_COORDINATOR, NUVOLARIS_COORDINATOR_THREADS
+
+# Stdlib only script standing for a task in the Metaflow runtime, see below
+WAITER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nuvolaris_waiter.py")
+
+
+def is_coordinator_enabled():
+    # the configuration may come from the environment as a string
+    return str(NUVOLARIS_COORDINATOR).lower() in ("1", "true", "yes")
+
+
+class _TaskChannel(object):
+    """Messages of a task (log lines, then its exit code) for its waiter, kept
+    until the waiter connects. The task is cancelled (stop is set) when its
+    waiter is gone or the coordinator is closed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._conn = None
+        self._finished = False
+        self.stop = threading.Event()
+
+    def _send(self, data):
+        try:
+            self._conn.sendall(data)
+        except OSError:
+            # the waiter is gone, e.g. killed by the runtime: nobody awaits the
+            # task anymore
+            self.stop.set()
+
+    def put(self, msg, last=False):
+        data = (json.dumps(msg) + "\n").encode("utf-8")
+        with self._lock:
+            self._finished = last
+            if self._conn is None:
+                self._pending.append(data)
+                return
+            self._send(data)
+            if last:
+                self._conn.close()
+
+    def attach(self, conn):
+        with self._lock:
+            self._conn = conn
+            for data in self._pending:
+                self._send(data)
+            self._pending = []
+            if self._finished:
+                conn.close()
+
+
+class NuvolarisCoordinator(object):
+    """Submits and monitors the Nuvolaris tasks of a run from the Metaflow
+    runtime process, with a thread per running task instead of a
+    `nuvolaris step` process importing Metaflow and the flow.
+
+    The Metaflow runtime still needs a process per task to follow: the task is
+    represented by a waiter (nuvolaris_waiter.py), which connects to the
+    coordinator through a unix socket, prints the task logs and exits with the
+    task exit code. It doesn't import anything but the standard library, so
+    --max-workers can be raised to hundreds of tasks on a laptop.
+    """
+
+    def __init__(self, max_threads):
+        self._dir = tempfile.mkdtemp(prefix="nuvolaris-coordinator-")
+        self.address = os.path.join(self._dir, "coordinator.sock")
+        self._channels = {}
+        # the channels of the tasks not finished yet, cancelled on close
+        self._running = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_threads, thread_name_prefix="nuvolaris-task"
+        )
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.address)
+        self._server.listen(128)
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, run_task):
+        """Runs run_task(echo, stop) in the thread pool, it must return the exit
+        code of the task, and return early once the stop event is set. Returns
+        the token the waiter of the task connects with.
+        """
+        token = uuid.uuid4().hex
+        channel = _TaskChannel()
+        with self._lock:
+            self._channels[token] = channel
+            self._running.add(channel)
+
+        def _echo(msg, stream="stderr", job_id=None):
+            msg = util.to_unicode(msg)
+            if job_id:
+                msg = "[%s] %s" % (job_id, msg)
+            channel.put({"stream": stream, "line": msg})
+
+        def _run():
+            try:
+                exit_code = run_task(_echo, channel.stop)
+            except Exception:
+                _echo(traceback.format_exc())
+                exit_code = METAFLOW_EXIT_DISALLOW_RETRY
+            finally:
+                with self._lock:
+                    self._running.discard(channel)
+            channel.put({"exit": exit_code}, last=True)
+
+        self._executor.submit(_run)
+        return token
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                # closed
+                return
+            try:
+                with conn.makefile("rb") as f:
+                    token = f.readline().strip().decode("utf-8")
+                with self._lock:
+                    channel = self._channels.pop(token, None)
+                if channel is None:
+                    conn.close()
+                else:
+                    channel.attach(conn)
+            except OSError:
+                conn.close()
+
+    def waiter_command(self, token):
+        return [sys.executable, "-S", WAITER_PATH, self.address, token]
+
+    def close(self):
+        # on a failure or an interruption of the run, the threads stop waiting
+        # for their tasks and the queued ones are never launched
+        with self._lock:
+            for channel in self._running:
+                channel.stop.set()
+        self._server.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def get_coordinator():
+    """Returns the coordinator of the runtime process, started on first use."""
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is None:
+            _coordinator = NuvolarisCoordinator(int(NUVOLARIS_COORDINATOR_THREADS))
+        return _coordinator
+
+
+def close_coordinator():
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is not None:
+            _coordinator.close()
+            _coordinator = None
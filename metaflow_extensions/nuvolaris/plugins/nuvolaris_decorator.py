@@ -19,6 +19,7 @@ import os
 import platform
 import sys
 import json
+import threading
 
 import requests
 
@@ -26,15 +27,54 @@ from metaflow import util
 from metaflow.decorators import StepDecorator
 from metaflow.exception import MetaflowException, NuvolarisException
 from metaflow.metadata import MetaDatum
-from metaflow.metadata.util import sync_local_metadata_to_datastore
 from metaflow.metaflow_config import (
     DATASTORE_LOCAL_DIR,
     NUVOLARIS_DEFAULT_NAMESPACE,
+    NUVOLARIS_PACKAGE_COMPRESSION,
+    NUVOLARIS_PACKAGE_FORMAT,
+    NUVOLARIS_LOG_RELAY_URL,
+    NUVOLARIS_PREWARM_HOLD_MS,
+    NUVOLARIS_SCRATCH_DIR,
+    NUVOLARIS_SCRATCH_MAX_SIZE,
+    NUVOLARIS_GATHER_THREADS,
+    NUVOLARIS_GATHER_BATCH_SIZE,
+    NUVOLARIS_PREFETCH_DIR,
+    NUVOLARIS_PIPELINE_THREADS,
+    NUVOLARIS_PIPELINE_MAX_PENDING,
+    NUVOLARIS_HEARTBEAT_INTERVAL,
+    NUVOLARIS_SPECULATION_QUANTILE,
+    NUVOLARIS_SPECULATION_MULTIPLIER,
+    NUVOLARIS_POLL_HISTORY,
     DATASTORE_SYSROOT_S3
 )
 from metaflow.plugins.timeout_decorator import get_run_time_limit_for_task
 from metaflow.sidecar import Sidecar
 
+from .nuvolaris_cache import lookup_cached_task, task_cache_key
+from .nuvolaris_coordinator import close_coordinator, get_coordinator, is_coordinator_enabled
+from .nuvolaris_metadata import get_metadata_manifest, sync_local_metadata_to_datastore
+from .nuvolaris_prewarm import PrewarmTrigger, prewarm_action
+from .nuvolaris_scratch import enable_scratch
+from .nuvolaris_pipeline import enable_pipelined_persist
+from .nuvolaris_heartbeat import HeartbeatSender, heartbeat_path
+from .nuvolaris_speculation import cancel_marker_path, get_step_tracker
+from .nuvolaris_plan import expected_duration, load_history
+from .nuvolaris_gather import gather_inputs, prefetch_inputs, step_artifact_names
+from .nuvolaris_task import get_step_cli, get_step_env, run_task, wait_before_retry
+from .nuvolaris_package import (
+    PACKAGE_FORMATS,
+    compress_package,
+    save_delta_package,
+    save_package,
+)
+from .openwhisk_client import (
+    ACTION_KINDS,
+    get_image_profiles,
+    get_pooled_action_name,
+    is_pooling_enabled,
+    resolve_action_image,
+)
+
 try:
     unicode
 except NameError:
@@ -48,7 +88,8 @@ class NuvolarisDecorator(StepDecorator):
     Parameters
     ----------
     action : str
-        Name of the action to be deployed as Nuvolaris OpenWhisk action    
+        Name of the action to be deployed as Nuvolaris OpenWhisk action. Not
+        required when the step uses a pooled action
     namespace : str
         Nuvolaris OpenWhisk namespace to use when launching action in Nuvolaris. If
         not specified, the value of `METAFLOW_NUVOLARIS_NAMESPACE` is used
@@ -57,6 +98,59 @@ class NuvolarisDecorator(StepDecorator):
        Nuvolaris OpenWhisk action timeout. Default to 60000 milliseconds
     memory : number
        Nuvolaris OpenWhisk action memory in megabytes. Default to 256 megabytes
+    kind : str
+       Nuvolaris OpenWhisk action launcher, either "go" (compiled at action creation)
+       or "python" (native python action, no compilation). Default to "go"
+    image : str
+       Runtime image profile, one of the `NUVOLARIS_METAFLOW_IMAGE_PROFILES`
+       keys (slim, ml, full), or a docker image reference. If not specified the
+       image of the OpenWhisk runtime kind is used
+    packages : Dict[str, str]
+       Packages to make available to the step, in the same form of @pypi
+       ({"name": "version"}). They are resolved once, cached in the datastore as a
+       dependency layer and extracted in the warm containers of the action
+    scratch : bool
+       Serve the artifacts from a cache directory of the action containers
+       (`NUVOLARIS_SCRATCH_DIR`), writing them through to the datastore in
+       background. Consecutive steps served by the same node (or sharing the
+       directory as a volume) skip the datastore round trip. Default to False
+    pool : bool
+       Run the step on a shared action keyed by memory, timeout, kind and image
+       instead of the named action, so that steps with the same resource shape,
+       of any flow, share the warm containers. If not specified the value of
+       `NUVOLARIS_ACTION_POOLING` is used
+    prewarm : int
+       Number of action containers to warm up when the foreach step preceding
+       this step starts, so that the first wave of its tasks doesn't hit cold
+       starts. Default to 0 (disabled)
+    cache : bool
+       The step is a pure function of its code and inputs: a task with the same
+       code package, step, foreach split and input artifacts as a previous
+       successful task clones its artifacts instead of invoking the action.
+       Default to False
+    gather : Union[bool, List[str]]
+       On a join step, load the artifacts of the inputs (all the public ones,
+       or the given names) before the step, in batched datastore requests run
+       concurrently, instead of one request per input and artifact as the step
+       reads them. Default to False
+    prefetch : bool
+       Download the input artifacts read by the step (the attributes in its
+       source) before it runs, concurrently, to a local directory of the
+       action (`NUVOLARIS_PREFETCH_DIR`) serving the step. Default to True
+    pipeline : bool
+       Upload the artifacts of the task while the next ones are pickled and
+       compressed, by a pool of `NUVOLARIS_PIPELINE_THREADS` threads, keeping at
+       most `NUVOLARIS_PIPELINE_MAX_PENDING` megabytes of packed artifacts in
+       memory. Default to False
+    speculate : bool
+       On a foreach step run by the coordinator (`NUVOLARIS_COORDINATOR`), launch
+       a duplicate of a task still running when most of its siblings have
+       finished, well past their median duration; the first attempt to finish
+       wins and the other one is cancelled. Default to False
+    api_access : bool
+       Send the credentials of the Nuvolaris API to the tasks of the step, which
+       invoke actions themselves with `nuvolaris_map` or `nuvolaris_reduce`.
+       Default to False
     """
 
     name = "nuvolaris"
@@ -64,11 +158,26 @@ class NuvolarisDecorator(StepDecorator):
         "action":None,
         "namespace": None,
         "timeout": 60000,
-        "memory": 256
+        "memory": 256,
+        "kind": "go",
+        "image": None,
+        "packages": {},
+        "scratch": False,
+        "pool": None,
+        "prewarm": 0,
+        "cache": False,
+        "gather": False,
+        "prefetch": True,
+        "pipeline": False,
+        "speculate": False,
+        "api_access": False,
     }
     package_url = None
     package_sha = None
     run_time_limit = None
+    # history of the flow, read once for all the steps by a background thread
+    poll_history = None
+    _poll_history_thread = None
 
     def __init__(self, attributes=None, statically_defined=False):
         super(NuvolarisDecorator, self).__init__(attributes, statically_defined)
@@ -81,9 +190,11 @@ class NuvolarisDecorator(StepDecorator):
                 "The *@nuvolaris* decorator requires --datastore=s3 or --datastore=azure at the moment."
         )
 
-        if not self.attributes["action"]:
+        self.attributes["pool"] = is_pooling_enabled(self.attributes["pool"])
+        if not self.attributes["action"] and not self.attributes["pool"]:
             raise NuvolarisException(
-                "Step *{step}* marked for execution on Nuvolaris requires an action name".format(step=step)
+                "Step *{step}* marked for execution on Nuvolaris requires an action name "
+                "or a pooled action (pool=True)".format(step=step)
             )
 
         if not self.attributes["namespace"]:
@@ -95,6 +206,51 @@ class NuvolarisDecorator(StepDecorator):
         if not self.attributes["memory"]:
             self.attributes["memory"] = defaults["memory"]                         
 
+        if not self.attributes["kind"]:
+            self.attributes["kind"] = self.defaults["kind"]
+
+        if self.attributes["kind"] not in ACTION_KINDS:
+            raise NuvolarisException(
+                "Step *{step}* has an unsupported action kind *{kind}*, use one of {kinds}".format(
+                    step=step, kind=self.attributes["kind"], kinds=", ".join(ACTION_KINDS)
+                )
+            )
+
+        if (
+            self.attributes["kind"] != "go"
+            and self.attributes["image"] in get_image_profiles()
+        ):
+            raise NuvolarisException(
+                "Step *{step}* uses the image profile *{image}* which is available for the go "
+                "launcher only, specify an image reference for kind *{kind}*".format(
+                    step=step, image=self.attributes["image"], kind=self.attributes["kind"]
+                )
+            )
+
+        if not isinstance(self.attributes["packages"], dict):
+            raise NuvolarisException(
+                "Step *{step}* packages should be a dictionary of package names and versions".format(step=step)
+            )
+
+        gather = self.attributes["gather"]
+        if not isinstance(gather, (bool, list, tuple)) or (
+            not isinstance(gather, bool) and not all(isinstance(n, str) for n in gather)
+        ):
+            raise NuvolarisException(
+                "Step *{step}* gather should be True or a list of artifact names".format(step=step)
+            )
+        if gather and graph[step].type != "join":
+            raise NuvolarisException(
+                "Step *{step}* is not a join step, gather applies to join steps only".format(step=step)
+            )
+
+        if NUVOLARIS_PACKAGE_FORMAT not in PACKAGE_FORMATS:
+            raise NuvolarisException(
+                "Unsupported code package format *{format}*, use one of {formats}".format(
+                    format=NUVOLARIS_PACKAGE_FORMAT, formats=", ".join(PACKAGE_FORMATS)
+                )
+            )
+
         # Set internal state.
         self.logger = logger
         self.environment = environment
@@ -121,7 +277,15 @@ class NuvolarisDecorator(StepDecorator):
                 "execution on Nuvolaris.".format(step=step)
             )
         
-        self.action = self.attributes["action"]
+        if self.attributes["pool"]:
+            self.action = get_pooled_action_name(
+                self.attributes["memory"],
+                self.attributes["timeout"],
+                self.attributes["kind"],
+                self.attributes["image"],
+            )
+        else:
+            self.action = self.attributes["action"]
 
     def package_init(self, flow, step_name, environment):
         # TODO if required to import some libraries
@@ -134,6 +298,51 @@ class NuvolarisDecorator(StepDecorator):
         self.package = package
         self.run_id = run_id
 
+        if self.attributes["speculate"]:
+            if not is_coordinator_enabled():
+                raise NuvolarisException(
+                    "Step *{step}* uses speculate=True, which requires the task "
+                    "coordinator (NUVOLARIS_COORDINATOR=true)".format(step=self.step)
+                )
+            if not any(graph[p].type == "foreach" for p in graph[self.step].in_funcs):
+                raise NuvolarisException(
+                    "Step *{step}* uses speculate=True, which applies to the steps "
+                    "of a foreach only".format(step=self.step)
+                )
+            if int(NUVOLARIS_HEARTBEAT_INTERVAL) <= 0:
+                raise NuvolarisException(
+                    "Step *{step}* uses speculate=True, which requires the task "
+                    "heartbeat (NUVOLARIS_HEARTBEAT_INTERVAL > 0) to cancel the "
+                    "losing attempt".format(step=self.step)
+                )
+            self._num_splits = {}
+
+        # The activations of the step are polled around the end expected from
+        # its history, read while the run goes on
+        if int(NUVOLARIS_POLL_HISTORY) > 0:
+            self._start_poll_history(flow.name)
+
+        # Tasks of a foreach start together, warm up the containers of the
+        # action while the foreach step is still running.
+        if int(self.attributes["prewarm"]) > 0:
+            for parent in graph[self.step].in_funcs:
+                if graph[parent].type == "foreach":
+                    getattr(flow, parent).decorators.append(
+                        PrewarmTrigger(self._prewarm)
+                    )
+
+    def _prewarm(self):
+        prewarm_action(
+            self.action,
+            self.attributes["namespace"],
+            self.attributes["memory"],
+            self.attributes["timeout"],
+            self.attributes["kind"],
+            resolve_action_image(self.attributes["image"]),
+            int(self.attributes["prewarm"]),
+            int(NUVOLARIS_PREWARM_HOLD_MS),
+        )
+
     def runtime_task_created(
         self, task_datastore, task_id, split_index, input_paths, is_cloned, ubf_context
     ):
@@ -150,6 +359,29 @@ class NuvolarisDecorator(StepDecorator):
             # After all attempts to run the user code have failed, we don't need
             # to execute on Nuvolaris anymore. We can execute possible fallback
             # code locally.
+            cache_key = None
+            if self.attributes["cache"]:
+                cache_key = task_cache_key(
+                    self.flow_datastore,
+                    self.package_sha,
+                    self.step,
+                    cli_args.task.input_paths,
+                    cli_args.task.split_index,
+                    self._cache_environment(),
+                )
+                origin = lookup_cached_task(self.flow_datastore, cache_key)
+                if origin:
+                    # Same as a cloned task of a resumed run (see Worker._launch),
+                    # the step runs locally only to clone the origin artifacts.
+                    cli_args.command_options["clone-only"] = origin
+                    cli_args.top_level_options["event-logger"] = "nullSidecarLogger"
+                    cli_args.top_level_options["monitor"] = "nullSidecarMonitor"
+                    return
+
+            if is_coordinator_enabled():
+                self._submit_to_coordinator(cli_args, retry_count, cache_key)
+                return
+
             cli_args.commands = ["nuvolaris", "step"]
             cli_args.command_args.append(self.package_sha)
             cli_args.command_args.append(self.package_url)        
@@ -158,15 +390,112 @@ class NuvolarisDecorator(StepDecorator):
             for k, v in self.attributes.items():
                 if k == "namespace":
                     cli_args.command_options["nuv_namespace"] = v
+                elif k in ("packages", "gather"):
+                    cli_args.command_options[k] = json.dumps(v) if v else None
                 else:
                     cli_args.command_options[k] = v
 
+            cli_args.command_options["cache-key"] = cache_key
             cli_args.command_options["run-time-limit"] = self.run_time_limit        
             cli_args.command_options["action"] = self.action
             cli_args.command_options["memory"] = self.attributes["memory"]
             cli_args.command_options["timeout"] = self.attributes["timeout"]           
+            cli_args.command_options["expected-duration"] = self._expected_duration()
             cli_args.entrypoint[0] = sys.executable
 
+    def _cache_environment(self):
+        # what the result of the step depends on besides its code and inputs
+        env_vars = {}
+        for deco in getattr(self.flow, self.step).decorators:
+            if deco.name == "environment":
+                env_vars.update(deco.attributes.get("vars") or {})
+        return {
+            "packages": self.attributes["packages"] or {},
+            "image": resolve_action_image(self.attributes["image"]),
+            "kind": self.attributes["kind"],
+            "env": {k: str(v) for k, v in env_vars.items()},
+        }
+
+    def _submit_to_coordinator(self, cli_args, retry_count, cache_key):
+        # Same as `nuvolaris step`, but run by a thread of the runtime process:
+        # the task process is replaced by a waiter of the coordinator.
+        task = cli_args.task
+        node = self.graph[self.step]
+        step_options = dict(cli_args.command_options)
+        step_options.pop("ubf-context", None)
+        env, step_options["input-paths"] = get_step_env(
+            node, step_options.get("input-paths")
+        )
+        step_cli = get_step_cli(
+            task.environment.executable(self.step),
+            cli_args.top_level_options,
+            self.step,
+            step_options,
+        )
+
+        speculation = None
+        if self.attributes["speculate"] and task.split_index is not None:
+            speculation = dict(
+                tracker=get_step_tracker(
+                    step_options["run-id"],
+                    self.step,
+                    self._get_num_splits(task.input_paths[0]),
+                ),
+                quantile=float(NUVOLARIS_SPECULATION_QUANTILE),
+                multiplier=float(NUVOLARIS_SPECULATION_MULTIPLIER),
+            )
+
+        def _run_task(echo, stop):
+            wait_before_retry(node, retry_count, echo, stop)
+            return run_task(
+                flow_name=self.flow.name,
+                flow_datastore=self.flow_datastore,
+                metadata=task.metadata,
+                environment=task.environment,
+                monitor=task.monitor,
+                step_name=self.step,
+                run_id=step_options["run-id"],
+                task_id=step_options["task-id"],
+                retry_count=retry_count,
+                step_cli=step_cli,
+                env=env,
+                echo=echo,
+                code_package_sha=self.package_sha,
+                code_package_url=self.package_url,
+                run_time_limit=self.run_time_limit,
+                namespace=self.attributes["namespace"],
+                action=self.action,
+                memory=self.attributes["memory"],
+                timeout=self.attributes["timeout"],
+                kind=self.attributes["kind"],
+                image=self.attributes["image"],
+                packages=self.attributes["packages"] or None,
+                api_access=self.attributes["api_access"],
+                cache_key=cache_key,
+                speculation=speculation,
+                expected_duration=self._expected_duration(),
+                stop=stop,
+            )
+
+        coordinator = get_coordinator()
+        token = coordinator.submit(_run_task)
+        cli_args.entrypoint = coordinator.waiter_command(token)
+        cli_args.top_level_options = {}
+        cli_args.commands = []
+        cli_args.command_args = []
+        cli_args.command_options = {}
+
+    def _get_num_splits(self, input_path):
+        # tasks of the same foreach share the parent task
+        if input_path not in self._num_splits:
+            run_id, step_name, task_id = input_path.split("/")
+            parent = self.flow_datastore.get_task_datastore(run_id, step_name, task_id)
+            self._num_splits[input_path] = parent["_foreach_num_splits"]
+        return self._num_splits[input_path]
+
+    def runtime_finished(self, exception):
+        close_coordinator()
+
     def task_pre_step(
         self,
         step_name,
@@ -183,6 +512,10 @@ class NuvolarisDecorator(StepDecorator):
     ):
         self.metadata = metadata
         self.task_datastore = task_datastore
+        self._scratch = None
+        self._prefetch = None
+        self._pipeline = None
+        self._task_ids = (run_id, step_name, task_id, retry_count)
 
         if "METAFLOW_RUNTIME_ENVIRONMENT" in os.environ and os.environ["METAFLOW_RUNTIME_ENVIRONMENT"] == "nuvolaris":
             meta = {}
@@ -194,8 +527,70 @@ class NuvolarisDecorator(StepDecorator):
             # Register book-keeping metadata for debugging.
             metadata.register_metadata(run_id, step_name, task_id, entries)
 
-            # Start MFLog sidecar to collect task logs.
-            self._save_logs_sidecar = Sidecar("save_logs_periodically")
+            # Beats until the process exits, the client declares the task lost
+            # when they stop (see nuvolaris_heartbeat.py).
+            if int(NUVOLARIS_HEARTBEAT_INTERVAL) > 0:
+                storage = task_datastore._storage_impl
+                cancel_path = None
+                if self.attributes["speculate"]:
+                    cancel_path = cancel_marker_path(
+                        storage, flow.name, run_id, step_name, task_id, retry_count
+                    )
+                HeartbeatSender(
+                    storage,
+                    heartbeat_path(
+                        storage, flow.name, run_id, step_name, task_id, retry_count
+                    ),
+                    int(NUVOLARIS_HEARTBEAT_INTERVAL),
+                    cancel_path,
+                ).start()
+
+            if self.attributes["scratch"]:
+                self._scratch = enable_scratch(
+                    task_datastore, NUVOLARIS_SCRATCH_DIR, int(NUVOLARIS_SCRATCH_MAX_SIZE)
+                )
+                self._flush_before_done(task_datastore)
+
+            if self.attributes["pipeline"]:
+                # in front of the scratch storage, if any, whose writes it pipelines
+                self._pipeline = enable_pipelined_persist(
+                    task_datastore,
+                    int(NUVOLARIS_PIPELINE_THREADS),
+                    int(NUVOLARIS_PIPELINE_MAX_PENDING),
+                )
+                self._flush_before_done(task_datastore)
+
+            if self.attributes["gather"]:
+                # after the scratch storage, which then serves the gathered artifacts too
+                gather_inputs(
+                    task_datastore._ca_store,
+                    inputs,
+                    self.attributes["gather"],
+                    int(NUVOLARIS_GATHER_THREADS),
+                    int(NUVOLARIS_GATHER_BATCH_SIZE),
+                )
+            elif self.attributes["prefetch"] and inputs:
+                names = step_artifact_names(getattr(flow, step_name))
+                if names:
+                    try:
+                        self._prefetch = prefetch_inputs(
+                            task_datastore._ca_store,
+                            inputs,
+                            names,
+                            NUVOLARIS_PREFETCH_DIR,
+                            int(NUVOLARIS_GATHER_THREADS),
+                            int(NUVOLARIS_GATHER_BATCH_SIZE),
+                        )
+                    except Exception as e:
+                        # the step loads the artifacts itself
+                        print("Unable to prefetch the input artifacts: %s" % e)
+
+            # Start MFLog sidecar to collect task logs. With a relay the logs
+            # are pushed live, the datastore copy is saved at the end of the task.
+            if NUVOLARIS_LOG_RELAY_URL:
+                self._save_logs_sidecar = Sidecar("nuvolaris_push_logs")
+            else:
+                self._save_logs_sidecar = Sidecar("save_logs_periodically")
             self._save_logs_sidecar.start()
 
     def task_finished(
@@ -204,16 +599,19 @@ class NuvolarisDecorator(StepDecorator):
         # task_finished may run locally if fallback is activated for @catch
         # decorator.
         if "METAFLOW_RUNTIME_ENVIRONMENT" in os.environ and os.environ["METAFLOW_RUNTIME_ENVIRONMENT"] == "nuvolaris":
+            if self._prefetch is not None:
+                self._prefetch.close()
+
             # If `local` metadata is configured, we would need to copy task
             # execution metadata from the AWS Batch container to user's
             # local file system after the user code has finished execution.
             # This happens via datastore as a communication bridge.
             if self.metadata.TYPE == "local":
                 # Note that the datastore is *always* Amazon S3 (see
-                # runtime_task_created function).
-                
+                # runtime_task_created function). Only the metadata files the
+                # client doesn't have yet are sent back.
                 sync_local_metadata_to_datastore(
-                    DATASTORE_LOCAL_DIR, self.task_datastore
+                    DATASTORE_LOCAL_DIR, self.task_datastore, get_metadata_manifest()
                 )
         
         try:
@@ -222,9 +620,79 @@ class NuvolarisDecorator(StepDecorator):
             # Best effort kill
             pass
 
+    def _flush_before_done(self, task_datastore):
+        # The artifacts uploaded in background must be in the datastore before
+        # the attempt is marked done (task_finished runs after that): a failed
+        # upload raises from done() and fails the attempt.
+        if getattr(task_datastore.done, "flushes_uploads", False):
+            return
+        done = task_datastore.done
+
+        def _done():
+            # the pipeline writes through the scratch storage, if any
+            if self._pipeline is not None:
+                self._pipeline.flush()
+                self._register_pipeline_stats()
+            if self._scratch is not None:
+                self._scratch.flush()
+            done()
+
+        _done.flushes_uploads = True
+        task_datastore.done = _done
+
+    def _register_pipeline_stats(self):
+        # Book-keeping metadata to compare the persist of artifact heavy steps
+        # with and without the pipeline; best effort as it is not needed by the task.
+        try:
+            import resource
+
+            run_id, step_name, task_id, retry_count = self._task_ids
+            stats = dict(self._pipeline.stats)
+            # kilobytes on linux
+            stats["max-rss-kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            entries = [
+                MetaDatum(
+                    field="nuvolaris-persist-%s" % k,
+                    value=str(v),
+                    type="nuvolaris-persist-%s" % k,
+                    tags=["attempt_id:%s" % retry_count],
+                )
+                for k, v in stats.items()
+            ]
+            self.metadata.register_metadata(run_id, step_name, task_id, entries)
+        except:
+            pass
+
+    @classmethod
+    def _start_poll_history(cls, flow_name):
+        # Reading the metadata of the past runs may take long on wide flows, the
+        # tasks are never delayed for it: they are launched without an expected
+        # duration until the history is there.
+        if cls._poll_history_thread is not None:
+            return
+
+        def _load():
+            try:
+                cls.poll_history = load_history(flow_name, int(NUVOLARIS_POLL_HISTORY))
+            except Exception:
+                cls.poll_history = []
+
+        cls._poll_history_thread = threading.Thread(target=_load, daemon=True)
+        cls._poll_history_thread.start()
+
+    def _expected_duration(self):
+        if not self.poll_history:
+            return None
+        return expected_duration(self.poll_history, self.step)
+
     @classmethod
     def _save_package_once(cls, flow_datastore, package):
-        if cls.package_url is None:
-            cls.package_url, cls.package_sha = flow_datastore.save_data(
-                [package.blob], len_hint=1
-            )[0]
+        if cls.package_url is None and NUVOLARIS_PACKAGE_FORMAT == "delta":
+            cls.package_url, cls.package_sha = save_delta_package(
+                flow_datastore, package.blob
+            )
+        elif cls.package_url is None:
+            cls.package_url, cls.package_sha = save_package(
+                flow_datastore,
+                compress_package(package.blob, NUVOLARIS_PACKAGE_COMPRESSION),
+            )
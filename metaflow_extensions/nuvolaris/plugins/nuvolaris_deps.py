@@ -0,0 +1,119 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tarfile
+from io import BytesIO
+
+# This script is executed inside the Nuvolaris action after the code package
+# has been extracted, so it can rely on Metaflow itself but it shouldn't have
+# other external dependencies (e.g. no click for parsing CLI args).
+from metaflow.datastore import DATASTORES
+from metaflow.metaflow_config import DATASTORE_SYSROOT_S3, DATASTORE_SYSROOT_AZURE
+
+# Requirements of the step, set by Nuvolaris.create_job from @nuvolaris(packages=...)
+PACKAGES_ENV_VAR = "NUVOLARIS_STEP_PACKAGES"
+# Extracted layers survive across activations served by the same warm container
+DEPS_CACHE_DIR = "/tmp/nuvolaris/deps"
+
+
+def get_deps_layer_root(datastore_type):
+    if datastore_type == "s3":
+        root = DATASTORE_SYSROOT_S3
+    elif datastore_type == "azure":
+        root = DATASTORE_SYSROOT_AZURE
+    else:
+        raise NotImplementedError(
+            "Dependency layers are not supported for datastore %s" % datastore_type
+        )
+    return DATASTORES[datastore_type].path_join(root, "nuvolaris", "deps")
+
+
+def layer_key(packages):
+    """Content address of a dependency layer: the same requirements resolved for
+    the same interpreter and platform always map to the same layer.
+    """
+    spec = {
+        "packages": sorted(packages.items()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def requirements(packages):
+    return [
+        "%s==%s" % (name, version) if version else name
+        for name, version in sorted(packages.items())
+    ]
+
+
+def ensure_layer(packages, datastore_type, cache_dir=DEPS_CACHE_DIR):
+    """Returns a local directory containing the given packages, ready to be
+    added to PYTHONPATH. The layer is looked up in the warm container cache first,
+    then in the datastore and, only when missing everywhere, resolved with pip and
+    uploaded as a tarball for the next activations.
+    """
+    key = layer_key(packages)
+    layer_dir = os.path.join(cache_dir, key)
+    if os.path.isdir(layer_dir):
+        return layer_dir
+
+    tmp_dir = "%s.tmp" % layer_dir
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    storage = DATASTORES[datastore_type](get_deps_layer_root(datastore_type))
+    tarball_path = "%s.tgz" % key
+    if storage.is_file([tarball_path])[0]:
+        with storage.load_bytes([tarball_path]) as loaded:
+            for _, path, _ in loaded:
+                with tarfile.open(path, mode="r:gz") as tar:
+                    tar.extractall(tmp_dir)
+    else:
+        subprocess.check_call(
+            [sys.executable, "-m", "pip", "install", "--quiet", "--no-cache-dir"]
+            + ["--target", tmp_dir]
+            + requirements(packages),
+            stdout=sys.stderr,
+        )
+        buf = BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz", compresslevel=3) as tar:
+            tar.add(tmp_dir, arcname=".")
+        buf.seek(0)
+        # Concurrent activations may race to upload the same layer, which is
+        # harmless as the content is the same.
+        storage.save_bytes([(tarball_path, buf)], overwrite=False, len_hint=1)
+
+    # only a completely extracted layer is visible to the next activations
+    os.rename(tmp_dir, layer_dir)
+    return layer_dir
+
+
+if __name__ == "__main__":
+    layer = ensure_layer(
+        json.loads(os.environ[PACKAGES_ENV_VAR]),
+        os.environ.get("METAFLOW_DEFAULT_DATASTORE", "s3"),
+    )
+    # the layer path is the only output, it is captured by the bootstrap command
+    print(layer)
@@ -38,7 +38,15 @@ class NuvolarisEnvironment(object):
             )
 
     # Custom implementation to skip the environment setup as we use an ad-hoc runtime
-    def get_package_commands(self, code_package_url, datastore_type):
+    def get_package_commands(
+        self, code_package_url, datastore_type, compression="gzip", package_format="tar"
+    ):
+        if package_format == "delta":
+            download_cmd = self._get_fetch_delta_package_cmd(code_package_url)
+        else:
+            download_cmd = self._get_download_code_package_cmd(
+                code_package_url, datastore_type
+            )
         cmds = [
             BASH_MFLOG,
             "if [ -d .logs ]; then cd .logs; rm -Rf *; cd ..; fi",
@@ -49,7 +57,7 @@ class NuvolarisEnvironment(object):
             "mkdir .metaflow",  # mute local datastore creation log
             "i=0; while [ $i -le 5 ]; do "
             "mflog 'Downloading code package...'; "
-            + self._get_download_code_package_cmd(code_package_url, datastore_type)
+            + download_cmd
             + " && mflog 'Code package downloaded.' && break; "
             "sleep 10; i=$((i+1)); "
             "done",
@@ -57,11 +65,99 @@ class NuvolarisEnvironment(object):
             "mflog 'Failed to download code package from %s "
             "after 6 tries. Exiting...' && exit 1; "
             "fi" % code_package_url,
-            "TAR_OPTIONS='--warning=no-timestamp' tar xf job.tar",
-            "mflog 'Task is starting.'"
         ]
+        if package_format != "delta":
+            cmds.append(self._get_extract_code_package_cmd(compression))
+        cmds.append("mflog 'Task is starting.'")
         return cmds
 
+    def _get_extract_code_package_cmd(self, compression):
+        if compression == "zstd":
+            # not every tar in the runtime images supports --zstd
+            return "zstd -qdc job.tar | TAR_OPTIONS='--warning=no-timestamp' tar xf -"
+        # gzip and xz are detected by tar itself
+        return "TAR_OPTIONS='--warning=no-timestamp' tar xf job.tar"
+
+    def _get_fetch_delta_package_cmd(self, code_package_url):
+        """Return a command assembling a delta code package (see nuvolaris_package) in the
+        current directory, reusing the chunks cached by previous activations of the container.
+        """
+        return "%s /lib/fetch_package.py %s" % (self._python(), code_package_url)
+
+    def get_fetch_package_commands(
+        self, code_package_url, datastore_type, compression="gzip", package_format="tar"
+    ):
+        """Return the commands fetching the code package in the current directory, without
+        the task environment setup and logging of get_package_commands (see nuvolaris_map).
+        """
+        if package_format == "delta":
+            return [self._get_fetch_delta_package_cmd(code_package_url)]
+        return [
+            self._get_download_code_package_cmd(code_package_url, datastore_type),
+            self._get_extract_code_package_cmd(compression),
+        ]
+
+    def get_deps_commands(self):
+        """Return the commands making the per step dependency layer (see nuvolaris_deps)
+        importable. They must run after the code package has been extracted.
+        """
+        return [
+            "mflog 'Setting up step dependencies.'",
+            "NUVOLARIS_DEPS=$(%s -m metaflow_extensions.nuvolaris.plugins.nuvolaris_deps)"
+            % self._python(),
+            "export PYTHONPATH=$NUVOLARIS_DEPS${PYTHONPATH:+:$PYTHONPATH}",
+        ]
+
+    def get_package_phases(
+        self, code_package_url, compression="gzip", package_format="tar"
+    ):
+        """Launcher spec counterpart of get_package_commands: the directories are
+        prepared by the launcher itself and the package is fetched and extracted by
+        a single process, retried by the launcher.
+        """
+        if package_format == "delta":
+            fetch_argv = [self._python(), "/lib/fetch_package.py", code_package_url]
+        else:
+            fetch_argv = [
+                self._python(),
+                "/lib/fetch_package.py",
+                "--tar",
+                compression,
+                code_package_url,
+            ]
+        return [
+            {
+                "name": "setup",
+                "rmtree": [".logs", "metaflow"],
+                # mute local datastore creation log
+                "mkdir": [".logs", "metaflow/.metaflow"],
+                "log": "Setting up task environment.",
+                "chdir": "metaflow",
+            },
+            {
+                "name": "package",
+                "log": "Downloading code package...",
+                "argv": fetch_argv,
+                "retries": 5,
+                "retry_delay": 10,
+            },
+        ]
+
+    def get_deps_phases(self):
+        """Launcher spec counterpart of get_deps_commands."""
+        return [
+            {
+                "name": "deps",
+                "log": "Setting up step dependencies.",
+                "argv": [
+                    self._python(),
+                    "-m",
+                    "metaflow_extensions.nuvolaris.plugins.nuvolaris_deps",
+                ],
+                "prepend_stdout_to": "PYTHONPATH",
+            }
+        ]
+
     def _python(self):
             if R.use_r():
                 return "python3"
@@ -0,0 +1,180 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import ast
+import inspect
+import os
+import shutil
+import tempfile
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+
+from metaflow.datastore.content_addressed_store import BlobCache
+
+# Loading of the input artifacts of a @nuvolaris task before the step runs.
+# Metaflow loads the artifact of an input when the step reads it, one datastore
+# request per input and artifact; here the artifacts are loaded in batched
+# requests run by a thread pool and served from a blob cache of the content
+# addressed store. The gather of a join keeps them in memory, the prefetch of
+# the artifacts read by a step keeps them in a local directory.
+
+
+class GatherBlobCache(BlobCache):
+    """Blobs loaded by gather_inputs, in front of the blob cache already set on
+    the content addressed store (the foreach artifacts prefetched by Metaflow).
+    """
+
+    def __init__(self, preloaded, fallback=None):
+        self._preloaded = preloaded
+        self._fallback = fallback
+
+    def load_key(self, key):
+        blob = self._preloaded.get(key)
+        if blob is None and self._fallback is not None:
+            blob = self._fallback.load_key(key)
+        return blob
+
+    def store_key(self, key, blob):
+        if self._fallback is not None:
+            self._fallback.store_key(key, blob)
+
+
+class PrefetchBlobCache(BlobCache):
+    """Blobs loaded by prefetch_inputs, kept as files of a local directory so
+    that they don't take memory until the step reads them.
+    """
+
+    def __init__(self, cache_dir, fallback=None):
+        self.cache_dir = cache_dir
+        self._fallback = fallback
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load_key(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except (IOError, OSError):
+            pass
+        if self._fallback is not None:
+            return self._fallback.load_key(key)
+        return None
+
+    def store_key(self, key, blob):
+        tmp = "%s.tmp" % self._path(key)
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.rename(tmp, self._path(key))
+
+    def close(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+def gather_keys(inputs, names):
+    """Content keys of the artifacts of the input datastores, the public ones
+    when names is True. Artifacts shared by several inputs are loaded once.
+    """
+    keys = set()
+    for ds in inputs:
+        for name, key in ds.items():
+            if names is True:
+                if not name.startswith("_"):
+                    keys.add(key)
+            elif name in names:
+                keys.add(key)
+    return keys
+
+
+def _load_batches(ca_store, keys, consume, max_workers, batch_size):
+    # Each thread loads a batch of keys with a single storage request, the
+    # blobs are passed to consume as they are loaded.
+    keys = sorted(keys)
+    batches = [keys[i : i + batch_size] for i in range(0, len(keys), batch_size)]
+
+    def _load(batch):
+        for key, blob in ca_store.load_blobs(batch):
+            consume(key, blob)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as pool:
+        # consume the results to raise the exceptions of the threads
+        list(pool.map(_load, batches))
+
+
+def gather_inputs(ca_store, inputs, names=True, max_workers=16, batch_size=32):
+    """Loads the artifacts (by name, or the public ones when names is True) of the
+    input datastores of a join and sets them as blob cache of the content
+    addressed store, so that reading `inputs[i].x` in the step doesn't hit the
+    datastore. Returns the number of artifacts loaded.
+    """
+    keys = gather_keys(inputs, names)
+    if not keys:
+        return 0
+    preloaded = {}
+    _load_batches(ca_store, keys, preloaded.__setitem__, max_workers, batch_size)
+    ca_store.set_blob_cache(GatherBlobCache(preloaded, ca_store._blob_cache))
+    return len(preloaded)
+
+
+def step_artifact_names(step_func):
+    """Names of the attributes read by the step function (`self.x`, `input.x`,
+    `inputs.a.x`), a superset of the input artifacts it reads. Returns None if
+    the source of the step is not available.
+    """
+    try:
+        source = textwrap.dedent(inspect.getsource(step_func))
+        tree = ast.parse(source)
+    except (IOError, OSError, TypeError, SyntaxError):
+        return None
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Load):
+            names.add(node.attr)
+        elif (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "getattr"
+            and len(node.args) >= 2
+            and isinstance(node.args[1], ast.Constant)
+            and isinstance(node.args[1].value, str)
+        ):
+            names.add(node.args[1].value)
+    return names
+
+
+def prefetch_inputs(
+    ca_store, inputs, names, cache_dir, max_workers=16, batch_size=32
+):
+    """Downloads the given artifacts of the input datastores to a new directory
+    under cache_dir and sets it as blob cache of the content addressed store.
+    Returns the PrefetchBlobCache, to close when the task is finished, or None
+    if there is nothing to prefetch.
+    """
+    keys = gather_keys(inputs, names)
+    if not keys:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    cache = PrefetchBlobCache(
+        tempfile.mkdtemp(dir=cache_dir), ca_store._blob_cache
+    )
+    try:
+        _load_batches(ca_store, keys, cache.store_key, max_workers, batch_size)
+    except Exception:
+        cache.close()
+        raise
+    ca_store.set_blob_cache(cache)
+    return cache
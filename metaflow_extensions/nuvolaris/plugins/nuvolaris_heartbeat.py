@@ -0,0 +1,129 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+import os
+import sys
+import threading
+import time
+from io import BytesIO
+
+# Heartbeat of the tasks running on Nuvolaris. OpenWhisk records a killed
+# container (OOM, lost node) only when the action times out, so the task
+# periodically rewrites a small object of the datastore and the client declares
+# the task lost when the object stops changing. The beat is a counter, compared
+# across reads by the client, so the clocks of the two sides don't matter.
+
+
+def heartbeat_path(storage, flow_name, run_id, step_name, task_id, attempt):
+    return storage.path_join(
+        flow_name, str(run_id), step_name, str(task_id), "%s.nuvolaris_heartbeat" % attempt
+    )
+
+
+class HeartbeatSender(object):
+    """Daemon thread of the task writing a beat every interval seconds, until
+    the process exits. With a cancel_path, the process exits as soon as the
+    marker is found there (the task lost a speculative race).
+    """
+
+    def __init__(self, storage, path, interval, cancel_path=None):
+        self._storage = storage
+        self._path = path
+        self._interval = interval
+        self._cancel_path = cancel_path
+        self._beat = 0
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _loop(self):
+        while True:
+            self._beat += 1
+            data = json.dumps({"beat": self._beat, "ts": time.time()}).encode("utf-8")
+            try:
+                self._storage.save_bytes(
+                    [(self._path, BytesIO(data))], overwrite=True, len_hint=1
+                )
+            except Exception:
+                # a missed beat, the client tolerates a few of them
+                pass
+            if self._cancel_path and self._is_cancelled():
+                print("Task cancelled, another attempt finished first.", file=sys.stderr)
+                sys.stderr.flush()
+                os._exit(1)
+            time.sleep(self._interval)
+
+    def _is_cancelled(self):
+        try:
+            return self._storage.is_file([self._cancel_path])[0]
+        except Exception:
+            return False
+
+
+class HeartbeatMonitor(object):
+    """Client side of the heartbeat: `is_lost` reads the beat of the task at most
+    every interval seconds, and is True once the beat hasn't changed for
+    max_missed intervals, or no beat was seen within grace seconds from the
+    launch (cold start, code package and dependencies).
+    """
+
+    def __init__(self, storage, path, interval, max_missed, grace):
+        self._storage = storage
+        self._path = path
+        self._interval = interval
+        self._max_missed = max_missed
+        self._grace = grace
+        self._started = time.time()
+        self._beat = None
+        self._last_change = None
+        self._next_check = self._started
+        self.lost_reason = None
+
+    def _read_beat(self):
+        with self._storage.load_bytes([self._path]) as loaded:
+            for _, local_path, _ in loaded:
+                if local_path is None:
+                    return None
+                with open(local_path, "rb") as f:
+                    return json.load(f)["beat"]
+
+    def is_lost(self):
+        if self.lost_reason is not None:
+            return True
+        now = time.time()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self._interval
+        try:
+            beat = self._read_beat()
+        except Exception:
+            # the datastore is not reachable from the client, not the task
+            return False
+        if beat is not None and beat != self._beat:
+            self._beat = beat
+            self._last_change = now
+        elif self._last_change is None:
+            if now - self._started > self._grace:
+                self.lost_reason = "no heartbeat received in %d seconds" % self._grace
+        elif now - self._last_change > self._interval * self._max_missed:
+            self.lost_reason = "heartbeat missing for %d seconds" % (
+                now - self._last_change
+            )
+        return self.lost_reason is not None
@@ -16,62 +16,20 @@
 # under the License.
 #
 import json
-import math
 import os
-import random
 import sys
 import time
 import subprocess
 
 from metaflow.exception import MetaflowException
+from .openwhisk_client import resolve_action_image
+from .nuvolaris_poll import PollScheduler
 
 CLIENT_REFRESH_INTERVAL_SECONDS = 300
 
 class NuvolarisJobException(MetaflowException):
     headline = "Nuvolaris job error"
 
-class NuvolarisApiException(Exception):
-
-    def __init__(self, status, message="An error occurred interacting with Nuvolaris Ai"):
-        self.status = status
-        self.message = message
-        super().__init__(self.message)
-
-
-# Implements truncated exponential backoff from
-# https://cloud.google.com/storage/docs/retry-strategy#exponential-backoff
-def nuv_retry(deadline_seconds=86400, max_backoff=5):
-    def decorator(function):
-        from functools import wraps
-
-        @wraps(function)
-        def wrapper(*args, **kwargs):
-            deadline = time.time() + deadline_seconds
-            retry_number = 0
-
-            while True:
-                try:
-                    result = function(*args, **kwargs)
-                    return result
-                except NuvolarisApiException as e:
-                    if e.status == 404:
-                        current_t = time.time()
-                        backoff_delay = min(
-                            math.pow(2, retry_number) + random.random(), max_backoff
-                        )
-                        if current_t + backoff_delay < deadline:
-                            time.sleep(backoff_delay)
-                            retry_number += 1
-                            continue  # retry again
-                        else:
-                            raise
-                    else:
-                        raise
-
-        return wrapper
-
-    return decorator
-
 class NuvolarisJob(object):
     def __init__(self, client, **kwargs):
         self._client = client
@@ -80,30 +38,43 @@ class NuvolarisJob(object):
         self._namespace = self._kwargs["namespace"]
         self._timeout = self._kwargs["timeout"]
         self._memory = self._kwargs["memory"]
+        self._kind = self._kwargs.get("kind") or "go"
+        self._image = resolve_action_image(self._kwargs.get("image"))
+        # set by create(), an already deployed action can be executed directly
+        self._result = None
 
     def create(self):
         # Will deploy the function packages as openwhisk action
         client = self._client.get()
-        if client.should_deploy_action(self._action_name,self._namespace, self._memory, self._timeout):
-            self._result = client.deploy_action(self._action_name,self._namespace, self._memory, self._timeout)
+        if client.should_deploy_action(self._action_name,self._namespace, self._memory, self._timeout, self._kind, self._image):
+            self._result = client.deploy_action(self._action_name,self._namespace, self._memory, self._timeout, self._kind, self._image)
         else:
             print(f"action {self._action_name} already deployed, reusing it.")
             self._result = client.get_action_detail(self._action_name,self._namespace)
         return self
 
-    def execute(self):
-        # Call the ow action via the REST api in non blocking fashion
+    def execute(self, scheduler=None, blocking_wait=None):
+        # Call the ow action via the REST api in non blocking fashion, or blocking for at most
+        # blocking_wait seconds: a short task then completes without any poll, a longer one
+        # falls back to polling its activation
         client = self._client.get()
         result = self._result
         try:
-            result = client.execute_action(action_name=self._action_name, command=self._kwargs['command'], environment_variables=self._kwargs["environment_variables"], namespace=self._namespace)           
+            result = client.execute_action(action_name=self._action_name, command=self._kwargs['command'], environment_variables=self._kwargs["environment_variables"], namespace=self._namespace, spec=self._kwargs.get("spec"), blocking_wait=blocking_wait)
             response = json.loads(result.text)
 
+            activation = None
+            if blocking_wait and result.status_code != 202 and "response" in response:
+                # the activation completed within the wait bound (502 is an
+                # activation that failed, still with its record)
+                activation = response
             return RunningJob(
                 client=self._client,
                 name=self._action_name,
                 uid=response['activationId'],
-                namespace=self._namespace
+                namespace=self._namespace,
+                scheduler=scheduler,
+                activation=activation,
             )
         except Exception as e:
             raise NuvolarisJobException(
@@ -142,13 +113,21 @@ class NuvolarisJob(object):
         return self
 
 class RunningJob(object):
-    def __init__(self, client, name, uid, namespace):
+    def __init__(self, client, name, uid, namespace, scheduler=None, activation=None):
         self._client = client
         self._name = name
         self._id = uid
         self._namespace = namespace
-
-        self._job = self._fetch_job()
+        self._activation = None
+        # the activation is polled when the scheduler says so, not at every
+        # status check (see nuvolaris_poll.py)
+        self._scheduler = scheduler or PollScheduler()
+
+        if activation is not None:
+            # returned by a blocking invocation
+            self._job = self._job_from_activation(activation)
+        else:
+            self._job = {"mf_process_status": "running"}
 
         import atexit
 
@@ -165,23 +144,37 @@ class RunningJob(object):
             self.__class__.__name__, self._namespace, self._name
         )
 
-    @nuv_retry()
     def _fetch_job(self):
         # Get the activation detail with the complete status of the Action execution
         # The activation API returns a 404 if the activation it is still running
         # it returns onyl the activation_result['response']['result'], which is the direct response of the python function mapped to the action
+        # The status is polled without blocking, so that the logs can be tailed while the activation runs
         client = self._client.get()
-        print(f"checking completion of nuvolaris activation {self._id}")
+        start = time.time()
         try:
-            response = client.get_activation_detail(activation_id=self._id, namespace=self._namespace)                    
-            if (response.status_code == 404):
-                # 404 means that the activation is not yet finished, i.e the job is still running and OW does not returns any information
-                raise NuvolarisApiException(status=404, message="Activation is not completed yet")
-            else:
-                activation_result = json.loads(response.text)                
-                return activation_result['response']['result']
-        finally:
-            pass            
+            response = client.get_activation_detail(activation_id=self._id, namespace=self._namespace)
+        except Exception:
+            # the controller is not reachable, the job is still running as far as we know
+            self._scheduler.polled(time.time() - start, error=True)
+            return {"mf_process_status": "running"}
+        self._scheduler.polled(
+            time.time() - start, error=response.status_code not in (200, 404)
+        )
+        if (response.status_code == 404):
+            # 404 means that the activation is not yet finished, i.e the job is still running and OW does not returns any information
+            return {"mf_process_status": "running"}
+        if response.status_code != 200:
+            # an overloaded controller (429, 5xx), polled again later
+            return {"mf_process_status": "running"}
+        return self._job_from_activation(json.loads(response.text))
+
+    def _job_from_activation(self, activation_result):
+        self._activation = activation_result
+        result = activation_result['response']['result']
+        if "mf_process_status" not in result:
+            # the launcher didn't complete, e.g. the action exceeded its time limits
+            result = dict(result, mf_process_status="failed", mf_process_ret_code=None)
+        return result
 
     def kill(self):
         # TODO Verify it is possible to kill an OW actionm via the REST API
@@ -196,7 +189,7 @@ class RunningJob(object):
         def done():
             return self._job and self._job['mf_process_status'] and not "running" == self._job['mf_process_status']
 
-        if not done():
+        if not done() and self._scheduler.due():
             # If not done, fetch newer status
             self._job = self._fetch_job()
         if done():
@@ -204,6 +197,11 @@ class RunningJob(object):
         else:
             return False
 
+    @property
+    def next_poll_in(self):
+        # seconds to the next poll of the activation
+        return self._scheduler.next_poll_in()
+
     @property
     def status(self):
         if not self.is_done:
@@ -215,7 +213,12 @@ class RunningJob(object):
 
     @property
     def has_succeeded(self):
-        return self.is_done and self._job['mf_process_status'] == "success"
+        # launchers may report a command that exited nonzero as a "success"
+        return (
+            self.is_done
+            and self._job['mf_process_status'] == "success"
+            and not self._job.get('mf_process_ret_code')
+        )
 
     @property
     def has_failed(self):
@@ -229,6 +232,23 @@ class RunningJob(object):
     def is_waiting(self):
         return not self.is_done and not self.is_running
 
+    @property
+    def activation_stats(self):
+        # Timings recorded by OpenWhisk for the completed activation, useful to
+        # compare cold (initTime is present) and warm starts across action kinds
+        if not self._activation:
+            return None
+        stats = {"duration": self._activation.get("duration")}
+        # phases timed by the launcher spec
+        for phase in (self._job or {}).get("mf_phases", []):
+            stats["phase-%s" % phase["name"]] = phase["duration"]
+        for ann in self._activation.get("annotations", []):
+            if ann["key"] in ("initTime", "waitTime", "kind"):
+                stats[ann["key"]] = ann["value"]
+            elif ann["key"] == "limits":
+                stats["memory"] = ann["value"].get("memory")
+        return stats
+
     @property
     def reason(self):
         if self.is_done:            
@@ -0,0 +1,293 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import hmac
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests as req
+
+from metaflow.metaflow_config import NUVOLARIS_LOG_RELAY_TOKEN, NUVOLARIS_LOG_RELAY_URL
+from metaflow.sidecar import MessageTypes
+
+# Header carrying the offset of a log chunk in the mflog file it comes from
+OFFSET_HEADER = "X-Log-Offset"
+PUSH_INTERVAL_SECONDS = 1
+REQUEST_TIMEOUT_SECONDS = 5
+
+
+def relay_log_key(flow_name, run_id, step_name, task_id, attempt):
+    return "/".join([flow_name, str(run_id), step_name, str(task_id), str(attempt)])
+
+
+def _auth_headers(headers=None):
+    # the token shared by the relay, its clients and the actions
+    headers = dict(headers or {})
+    if NUVOLARIS_LOG_RELAY_TOKEN:
+        headers["Authorization"] = "Bearer %s" % NUVOLARIS_LOG_RELAY_TOKEN
+    return headers
+
+
+class _LogRelayHandler(BaseHTTPRequestHandler):
+    # Routes: /logs/<flow>/<run>/<step>/<task>/<attempt>/<stream>
+    #   POST   appends a chunk pushed by an action (idempotent, by offset)
+    #   GET    returns the bytes from ?offset=N on
+    #   DELETE drops the logs of the task, once the client has read them
+    # Every request must carry the token of the relay as a bearer token.
+
+    def _log_id(self):
+        path = self.path.split("?", 1)[0]
+        if not path.startswith("/logs/"):
+            return None
+        return path[len("/logs/") :].rstrip("/")
+
+    def _authorized(self):
+        expected = "Bearer %s" % self.server.token
+        return hmac.compare_digest(
+            self.headers.get("Authorization", "").encode(), expected.encode()
+        )
+
+    def _reply(self, code, body=b"", offset=None):
+        self.send_response(code)
+        if offset is not None:
+            self.send_header(OFFSET_HEADER, str(offset))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._reply(401)
+        log_id = self._log_id()
+        if log_id is None:
+            return self._reply(404)
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        offset = int(self.headers.get(OFFSET_HEADER, 0))
+        with self.server.lock:
+            log = self.server.logs.setdefault(log_id, bytearray())
+            if offset > len(log):
+                # a chunk went missing, the pusher resends from our length
+                return self._reply(409, offset=len(log))
+            log.extend(data[len(log) - offset :])
+            self.server.touch(log_id)
+            self._reply(200, offset=len(log))
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._reply(401)
+        log_id = self._log_id()
+        if log_id is None:
+            return self._reply(404)
+        offset = 0
+        if "?offset=" in self.path:
+            offset = int(self.path.rsplit("?offset=", 1)[1])
+        with self.server.lock:
+            log = self.server.logs.get(log_id, b"")
+            if log_id in self.server.logs:
+                self.server.touch(log_id)
+            self._reply(200, bytes(log[offset:]), offset=len(log))
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return self._reply(401)
+        log_id = self._log_id()
+        if log_id is None:
+            return self._reply(404)
+        with self.server.lock:
+            for stream_id in [
+                k for k in self.server.logs if k.startswith(log_id + "/")
+            ]:
+                self.server.drop(stream_id)
+        self._reply(200)
+
+    def log_message(self, format, *args):
+        # keep the relay quiet, it may serve many tasks
+        pass
+
+
+class LogRelayServer(ThreadingHTTPServer):
+    """In memory relay between the actions pushing the task logs and the
+    clients tailing them. Logs are dropped once read by the client, the durable
+    copy is still written to the datastore at the end of the task. The logs of
+    the clients that never read them back expire after ttl seconds without
+    reads or writes, and the least recently used ones are dropped beyond
+    max_size bytes: their client prints them from the datastore copy instead.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host, port, token, max_size, ttl):
+        super(LogRelayServer, self).__init__((host, port), _LogRelayHandler)
+        self.token = token
+        self.max_size = max_size
+        self.ttl = ttl
+        self.logs = {}
+        self.touched = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def touch(self, log_id):
+        # called with the lock held, after a read or a write of the log
+        now = time.time()
+        self.touched[log_id] = now
+        self.size = sum(len(log) for log in self.logs.values())
+        for stream_id, t in sorted(self.touched.items(), key=lambda e: e[1]):
+            if stream_id == log_id:
+                continue
+            if now - t <= self.ttl and self.size <= self.max_size:
+                break
+            self.drop(stream_id)
+
+    def drop(self, log_id):
+        self.size -= len(self.logs.pop(log_id, b""))
+        self.touched.pop(log_id, None)
+
+
+class RelayTail(object):
+    """Log tailer reading from the relay, a drop-in for the datastore tailers
+    of metaflow.mflog.get_log_tailer (complete lines only, as bytes).
+    """
+
+    def __init__(self, relay_url, log_key, stream):
+        self._url = "%s/logs/%s/%s" % (relay_url.rstrip("/"), log_key, stream)
+        self._pos = 0
+        self._tail = b""
+
+    @property
+    def bytes_read(self):
+        # bytes of the log already returned as complete lines
+        return self._pos - len(self._tail)
+
+    def __iter__(self):
+        resp = req.get(
+            self._url,
+            params={"offset": self._pos},
+            headers=_auth_headers(),
+            timeout=REQUEST_TIMEOUT_SECONDS,
+        )
+        if resp.status_code != 200 or not resp.content:
+            return
+        self._pos += len(resp.content)
+        lines = (self._tail + resp.content).split(b"\n")
+        self._tail = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+
+
+class CatchUpTail(object):
+    """Skips the first bytes of a log tailer. Used to print from the datastore
+    copy the lines that the relay missed (e.g. written after the push sidecar
+    stopped, or with an unreachable relay).
+    """
+
+    def __init__(self, tail, skip_bytes):
+        self._tail = tail
+        self._skip = skip_bytes
+
+    def __iter__(self):
+        for line in self._tail:
+            if self._skip >= len(line):
+                self._skip -= len(line)
+                continue
+            line, self._skip = line[self._skip :], 0
+            yield line
+
+
+def delete_relay_logs(relay_url, log_key):
+    try:
+        req.delete(
+            "%s/logs/%s" % (relay_url.rstrip("/"), log_key),
+            headers=_auth_headers(),
+            timeout=REQUEST_TIMEOUT_SECONDS,
+        )
+    except Exception:
+        pass
+
+
+class PushLogsSidecar(object):
+    """Action side of the relay, the live counterpart of the
+    save_logs_periodically sidecar: new bytes of the mflog files are pushed to
+    NUVOLARIS_LOG_RELAY_URL every PUSH_INTERVAL_SECONDS.
+    """
+
+    def __init__(self):
+        # these env vars are set by mflog.mflog_env
+        flow_name, run_id, step_name, task_id = os.environ["MF_PATHSPEC"].split("/")
+        log_key = relay_log_key(
+            flow_name, run_id, step_name, task_id, os.environ["MF_ATTEMPT"]
+        )
+        self._streams = [
+            (
+                "%s/logs/%s/%s" % (NUVOLARIS_LOG_RELAY_URL.rstrip("/"), log_key, stream),
+                os.environ[env_var],
+            )
+            for stream, env_var in (("stdout", "MFLOG_STDOUT"), ("stderr", "MFLOG_STDERR"))
+        ]
+        self._offsets = [0 for _ in self._streams]
+        self.is_alive = True
+        self._thread = threading.Thread(target=self._update_loop)
+        self._thread.start()
+
+    def process_message(self, msg):
+        if msg.msg_type == MessageTypes.SHUTDOWN:
+            self.is_alive = False
+
+    @classmethod
+    def get_worker(cls):
+        return cls
+
+    def _push(self, i):
+        url, path = self._streams[i]
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            f.seek(self._offsets[i])
+            data = f.read()
+        if not data:
+            return
+        resp = req.post(
+            url,
+            data=data,
+            headers=_auth_headers({OFFSET_HEADER: str(self._offsets[i])}),
+            timeout=REQUEST_TIMEOUT_SECONDS,
+        )
+        if resp.status_code in (200, 409):
+            self._offsets[i] = int(resp.headers[OFFSET_HEADER])
+
+    def _update_loop(self):
+        while True:
+            alive = self.is_alive
+            for i in range(len(self._streams)):
+                try:
+                    self._push(i)
+                except Exception:
+                    # the datastore copy saved at the end of the task is the
+                    # durable one, a missed push only delays the logs
+                    pass
+            if not alive:
+                break
+            time.sleep(PUSH_INTERVAL_SECONDS)
+
+
+def serve(host, port, token, max_size, ttl):
+    server = LogRelayServer(host, port, token, max_size, ttl)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
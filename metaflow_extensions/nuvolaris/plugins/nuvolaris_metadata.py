@@ -0,0 +1,93 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+import os
+import tarfile
+from io import BytesIO
+
+from metaflow.datastore.local_storage import LocalStorage
+from metaflow.metadata.util import sync_local_metadata_from_datastore
+
+# Set by the client with the metadata files it already holds for the task, the
+# action syncs back only the files missing from this manifest
+METADATA_MANIFEST_ENV_VAR = "NUVOLARIS_METADATA_MANIFEST"
+
+
+def local_metadata_manifest(metadata_local_root, flow_name, run_id, step_name, task_id):
+    """Returns the metadata files (relative to the local metadata root) known
+    locally for the flow, run, step and task a Nuvolaris task belongs to.
+    """
+    manifest = []
+    components = [flow_name, run_id, step_name, task_id]
+    for depth in range(1, len(components) + 1):
+        rel_dir = os.path.join(*(components[:depth] + [LocalStorage.METADATA_DIR]))
+        meta_dir = os.path.join(metadata_local_root, rel_dir)
+        if os.path.isdir(meta_dir):
+            manifest.extend(
+                os.path.join(rel_dir, f)
+                for f in os.listdir(meta_dir)
+                if os.path.isfile(os.path.join(meta_dir, f))
+            )
+    return manifest
+
+
+def sync_local_metadata_to_datastore(metadata_local_dir, task_ds, manifest=None):
+    """Incremental counterpart of metaflow.metadata.util.sync_local_metadata_to_datastore.
+
+    Only the files missing from the manifest are compressed in a single tarball,
+    which keeps the layout of the full one so it can be extracted by the standard
+    sync_local_metadata_from_datastore as well. Without a manifest all the files
+    are synced.
+    """
+    known = set(manifest or [])
+    buf = BytesIO()
+    with tarfile.open(mode="w:gz", fileobj=buf) as tar:
+        for root, _, files in os.walk(metadata_local_dir):
+            for f in files:
+                path = os.path.join(root, f)
+                if os.path.relpath(path, metadata_local_dir) not in known:
+                    tar.add(path)
+    blob = buf.getvalue()
+    _, key = task_ds.parent_datastore.save_data([blob], len_hint=1)[0]
+    task_ds._dangerous_save_metadata_post_done({"local_metadata": key})
+
+
+def get_metadata_manifest():
+    manifest = os.environ.get(METADATA_MANIFEST_ENV_VAR)
+    return json.loads(manifest) if manifest else None
+
+
+class LocalMetadataSync(object):
+    """Client side of the sync, pulling the task metadata at most once even when
+    both the failure and the completion paths of the task request it.
+    """
+
+    def __init__(self, metadata_local_dir, get_task_ds):
+        self._metadata_local_dir = metadata_local_dir
+        self._get_task_ds = get_task_ds
+        self._synced = False
+
+    def sync(self):
+        if self._synced:
+            return
+        self._synced = True
+        task_ds = self._get_task_ds()
+        if not task_ds.has_metadata("local_metadata"):
+            # the task didn't get to the end, nothing has been synced back
+            return
+        sync_local_metadata_from_datastore(self._metadata_local_dir, task_ds)
@@ -0,0 +1,155 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import gzip
+import json
+import lzma
+import tarfile
+from hashlib import sha1
+from io import BytesIO
+
+from metaflow.exception import NuvolarisException
+
+# Code package compressions understood by NuvolarisEnvironment.get_package_commands
+PACKAGE_COMPRESSIONS = ("gzip", "xz", "zstd")
+
+# Code package formats: a single tarball or a manifest of content defined chunks
+# assembled in the action by runtime/lib/fetch_package.py
+PACKAGE_FORMATS = ("tar", "delta")
+DELTA_MANIFEST_VERSION = 1
+
+# Content defined chunking parameters, files up to CHUNK_MAX_SIZE are a single chunk
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_AVG_SIZE = 64 * 1024
+CHUNK_MAX_SIZE = 256 * 1024
+
+# Gear hash table, derived from sha1 so that it is stable across processes
+_GEAR = [int.from_bytes(sha1(bytes([i])).digest()[:8], "big") for i in range(256)]
+_GEAR_MASK = (1 << 64) - 1
+
+
+def compress_package(blob, compression):
+    """Metaflow builds the code package as a gzip compressed tarball, this
+    returns it recompressed with the given algorithm.
+    """
+    if compression == "gzip":
+        return blob
+    tar = gzip.decompress(bytes(blob))
+    if compression == "xz":
+        return lzma.compress(tar, preset=6)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise NuvolarisException(
+                "The zstd code package compression requires the zstandard package, "
+                "install it with pip install zstandard"
+            )
+        return zstandard.ZstdCompressor(level=10).compress(tar)
+    raise NuvolarisException(
+        "Unsupported code package compression *%s*, use one of %s"
+        % (compression, ", ".join(PACKAGE_COMPRESSIONS))
+    )
+
+
+def save_package(flow_datastore, blob):
+    """Saves the code package in the content addressed store of the flow and
+    returns its (url, sha). The store skips the upload of a blob it already
+    holds, so an unchanged package is never uploaded again.
+    """
+    return flow_datastore.save_data([blob], len_hint=1)[0]
+
+
+def content_defined_chunks(data):
+    """Splits data at content defined boundaries (gear rolling hash), so that an
+    edit only changes the chunks around it and not every following one.
+
+    The hash is computed in pure python, at some 10-20 MB/s: large data files
+    shipped with the code slow down the packaging of every run, the tar format
+    suits such packages better.
+    """
+    if len(data) <= CHUNK_MAX_SIZE:
+        return [data]
+    chunks = []
+    boundary_mask = CHUNK_AVG_SIZE - 1
+    gear = _GEAR
+    gear_mask = _GEAR_MASK
+    start = 0
+    length = len(data)
+    while start < length:
+        end = min(start + CHUNK_MAX_SIZE, length)
+        h = 0
+        i = end
+        # the bytes before CHUNK_MIN_SIZE never make a boundary
+        for j, byte in enumerate(data[start + CHUNK_MIN_SIZE : end], start + CHUNK_MIN_SIZE):
+            h = ((h << 1) + gear[byte]) & gear_mask
+            if not h & boundary_mask:
+                i = j + 1
+                break
+        chunks.append(data[start:i])
+        start = i
+    return chunks
+
+
+def get_chunks_root(flow_datastore):
+    return flow_datastore._storage_impl.path_join(
+        flow_datastore.flow_name, "nuvolaris", "chunks"
+    )
+
+
+def save_delta_package(flow_datastore, blob):
+    """Saves the code package as a manifest of content addressed file chunks.
+
+    Chunks are keyed by the SHA of their content and stored gzip compressed;
+    only the chunks missing from the datastore are uploaded, so the upload
+    grows with the size of the change and not with the size of the package.
+    Returns the (url, sha) of the manifest.
+    """
+    storage = flow_datastore._storage_impl
+    chunks_root = get_chunks_root(flow_datastore)
+    files = []
+    chunks = {}
+    with tarfile.open(fileobj=BytesIO(bytes(blob)), mode="r:gz") as tar:
+        for member in tar.getmembers():
+            if not member.isfile():
+                continue
+            data = tar.extractfile(member).read()
+            shas = []
+            for chunk in content_defined_chunks(data):
+                sha = sha1(chunk).hexdigest()
+                chunks[sha] = chunk
+                shas.append(sha)
+            files.append({"name": member.name, "mode": member.mode, "chunks": shas})
+
+    shas = list(chunks)
+    paths = [storage.path_join(chunks_root, sha[:2], sha) for sha in shas]
+    missing = [
+        (path, gzip.compress(chunks[sha], compresslevel=3))
+        for sha, path, exists in zip(shas, paths, storage.is_file(paths))
+        if not exists
+    ]
+    if missing:
+        storage.save_bytes(missing, overwrite=True, len_hint=len(missing))
+
+    manifest = {
+        "version": DELTA_MANIFEST_VERSION,
+        "chunks_root": storage.full_uri(chunks_root),
+        "files": files,
+    }
+    return save_package(
+        flow_datastore, json.dumps(manifest, sort_keys=True).encode("utf-8")
+    )
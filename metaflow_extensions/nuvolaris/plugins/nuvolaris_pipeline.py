@@ -0,0 +1,120 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metaflow.exception import NuvolarisException
+
+
+class PipelinedStorage(object):
+    """Storage implementation uploading the blobs of the content addressed store
+    as soon as they are produced.
+
+    Metaflow pickles and compresses every artifact of the task, then uploads them
+    all. Here the artifacts iterator is consumed by the persisting thread while
+    the blobs already packed are uploaded, each with its own request, by a pool
+    of threads. The packed blobs waiting for upload are bounded by max_pending
+    bytes: the persisting thread waits for uploads to complete before packing
+    more (a single blob larger than the bound is still uploaded alone).
+    `flush` waits for the pending uploads and must be called before the attempt
+    is marked done, so the datastore is complete for the tasks running next.
+    """
+
+    def __init__(self, storage_impl, max_workers, max_pending):
+        self._storage_impl = storage_impl
+        self._max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._uploads = []
+        self._cond = threading.Condition()
+        self._pending = 0
+        self.stats = {
+            "blobs": 0,
+            "bytes": 0,
+            "peak-pending-bytes": 0,
+            "wait-seconds": 0.0,
+            "flush-seconds": 0.0,
+        }
+
+    def __getattr__(self, name):
+        # reads, path manipulation, etc. are delegated to the wrapped storage
+        return getattr(self._storage_impl, name)
+
+    def _acquire(self, size):
+        start = time.time()
+        with self._cond:
+            while self._pending and self._pending + size > self._max_pending:
+                self._cond.wait()
+            self._pending += size
+            self.stats["peak-pending-bytes"] = max(
+                self.stats["peak-pending-bytes"], self._pending
+            )
+        self.stats["wait-seconds"] += time.time() - start
+
+    def _release(self, size):
+        with self._cond:
+            self._pending -= size
+            self._cond.notify_all()
+
+    def _upload(self, path, obj, size, overwrite):
+        try:
+            self._storage_impl.save_bytes([(path, obj)], overwrite=overwrite, len_hint=1)
+        finally:
+            self._release(size)
+
+    def save_bytes(self, path_and_bytes_iter, overwrite=False, len_hint=0):
+        for path, obj in path_and_bytes_iter:
+            byte_obj = obj[0] if isinstance(obj, tuple) else obj
+            size = len(byte_obj.getbuffer()) if hasattr(byte_obj, "getbuffer") else 0
+            self._acquire(size)
+            self.stats["blobs"] += 1
+            self.stats["bytes"] += size
+            self._uploads.append(
+                self._executor.submit(self._upload, path, obj, size, overwrite)
+            )
+
+    def flush(self):
+        """Waits for the pending uploads."""
+        start = time.time()
+        uploads, self._uploads = self._uploads, []
+        errors = []
+        for upload in uploads:
+            try:
+                upload.result()
+            except Exception as e:
+                errors.append(e)
+        self.stats["flush-seconds"] += time.time() - start
+        if errors:
+            raise NuvolarisException(
+                "Failed to upload %d artifact(s) to the datastore: %s"
+                % (len(errors), errors[0])
+            )
+
+
+def enable_pipelined_persist(task_datastore, max_workers, max_pending_mb):
+    """Puts a PipelinedStorage in front of the content addressed store of the
+    flow, which the artifacts of the task are saved to, and returns it.
+    """
+    ca_store = task_datastore._ca_store
+    if isinstance(ca_store._storage_impl, PipelinedStorage):
+        return ca_store._storage_impl
+    pipeline = PipelinedStorage(
+        ca_store._storage_impl, max_workers, max_pending_mb * 1024 * 1024
+    )
+    ca_store._storage_impl = pipeline
+    return pipeline
@@ -0,0 +1,205 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+import math
+import os
+from statistics import median
+
+from metaflow.metaflow_config import DATASTORE_LOCAL_DIR
+
+from .openwhisk_client import is_pooling_enabled
+
+HISTORY_CACHE_DIR = os.path.join(DATASTORE_LOCAL_DIR, "nuvolaris", "history")
+
+
+def _task_record(task):
+    md = task.metadata_dict
+    duration = md.get("nuvolaris-activation-duration")
+    if duration is not None:
+        return {
+            "duration_ms": float(duration),
+            "init_ms": float(md.get("nuvolaris-activation-initTime", 0)),
+        }
+    # a local step, or a task run before the activation stats were recorded
+    if task.created_at and task.finished_at:
+        elapsed = task.finished_at - task.created_at
+        return {"duration_ms": elapsed.total_seconds() * 1000, "init_ms": 0}
+    return None
+
+
+def _run_record(run):
+    steps = {}
+    for step in run:
+        tasks = list(step)
+        records = [r for r in (_task_record(t) for t in tasks) if r]
+        artifact_bytes = 0
+        if tasks:
+            # artifacts are written by every task of a step, a sample is enough
+            artifact_bytes = sum(a.size for a in tasks[0].artifacts)
+        steps[step.id] = {
+            "tasks": len(tasks),
+            "duration_ms": [r["duration_ms"] for r in records],
+            "init_ms": [r["init_ms"] for r in records],
+            "artifact_bytes": artifact_bytes,
+        }
+    return steps
+
+
+def load_history(flow_name, max_runs=5, echo=None):
+    """Returns the records of the last max_runs successful runs of the flow, as
+    a list of {step_name: {tasks, duration_ms, init_ms, artifact_bytes}}.
+
+    Reading the metadata of every task of a large foreach is slow, so the record
+    of a run, which never changes once the run is finished, is cached locally.
+    History is best effort: no records are returned if the metadata can't be read.
+    """
+    from metaflow import Flow
+
+    cache_path = os.path.join(HISTORY_CACHE_DIR, "%s.json" % flow_name)
+    cache = {}
+    if os.path.isfile(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    records = []
+    try:
+        for run in Flow(flow_name).runs():
+            if len(records) == max_runs:
+                break
+            if run.id not in cache:
+                if not run.successful:
+                    continue
+                if echo:
+                    echo("Reading the timings of run %s..." % run.id)
+                cache[run.id] = _run_record(run)
+            records.append(cache[run.id])
+    except Exception as e:
+        if echo:
+            echo("Unable to read the history of %s: %s" % (flow_name, e))
+
+    os.makedirs(HISTORY_CACHE_DIR, exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(cache, f)
+    return records
+
+
+def _step_history(history, step_name):
+    durations, inits, tasks, artifact_bytes = [], [], [], []
+    for run in history:
+        if step_name in run:
+            durations.extend(run[step_name]["duration_ms"])
+            inits.extend(run[step_name]["init_ms"])
+            tasks.append(run[step_name]["tasks"])
+            artifact_bytes.append(run[step_name]["artifact_bytes"])
+    return durations, inits, tasks, artifact_bytes
+
+
+def _foreach_width(graph, name, history, splits):
+    # number of splits of a foreach: as given, or as in the last run that had it
+    if name in splits:
+        return splits[name], "given"
+    child = graph[name].out_funcs[0]
+    _, _, tasks, _ = _step_history(history, name)
+    _, _, child_tasks, _ = _step_history(history, child)
+    if tasks and child_tasks:
+        return max(1, child_tasks[0] // max(1, tasks[0])), "history"
+    return 1, "unknown"
+
+
+def expected_duration(history, step_name):
+    """Median duration in seconds of the tasks of the step in the history, or
+    None without history.
+    """
+    durations, _, _, _ = _step_history(history, step_name)
+    if not durations:
+        return None
+    return median(durations) / 1000.0
+
+
+def plan_flow(graph, history, splits, concurrency, max_workers):
+    """Projects the schedule and the cost of a run of the flow.
+
+    Every step gets as many tasks as the product of the widths of the foreach
+    steps enclosing it, run in waves of min(concurrency, max_workers) tasks
+    lasting the median task duration of the history (or the action timeout, an
+    upper bound, without history). The wall time of the run is the longest
+    path of the graph, parallel branches overlapping.
+    """
+    widths = {
+        node.name: _foreach_width(graph, node.name, history, splits)
+        for node in graph
+        if node.type == "foreach"
+    }
+    parallelism = max(1, min(concurrency, max_workers))
+
+    steps = {}
+    for node in graph:
+        invocations = 1
+        for parent in node.split_parents:
+            if widths.get(parent) and graph[parent].matching_join != node.name:
+                invocations *= widths[parent][0]
+
+        deco = next((d for d in node.decorators if d.name == "nuvolaris"), None)
+        durations, inits, _, artifact_bytes = _step_history(history, node.name)
+        if durations:
+            duration_ms, source = median(durations), "history(%d)" % len(durations)
+        elif deco:
+            duration_ms, source = float(deco.attributes["timeout"]), "timeout"
+        else:
+            duration_ms, source = 0.0, "unknown"
+
+        step = {
+            "invocations": invocations,
+            "duration_ms": duration_ms,
+            "duration_source": source,
+            "wall_ms": math.ceil(invocations / parallelism) * duration_ms,
+            "payload_bytes": invocations * (median(artifact_bytes) if artifact_bytes else 0),
+            "cold_start_ms": median(inits) if inits else 0,
+            "nuvolaris": deco is not None,
+            "gb_seconds": 0.0,
+        }
+        if deco:
+            step["memory"] = int(deco.attributes["memory"])
+            step["action"] = (
+                "<pool>" if is_pooling_enabled(deco.attributes["pool"])
+                else deco.attributes["action"]
+            )
+            step["prewarm"] = int(deco.attributes["prewarm"] or 0)
+            step["gb_seconds"] = (
+                invocations * step["memory"] / 1024.0 * duration_ms / 1000.0
+            )
+        steps[node.name] = step
+
+    finish = {}
+
+    def _finish(name):
+        if name not in finish:
+            start = max([_finish(p) for p in graph[name].in_funcs] or [0])
+            finish[name] = start + steps[name]["wall_ms"]
+        return finish[name]
+
+    wall_ms = max([_finish(node.name) for node in graph] or [0])
+    return {
+        "steps": steps,
+        "foreach_widths": widths,
+        "parallelism": parallelism,
+        "wall_ms": wall_ms,
+        "invocations": sum(s["invocations"] for s in steps.values() if s["nuvolaris"]),
+        "gb_seconds": sum(s["gb_seconds"] for s in steps.values()),
+        "payload_bytes": sum(s["payload_bytes"] for s in steps.values()),
+    }
@@ -0,0 +1,115 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import random
+import threading
+import time
+
+from metaflow.metaflow_config import NUVOLARIS_POLL_MAX, NUVOLARIS_POLL_MIN
+
+# Scheduling of the activation polls of the running tasks. Tasks launched
+# together (a foreach) would otherwise poll the controller in lockstep: the
+# polls are spread with decorrelated jitter, sparse until the completion
+# expected from the history of the step and denser around it, and slowed down
+# when the controller answers slowly or with errors.
+
+# Upper bound of the slow down applied under controller load
+MAX_LOAD_FACTOR = 8.0
+
+
+class ControllerLoad(object):
+    """Moving averages of the latency and of the error rate of the requests to
+    the controller, shared by the tasks waited by the process (the coordinator
+    threads).
+    """
+
+    def __init__(self, alpha=0.2):
+        self._alpha = alpha
+        self._lock = threading.Lock()
+        self.baseline = None
+        self.latency = None
+        self.error_rate = 0.0
+
+    def record(self, latency, error=False):
+        with self._lock:
+            self.error_rate += self._alpha * ((1.0 if error else 0.0) - self.error_rate)
+            if error:
+                return
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self._alpha * (latency - self.latency)
+            # the fastest answers seen, the latency of an idle controller
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+
+    def factor(self):
+        with self._lock:
+            factor = 1.0
+            if self.latency is not None and self.baseline:
+                factor = max(1.0, self.latency / max(self.baseline, 0.05))
+            factor *= 1.0 + 4.0 * self.error_rate
+            return min(factor, MAX_LOAD_FACTOR)
+
+
+CONTROLLER_LOAD = ControllerLoad()
+
+
+class PollScheduler(object):
+    """Decides when the activation of a task is polled next: `due` tells if a
+    poll is due, `polled` records its latency and schedules the next one.
+
+    Before the expected duration (seconds, from the history of the step, if
+    known) the delay is a quarter of the remaining time, then it follows a
+    decorrelated jitter (uniform between the minimum and three times the last
+    delay); it is always between NUVOLARIS_POLL_MIN and NUVOLARIS_POLL_MAX
+    seconds before the controller load factor is applied.
+    """
+
+    def __init__(self, expected_duration=None, load=CONTROLLER_LOAD):
+        self._min = float(NUVOLARIS_POLL_MIN)
+        self._max = float(NUVOLARIS_POLL_MAX)
+        self._expected = expected_duration
+        self._load = load
+        self._start = time.time()
+        self._delay = self._min
+        # tasks launched together don't poll together
+        self._next = self._start + random.uniform(self._min, self._first_delay())
+        self.polls = 0
+
+    def _first_delay(self):
+        if self._expected:
+            return min(self._max, max(self._min, self._expected / 4))
+        return self._min * 3
+
+    def due(self):
+        return time.time() >= self._next
+
+    def next_poll_in(self):
+        return max(0.0, self._next - time.time())
+
+    def polled(self, latency, error=False):
+        self.polls += 1
+        self._load.record(latency, error)
+        now = time.time()
+        remaining = (self._expected or 0) - (now - self._start)
+        if remaining > self._min:
+            delay = random.uniform(0.5, 1.0) * remaining / 4
+        else:
+            delay = random.uniform(self._min, self._delay * 3)
+        self._delay = min(self._max, max(self._min, delay))
+        self._next = now + self._delay * self._load.factor()
@@ -0,0 +1,67 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import threading
+
+from metaflow.decorators import StepDecorator
+
+from .nuvolaris_client import NuvolarisClient
+
+
+class PrewarmTrigger(StepDecorator):
+    """Runtime only decorator attached by @nuvolaris(prewarm=...) to the foreach
+    step preceding it, which may not run on Nuvolaris. It fires the warm up of the
+    action when the foreach task is created, so that the containers start while
+    the foreach step runs. It is not a registered decorator: it is marked as
+    statically defined so that the runtime never renders it as a --with option
+    of the step command line.
+    """
+
+    name = "nuvolaris_prewarm"
+
+    def __init__(self, prewarm):
+        super(PrewarmTrigger, self).__init__(statically_defined=True)
+        self._prewarm = prewarm
+
+    def runtime_task_created(
+        self, task_datastore, task_id, split_index, input_paths, is_cloned, ubf_context
+    ):
+        if not is_cloned:
+            self._prewarm()
+
+
+def prewarm_action(action, namespace, memory, timeout, kind, image, count, hold_ms):
+    """Deploys the action if needed, then fires count concurrent warm up
+    invocations, each one holding a container for hold_ms milliseconds. It runs
+    in background and never fails the run: the tasks would just start cold.
+    """
+
+    def _prewarm():
+        try:
+            client = NuvolarisClient().get()
+            if client.should_deploy_action(action, namespace, memory, timeout, kind, image):
+                client.deploy_action(action, namespace, memory, timeout, kind, image)
+            print(f"prewarming {count} containers of action {action}")
+            for _ in range(count):
+                # non blocking invocations, they overlap for hold_ms
+                client.warm_action(action, namespace, hold_ms)
+        except Exception as e:
+            print(f"unable to prewarm action {action}: {e}")
+
+    thread = threading.Thread(target=_prewarm, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,211 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metaflow.exception import NuvolarisException
+
+# Suffix of the file holding the datastore metadata of a scratch entry. It is
+# written only once the entry has been uploaded, so an entry without it is not
+# visible to readers (it may still be, or have failed, to be written through).
+META_SUFFIX = ".meta"
+
+
+class ScratchStorage(object):
+    """Write-through cache in front of a datastore storage implementation.
+
+    Objects are kept in a local directory (private to the action container, or a
+    volume shared by the actions of the cluster), keyed by their full datastore uri. Reads are served
+    from the scratch directory when possible and populate it otherwise; writes
+    land in the scratch directory and are uploaded to the datastore in background.
+    `flush` waits for the pending uploads and must be called before the attempt
+    is marked done, so the datastore is always complete for the tasks running
+    elsewhere.
+
+    Only content addressed objects should go through it (see `enable_scratch`),
+    as their content never changes once written.
+    """
+
+    def __init__(self, storage_impl, scratch_dir, max_size):
+        self._storage_impl = storage_impl
+        self._scratch_dir = scratch_dir
+        self._max_size = max_size
+        self._uploads = []
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(scratch_dir, exist_ok=True)
+
+    def __getattr__(self, name):
+        # path manipulation, listing, etc. are delegated to the wrapped storage
+        return getattr(self._storage_impl, name)
+
+    def _local_path(self, path):
+        uri = self._storage_impl.full_uri(path)
+        return os.path.join(self._scratch_dir, uri.replace("://", "/", 1).lstrip("/"))
+
+    def _cached(self, path):
+        local_path = self._local_path(path)
+        return os.path.isfile(local_path + META_SUFFIX) and os.path.isfile(local_path)
+
+    def _store(self, local_path, read_from):
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        tmp = "%s.%d" % (local_path, os.getpid())
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(read_from, f)
+        os.rename(tmp, local_path)
+
+    def _commit(self, local_path, meta):
+        tmp = "%s%s.%d" % (local_path, META_SUFFIX, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp, local_path + META_SUFFIX)
+
+    def is_file(self, paths):
+        results = [self._cached(p) for p in paths]
+        missing = [p for p, cached in zip(paths, results) if not cached]
+        if missing:
+            remote = iter(self._storage_impl.is_file(missing))
+            results = [cached or next(remote) for cached in results]
+        return results
+
+    @contextmanager
+    def load_bytes(self, paths):
+        results = []
+        missing = []
+        for p in paths:
+            if self._cached(p):
+                local_path = self._local_path(p)
+                with open(local_path + META_SUFFIX) as f:
+                    meta = json.load(f)
+                # refresh the entry for the LRU eviction
+                os.utime(local_path)
+                results.append((p, local_path, meta))
+            else:
+                missing.append(p)
+        if missing:
+            with self._storage_impl.load_bytes(missing) as loaded:
+                for key, path, meta in loaded:
+                    if path is None:
+                        results.append((key, None, None))
+                        continue
+                    local_path = self._local_path(key)
+                    with open(path, "rb") as f:
+                        self._store(local_path, f)
+                    self._commit(local_path, meta)
+                    results.append((key, local_path, meta))
+        yield results
+
+    def save_bytes(self, path_and_bytes_iter, overwrite=False, len_hint=0):
+        entries = []
+        for path, obj in path_and_bytes_iter:
+            if isinstance(obj, tuple):
+                byte_obj, meta = obj
+            else:
+                byte_obj, meta = obj, None
+            local_path = self._local_path(path)
+            self._store(local_path, byte_obj)
+            entries.append((path, local_path, meta))
+        if entries:
+            self._uploads.append(
+                self._executor.submit(self._upload, entries, overwrite)
+            )
+
+    def _upload(self, entries, overwrite):
+        handles = [open(local_path, "rb") for _, local_path, _ in entries]
+        try:
+            self._storage_impl.save_bytes(
+                (
+                    (path, (f, meta) if meta is not None else f)
+                    for (path, _, meta), f in zip(entries, handles)
+                ),
+                overwrite=overwrite,
+                len_hint=len(entries),
+            )
+        finally:
+            for f in handles:
+                f.close()
+        for _, local_path, meta in entries:
+            self._commit(local_path, meta)
+
+    def flush(self):
+        """Waits for the pending uploads, then trims the scratch directory."""
+        uploads, self._uploads = self._uploads, []
+        errors = []
+        for upload in uploads:
+            try:
+                upload.result()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise NuvolarisException(
+                "Failed to write %d artifact batch(es) through to the datastore: %s"
+                % (len(errors), errors[0])
+            )
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for root, _, files in os.walk(self._scratch_dir):
+            for f in files:
+                if f.endswith(META_SUFFIX):
+                    continue
+                local_path = os.path.join(root, f)
+                if not os.path.isfile(local_path + META_SUFFIX):
+                    # not uploaded (yet), possibly by another action
+                    continue
+                try:
+                    st = os.stat(local_path)
+                except OSError:
+                    continue
+                entries.append(
+                    (st.st_mtime, st.st_size, [local_path + META_SUFFIX, local_path])
+                )
+        evict_lru(entries, self._max_size)
+
+
+def evict_lru(entries, max_size):
+    """Removes the least recently used of the (mtime, size, paths) entries of a
+    local cache until their total size is within max_size bytes; the files of
+    an entry are removed together, missing ones are ignored.
+    """
+    total = sum(size for _, size, _ in entries)
+    for _, size, paths in sorted(entries, key=lambda e: e[0]):
+        if total <= max_size:
+            break
+        for p in paths:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+        total -= size
+
+
+def enable_scratch(task_datastore, scratch_dir, max_size_mb):
+    """Puts a ScratchStorage in front of the content addressed store of the flow,
+    which holds the artifacts of every task, and returns it.
+    """
+    ca_store = task_datastore._ca_store
+    if isinstance(ca_store._storage_impl, ScratchStorage):
+        return ca_store._storage_impl
+    scratch = ScratchStorage(
+        ca_store._storage_impl, scratch_dir, max_size_mb * 1024 * 1024
+    )
+    ca_store._storage_impl = scratch
+    return scratch
@@ -0,0 +1,104 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import re
+import statistics
+import threading
+from io import BytesIO
+
+from metaflow.metaflow_config import MAX_ATTEMPTS
+
+# Speculative execution of the stragglers of a foreach with
+# @nuvolaris(speculate=True), run by the coordinator which sees every task of
+# the step. The duplicate of a task runs as the last attempt Metaflow reads
+# (SPECULATIVE_ATTEMPT), so that readers, which take the latest attempt started,
+# always find the result there: when the duplicate wins it is already there,
+# when the original wins its artifacts are cloned to it. The loser is cancelled
+# through a marker, read by its heartbeat thread.
+SPECULATIVE_ATTEMPT = MAX_ATTEMPTS - 1
+
+
+def cancel_marker_path(storage, flow_name, run_id, step_name, task_id, attempt):
+    return storage.path_join(
+        flow_name, str(run_id), step_name, str(task_id), "%s.nuvolaris_cancel" % attempt
+    )
+
+
+def write_cancel_marker(storage, path):
+    storage.save_bytes([(path, BytesIO(b"cancel"))], overwrite=True, len_hint=1)
+
+
+def speculative_step_cli(step_cli):
+    # the duplicate is a regular attempt of the task with another id, allowed
+    # to run the user code (not the @catch fallback of the last retry)
+    step_cli = re.sub(r"--retry-count[ =]\d+", "--retry-count %d" % SPECULATIVE_ATTEMPT, step_cli)
+    return re.sub(
+        r"--max-user-code-retries[ =]\d+",
+        "--max-user-code-retries %d" % SPECULATIVE_ATTEMPT,
+        step_cli,
+    )
+
+
+def clone_attempt(flow_datastore, run_id, step_name, task_id, origin_attempt, attempt):
+    """Makes attempt a done copy of origin_attempt (artifacts are shared by
+    content), as the readers take the latest attempt started.
+    """
+    origin = flow_datastore.get_task_datastore(
+        run_id, step_name, task_id, attempt=int(origin_attempt)
+    )
+    ds = flow_datastore.get_task_datastore(
+        run_id, step_name, task_id, attempt=attempt, mode="w"
+    )
+    ds.init_task()
+    ds.clone(origin)
+    ds.done()
+
+
+class StepTracker(object):
+    """Durations of the finished tasks of a foreach step, shared by the
+    coordinator threads running its tasks.
+    """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self._durations = []
+        self._lock = threading.Lock()
+
+    def finished(self, duration):
+        with self._lock:
+            self._durations.append(duration)
+
+    def is_straggler(self, elapsed, quantile, multiplier):
+        """True once quantile of the expected tasks have finished and elapsed is
+        over multiplier times their median duration.
+        """
+        with self._lock:
+            if not self.expected or len(self._durations) < quantile * self.expected:
+                return False
+            return elapsed > multiplier * statistics.median(self._durations)
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_step_tracker(run_id, step_name, expected):
+    with _trackers_lock:
+        key = (run_id, step_name)
+        if key not in _trackers:
+            _trackers[key] = StepTracker(expected)
+        return _trackers[key]
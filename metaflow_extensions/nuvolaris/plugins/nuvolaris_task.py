@@ -0,0 +1,397 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+from metaflow import util
+from metaflow.exception import METAFLOW_EXIT_DISALLOW_RETRY
+from metaflow.metadata import MetaDatum
+from metaflow.datastore import TaskDataStore
+from metaflow.datastore.local_storage import LocalStorage
+from metaflow.metaflow_config import DATASTORE_LOCAL_DIR
+from metaflow.mflog import TASK_LOG_SOURCE
+
+from .nuvolaris import (
+    Nuvolaris,
+    NuvolarisTaskCancelledException,
+    NuvolarisTaskLostException,
+)
+from .nuvolaris_cache import record_cached_task
+from .nuvolaris_speculation import (
+    SPECULATIVE_ATTEMPT,
+    cancel_marker_path,
+    clone_attempt,
+    speculative_step_cli,
+    write_cancel_marker,
+)
+from .nuvolaris_metadata import (
+    METADATA_MANIFEST_ENV_VAR,
+    LocalMetadataSync,
+    local_metadata_manifest,
+)
+
+# Launching and monitoring a task on Nuvolaris, shared by the `nuvolaris step`
+# command (a process per task) and the coordinator (a thread per task).
+
+
+def get_step_env(node, input_paths):
+    """Returns the environment of the job (the @environment variables) and the
+    input paths to put on the command line, split in environment variables when
+    too long for it.
+    """
+    env = {}
+    env_deco = [deco for deco in node.decorators if deco.name == "environment"]
+    if env_deco:
+        env = dict(env_deco[0].attributes["vars"])
+
+    if input_paths:
+        max_size = 30 * 1024
+        split_vars = {
+            "METAFLOW_INPUT_PATHS_%d" % (i // max_size): input_paths[i : i + max_size]
+            for i in range(0, len(input_paths), max_size)
+        }
+        input_paths = "".join("${%s}" % s for s in split_vars.keys())
+        env.update(split_vars)
+    return env, input_paths
+
+
+def wait_before_retry(node, retry_count, echo, stop=None):
+    retry_deco = [deco for deco in node.decorators if deco.name == "retry"]
+    minutes_between_retries = None
+    if retry_deco:
+        minutes_between_retries = int(
+            retry_deco[0].attributes.get("minutes_between_retries", 2)
+        )
+    if retry_count:
+        echo("Sleeping %d minutes before the next retry" % minutes_between_retries)
+        if stop is None:
+            time.sleep(minutes_between_retries * 60)
+        else:
+            # interrupted when the task is cancelled
+            stop.wait(minutes_between_retries * 60)
+
+
+def get_step_cli(executable, top_level_options, step_name, step_options):
+    return "{entrypoint} {top_args} step {step} {step_args}".format(
+        entrypoint="%s -u %s" % (executable, os.path.basename(sys.argv[0])),
+        top_args=" ".join(util.dict_to_cli_options(top_level_options)),
+        step=step_name,
+        step_args=" ".join(util.dict_to_cli_options(step_options)),
+    )
+
+
+def run_task(
+    flow_name,
+    flow_datastore,
+    metadata,
+    environment,
+    monitor,
+    step_name,
+    run_id,
+    task_id,
+    retry_count,
+    step_cli,
+    env,
+    echo,
+    cache_key=None,
+    speculation=None,
+    stop=None,
+    **job_args
+):
+    """Launches the task on Nuvolaris and waits for it, echoing its logs.
+
+    Returns the exit code of the task as seen by the Metaflow runtime: 0 on
+    success, 1 when the task was lost (to be retried), and
+    METAFLOW_EXIT_DISALLOW_RETRY otherwise. With a cache_key the task is
+    recorded in the result cache once successful. With speculation (the
+    StepTracker of the step, the quantile and the multiplier) a duplicate of
+    the task is launched when it is a straggler (see nuvolaris_speculation.py).
+    With stop (a threading.Event), the task is no longer awaited once it is set
+    and METAFLOW_EXIT_DISALLOW_RETRY is returned.
+    """
+    start = time.time()
+    if stop is not None and stop.is_set():
+        echo("Task cancelled before its launch.")
+        return METAFLOW_EXIT_DISALLOW_RETRY
+
+    def _log_locations(attempt):
+        ds = flow_datastore.get_task_datastore(
+            mode="w",
+            run_id=run_id,
+            step_name=step_name,
+            task_id=task_id,
+            attempt=int(attempt),
+        )
+        return (
+            ds.get_log_location(TASK_LOG_SOURCE, "stdout"),
+            ds.get_log_location(TASK_LOG_SOURCE, "stderr"),
+        )
+
+    # Set log tailing.
+    stdout_location, stderr_location = _log_locations(retry_count)
+
+    if metadata.TYPE == "local":
+        # Let the action sync back only the metadata files missing locally
+        env[METADATA_MANIFEST_ENV_VAR] = json.dumps(
+            local_metadata_manifest(
+                LocalStorage.get_datastore_root_from_config(echo),
+                flow_name,
+                run_id,
+                step_name,
+                task_id,
+            )
+        )
+
+    metadata_sync = LocalMetadataSync(
+        DATASTORE_LOCAL_DIR,
+        lambda: flow_datastore.get_task_datastore(run_id, step_name, task_id),
+    )
+
+    def _sync_metadata():
+        if metadata.TYPE == "local":
+            metadata_sync.sync()
+
+    def _register_activation_stats():
+        # Book-keeping metadata used to compare action kinds (cold/warm start,
+        # memory) across runs; best effort as it is not needed by the task.
+        try:
+            stats = nuvolaris.activation_stats
+            if stats:
+                entries = [
+                    MetaDatum(
+                        field="nuvolaris-activation-%s" % k,
+                        value=str(v),
+                        type="nuvolaris-activation-%s" % k,
+                        tags=["attempt_id:%s" % retry_count],
+                    )
+                    for k, v in stats.items()
+                ]
+                metadata.register_metadata(run_id, step_name, task_id, entries)
+        except:
+            pass
+
+    def _launch(attempt, cli):
+        launched = Nuvolaris(
+            datastore=flow_datastore,
+            metadata=metadata,
+            environment=environment,
+        )
+        # Configure and launch Nuvolaris action.
+        with monitor.measure("metaflow.nuvolaris.launch_job"):
+            launched.launch_job(
+                flow_name=flow_name,
+                run_id=run_id,
+                step_name=step_name,
+                task_id=task_id,
+                attempt=str(attempt),
+                user=util.get_username(),
+                code_package_ds=flow_datastore.TYPE,
+                step_cli=cli,
+                env=env,
+                **job_args
+            )
+        return launched
+
+    try:
+        nuvolaris = _launch(retry_count, step_cli)
+    except Exception:
+        echo(traceback.format_exc(chain=False))
+        _sync_metadata()
+        return METAFLOW_EXIT_DISALLOW_RETRY
+    try:
+        if speculation is None:
+            nuvolaris.wait(stdout_location, stderr_location, echo=echo, stop=stop)
+        else:
+            nuvolaris = _wait_speculative(
+                nuvolaris,
+                lambda: _launch(SPECULATIVE_ATTEMPT, speculative_step_cli(step_cli)),
+                _log_locations,
+                flow_datastore,
+                flow_name,
+                run_id,
+                step_name,
+                task_id,
+                retry_count,
+                start,
+                echo,
+                stop,
+                **speculation
+            )
+    except NuvolarisTaskCancelledException as e:
+        echo(str(e))
+        return METAFLOW_EXIT_DISALLOW_RETRY
+    except NuvolarisTaskLostException as e:
+        # unlike the failures of the task itself, a lost container is retried
+        echo(str(e))
+        return 1
+    except Exception:
+        # don't retry abnormally terminated tasks
+        echo(traceback.format_exc())
+        return METAFLOW_EXIT_DISALLOW_RETRY
+    finally:
+        _sync_metadata()
+        _register_activation_stats()
+    if speculation is not None:
+        speculation["tracker"].finished(time.time() - start)
+    if cache_key:
+        try:
+            record_cached_task(
+                flow_datastore, cache_key, "%s/%s/%s" % (run_id, step_name, task_id)
+            )
+        except Exception as e:
+            echo("Unable to cache the result of the task: %s" % e)
+    return 0
+
+
+class _AttemptWaiter(object):
+    # Waits for an attempt in a thread, its logs are echoed until abandoned.
+    def __init__(self, nuvolaris, attempt, log_locations, echo, stop):
+        self.nuvolaris = nuvolaris
+        self.attempt = attempt
+        self.error = None
+        self.done = threading.Event()
+        self._abandoned = False
+
+        def _echo(*args, **kwargs):
+            if not self._abandoned:
+                echo(*args, **kwargs)
+
+        threading.Thread(
+            target=self._wait, args=(log_locations, _echo, stop), daemon=True
+        ).start()
+
+    def _wait(self, log_locations, echo, stop):
+        try:
+            self.nuvolaris.wait(*log_locations, echo=echo, stop=stop)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def abandon(self):
+        self._abandoned = True
+
+
+def _speculative_attempt_started(flow_datastore, run_id, step_name, task_id):
+    storage = flow_datastore._storage_impl
+    path = storage.path_join(
+        flow_datastore.flow_name,
+        str(run_id),
+        step_name,
+        str(task_id),
+        TaskDataStore.metadata_name_for_attempt(
+            TaskDataStore.METADATA_ATTEMPT_SUFFIX, SPECULATIVE_ATTEMPT
+        ),
+    )
+    return storage.is_file([path])[0]
+
+
+def _wait_speculative(
+    nuvolaris,
+    launch_duplicate,
+    log_locations,
+    flow_datastore,
+    flow_name,
+    run_id,
+    step_name,
+    task_id,
+    retry_count,
+    start,
+    echo,
+    stop,
+    tracker,
+    quantile,
+    multiplier,
+):
+    """Waits for the task, launching a duplicate attempt if it becomes a
+    straggler of its step, and returns the Nuvolaris job of the first attempt
+    to succeed. Raises the error of the task if no attempt succeeds.
+    """
+    waiters = [
+        _AttemptWaiter(nuvolaris, retry_count, log_locations(retry_count), echo, stop)
+    ]
+    # retries of a task whose duplicate failed must not speculate again
+    can_speculate = int(retry_count) < SPECULATIVE_ATTEMPT and not (
+        _speculative_attempt_started(flow_datastore, run_id, step_name, task_id)
+    )
+    while True:
+        winner = next((w for w in waiters if w.done.is_set() and w.error is None), None)
+        if winner is not None:
+            break
+        if all(w.done.is_set() for w in waiters):
+            raise waiters[0].error
+        if (
+            can_speculate
+            and not (stop is not None and stop.is_set())
+            and not waiters[0].done.is_set()
+            and tracker.is_straggler(time.time() - start, quantile, multiplier)
+        ):
+            can_speculate = False
+            echo("Task is a straggler of its step, launching a speculative attempt.")
+            try:
+                waiters.append(
+                    _AttemptWaiter(
+                        launch_duplicate(),
+                        SPECULATIVE_ATTEMPT,
+                        log_locations(SPECULATIVE_ATTEMPT),
+                        echo,
+                        stop,
+                    )
+                )
+            except Exception as e:
+                echo("Unable to launch the speculative attempt: %s" % e)
+        time.sleep(1)
+
+    storage = flow_datastore._storage_impl
+    for waiter in waiters:
+        if waiter is winner:
+            continue
+        waiter.abandon()
+        if not waiter.done.is_set():
+            write_cancel_marker(
+                storage,
+                cancel_marker_path(
+                    storage, flow_name, run_id, step_name, task_id, waiter.attempt
+                ),
+            )
+    for waiter in waiters:
+        if waiter.attempt == SPECULATIVE_ATTEMPT and waiter is not winner:
+            # The duplicate writes to the attempt the readers use: it reads the
+            # marker at its next beat, and could still complete until then. It
+            # must be gone before the winner is cloned there; its activation
+            # ends, or the heartbeat monitor declares it lost.
+            if not waiter.done.is_set():
+                echo("Waiting for the speculative attempt to stop...")
+            waiter.done.wait()
+    if winner.attempt != SPECULATIVE_ATTEMPT and (
+        len(waiters) > 1
+        or _speculative_attempt_started(flow_datastore, run_id, step_name, task_id)
+    ):
+        # the readers take the latest attempt started
+        clone_attempt(
+            flow_datastore, run_id, step_name, task_id, winner.attempt, SPECULATIVE_ATTEMPT
+        )
+    if len(waiters) > 1:
+        echo(
+            "Attempt %s finished first, the other one is cancelled." % winner.attempt
+        )
+    return winner.nuvolaris
@@ -0,0 +1,49 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Stands for a Nuvolaris task run by the coordinator (nuvolaris_coordinator.py)
+in the Metaflow runtime: prints the task logs and exits with the task exit code.
+
+It is run as a script with python -S, so it must only use the standard library.
+
+usage: nuvolaris_waiter.py <coordinator socket> <token>
+"""
+import json
+import socket
+import sys
+
+# METAFLOW_EXIT_DISALLOW_RETRY, when the coordinator went away
+EXIT_DISALLOW_RETRY = 202
+
+
+def wait(address, token):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(address)
+    sock.sendall((token + "\n").encode("utf-8"))
+    with sock.makefile("r", encoding="utf-8") as f:
+        for line in f:
+            msg = json.loads(line)
+            if "exit" in msg:
+                return msg["exit"]
+            stream = sys.stderr if msg["stream"] == "stderr" else sys.stdout
+            stream.write(msg["line"] + "\n")
+            stream.flush()
+    return EXIT_DISALLOW_RETRY
+
+
+if __name__ == "__main__":
+    sys.exit(wait(sys.argv[1], sys.argv[2]))
@@ -24,20 +24,68 @@ from metaflow.metaflow_config import (
     NUVOLARIS_DEFAULT_API_URL,
     NUVOLARIS_DEFAULT_API_USER,
     NUVOLARIS_DEFAULT_API_AUTH,
-    NUVOLARIS_METAFLOW_OW_KIND
+    NUVOLARIS_METAFLOW_OW_KIND,
+    NUVOLARIS_METAFLOW_PYTHON_OW_KIND,
+    NUVOLARIS_METAFLOW_IMAGE_PROFILES,
+    NUVOLARIS_ACTION_POOLING,
+    NUVOLARIS_ACTION_POOL_PREFIX
 )
 
+# Supported @nuvolaris action kinds, each one mapped to its action template and
+# to the OpenWhisk runtime kind providing the matching metaflow enabled image
+ACTION_KINDS = {
+    "go": {"template": "templates/mf_nuvolaris_action.go", "ow_kind": NUVOLARIS_METAFLOW_OW_KIND},
+    "python": {"template": "templates/mf_nuvolaris_action.py", "ow_kind": NUVOLARIS_METAFLOW_PYTHON_OW_KIND},
+}
+DEFAULT_ACTION_KIND = "go"
+
+def get_image_profiles():
+    profiles = NUVOLARIS_METAFLOW_IMAGE_PROFILES
+    if isinstance(profiles, str):
+        profiles = json.loads(profiles)
+    return profiles
+
+def resolve_action_image(image):
+    """ Returns the docker image for an @nuvolaris image attribute, which is either
+    the name of a runtime image profile or a full image reference. None means the
+    image associated to the action kind by the OpenWhisk runtime configuration.
+    """
+    if not image:
+        return None
+    return get_image_profiles().get(image, image)
+
+def is_pooling_enabled(pool=None):
+    """ The pool attribute of a step wins over the NUVOLARIS_ACTION_POOLING configuration,
+    which may come from the environment as a string.
+    """
+    if pool is None:
+        pool = NUVOLARIS_ACTION_POOLING
+    if isinstance(pool, str):
+        return pool.lower() in ("1", "true", "yes")
+    return bool(pool)
+
+def get_pooled_action_name(memory, timeout, kind=DEFAULT_ACTION_KIND, image=None):
+    """ Returns the name of the shared action serving every step with the same resource
+    shape. The action source doesn't depend on the step, so steps of different flows
+    with the same shape reuse the same action and its warm containers.
+    """
+    image_id = hashlib.sha1((resolve_action_image(image) or "").encode("utf-8")).hexdigest()[:8]
+    return f"{NUVOLARIS_ACTION_POOL_PREFIX}-{kind}-{memory}m-{timeout}ms-{image_id}"
+
 class WskCli(object):
         def __init__(self):
             self._headers = {'Content-Type': 'application/json'}
             self._ow_auth = self.get_auth()
-            self._nuv_action_template = self.get_mf_nuvolaris_action_template()
+            self._nuv_action_templates = {}
 
-        def get_mf_nuvolaris_action_template(self):
-            with open("templates/mf_nuvolaris_action.go", "r") as file:
-                action_src = file.read()
-                file.close()
-                return action_src                
+        def get_mf_nuvolaris_action_template(self, kind=DEFAULT_ACTION_KIND):
+            # templates are lazily loaded and kept for the lifetime of the client
+            if kind not in self._nuv_action_templates:
+                with open(ACTION_KINDS[kind]["template"], "r") as file:
+                    action_src = file.read()
+                    file.close()
+                    self._nuv_action_templates[kind] = action_src
+            return self._nuv_action_templates[kind]
 
         def build_action_url(self,baseurl,action_name, namespace, package=None ):   
             url = f"{baseurl}/{namespace}/actions/"
@@ -56,15 +104,15 @@ class WskCli(object):
         def get_auth(self):
             return {'username':NUVOLARIS_DEFAULT_API_USER, 'password':NUVOLARIS_DEFAULT_API_AUTH}
         
-        def get_hash(self, action_name,memory, timeout):
-            to_hash_data = json.dumps({"name":action_name,"memory":memory,"timeout":timeout,"code":self._nuv_action_template})
+        def get_hash(self, action_name,memory, timeout, kind=DEFAULT_ACTION_KIND, image=None):
+            to_hash_data = json.dumps({"name":action_name,"memory":memory,"timeout":timeout,"kind":kind,"image":image,"code":self.get_mf_nuvolaris_action_template(kind)})
             return self.get_action_hash(to_hash_data)
         
-        def should_deploy_action(self, action_name, namespace, memory, timeout):
+        def should_deploy_action(self, action_name, namespace, memory, timeout, kind=DEFAULT_ACTION_KIND, image=None):
             """ Check if the given action should be deployed or not checking on the
             action annotations hash key
             """
-            print(f"checking existence of action {action_name} with memory={memory} and timeout={timeout}")
+            print(f"checking existence of action {action_name} with kind={kind}, memory={memory} and timeout={timeout}")
 
             try:
                 response = self.get_action_detail(action_name, namespace)
@@ -78,7 +126,7 @@ class WskCli(object):
 
                 if "annotations" in action_data:
                     annotations = action_data["annotations"]
-                    action_hash = self.get_hash(action_name,memory,timeout)
+                    action_hash = self.get_hash(action_name,memory,timeout,kind,image)
 
                     for ann in annotations:
                         if ann["key"] == "hash":
@@ -94,15 +142,21 @@ class WskCli(object):
                 print(f"unpredicatable error checking existence of action{action_name}")
                 return True
             
-        def deploy_action(self, action_name, namespace, memory, timeout):
-            print(f"creating action {action_name} with memory={memory} and timeout={timeout}")            
+        def deploy_action(self, action_name, namespace, memory, timeout, kind=DEFAULT_ACTION_KIND, image=None):
+            print(f"creating action {action_name} with kind={kind}, image={image}, memory={memory} and timeout={timeout}")            
             
-            action_hash = self.get_hash(action_name,memory,timeout)
+            action_hash = self.get_hash(action_name,memory,timeout,kind,image)
+            action_exec = {"kind":ACTION_KINDS[kind]["ow_kind"],"code":self.get_mf_nuvolaris_action_template(kind)}
+            if image:
+                # a custom image is deployed as a blackbox action still receiving the launcher source
+                action_exec["kind"] = "blackbox"
+                action_exec["image"] = image
+
             # Deploy the action using the rest api
             params = {
                     "namespace":namespace,
                     "name":action_name,
-                    "exec":{"kind":NUVOLARIS_METAFLOW_OW_KIND,"code":self._nuv_action_template},
+                    "exec":action_exec,
                     "limits": {"timeout": timeout,"memory": memory,"logs": 10},
                     "annotations":[{"key":"hash","value":action_hash}]
                     }
@@ -115,16 +169,29 @@ class WskCli(object):
             return response
 
         
-        # Execute an action in a non blocking fashion passing the metaflow generated command as argument
-        def execute_action(self, action_name, command, environment_variables, namespace):            
-            params = {"command":command}
+        # Execute an action in a non blocking fashion passing the metaflow generated command, or its structured
+        # launcher spec, as argument
+        # Invoke the action, without blocking unless blocking_wait is given: then the controller
+        # answers with the activation record if it completes within blocking_wait seconds, with
+        # the activation id only (202) otherwise
+        def execute_action(self, action_name, command, environment_variables, namespace, spec=None, blocking_wait=None):
+            params = {"spec":spec} if spec else {"command":command}
 
             if(environment_variables):
                 params["environment_variables"]=environment_variables
 
             url = self.build_action_url(NUVOLARIS_DEFAULT_API_URL,action_name,namespace)
+            if blocking_wait:
+                query = {"blocking": "true", "timeout": int(blocking_wait * 1000)}
+                # the controller returns at the wait bound, the request timeout only covers a lost answer
+                return req.post(url, auth=(self._ow_auth['username'],self._ow_auth['password']), headers=self._headers, data=json.dumps(params), params=query, timeout=blocking_wait + 30)
             return req.post(url, auth=(self._ow_auth['username'],self._ow_auth['password']), headers=self._headers, data=json.dumps(params))
 
+        # Execute a no-op invocation keeping a container of the action busy for hold_ms milliseconds
+        def warm_action(self, action_name, namespace, hold_ms):
+            url = self.build_action_url(NUVOLARIS_DEFAULT_API_URL,action_name,namespace)
+            return req.post(url, auth=(self._ow_auth['username'],self._ow_auth['password']), headers=self._headers, data=json.dumps({"warmup":hold_ms}))
+
         # Fetch the detail about the action
         def get_action_detail(self, action_name, namespace):
             url = self.build_action_url(NUVOLARIS_DEFAULT_API_URL,action_name,namespace)
@@ -0,0 +1,145 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Code package fetcher
+
+Assembles in the current directory a code package saved by the @nuvolaris
+decorator as a manifest of content addressed chunks (see nuvolaris_package.py).
+Chunks are kept in a cache surviving across the activations served by the same
+warm container, so only the chunks changed since the last run are downloaded.
+
+With --tar it downloads and extracts a tarball code package instead, which lets
+the launcher spec bootstrap a task without any shell command.
+
+It runs before the code package (and therefore metaflow) is available, so it
+only depends on the datastore SDKs shipped with the runtime image.
+
+usage: fetch_package.py [--tar gzip|xz|zstd] <url>
+"""
+import argparse
+import gzip
+import json
+import os
+import subprocess
+import tarfile
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from urllib.parse import urlparse
+
+CHUNKS_CACHE_DIR = "/tmp/nuvolaris/chunks"
+MAX_WORKERS = 16
+
+
+class S3Fetcher(object):
+    def __init__(self):
+        import boto3
+
+        self._client = boto3.client(
+            "s3", endpoint_url=os.environ.get("METAFLOW_S3_ENDPOINT_URL") or None
+        )
+
+    def get(self, url):
+        parsed = urlparse(url)
+        obj = self._client.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))
+        return obj["Body"].read()
+
+
+class AzureFetcher(object):
+    def __init__(self):
+        from azure.identity import DefaultAzureCredential
+        from azure.storage.blob import BlobServiceClient
+
+        self._client = BlobServiceClient(
+            account_url=os.environ["METAFLOW_AZURE_STORAGE_BLOB_SERVICE_ENDPOINT"],
+            credential=DefaultAzureCredential(),
+        )
+
+    def get(self, url):
+        # metaflow azure urls are <container>/<blob>
+        container, blob = url.split("/", 1)
+        return self._client.get_blob_client(container, blob).download_blob().readall()
+
+
+def get_fetcher(url):
+    if url.startswith("s3://"):
+        return S3Fetcher()
+    return AzureFetcher()
+
+
+def fetch_chunk(fetcher, chunks_root, sha):
+    path = os.path.join(CHUNKS_CACHE_DIR, sha)
+    if os.path.isfile(path):
+        return path
+    data = gzip.decompress(fetcher.get("%s/%s/%s" % (chunks_root, sha[:2], sha)))
+    if sha1(data).hexdigest() != sha:
+        raise ValueError("corrupted code package chunk %s" % sha)
+    tmp = "%s.%d" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.rename(tmp, path)
+    return path
+
+
+def extract_tar(url, compression):
+    data = get_fetcher(url).get(url)
+    if compression == "zstd":
+        # the zstd cli is part of the runtime images, the zstandard module is not
+        data = subprocess.run(
+            ["zstd", "-qdc"], input=data, stdout=subprocess.PIPE, check=True
+        ).stdout
+    # gzip and xz are detected by tarfile itself
+    with tarfile.open(fileobj=BytesIO(data), mode="r:*") as tar:
+        tar.extractall()
+
+
+def assemble_delta(manifest_url):
+    fetcher = get_fetcher(manifest_url)
+    manifest = json.loads(fetcher.get(manifest_url))
+    os.makedirs(CHUNKS_CACHE_DIR, exist_ok=True)
+
+    shas = {sha for f in manifest["files"] for sha in f["chunks"]}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        paths = dict(
+            zip(
+                shas,
+                pool.map(
+                    lambda sha: fetch_chunk(fetcher, manifest["chunks_root"], sha),
+                    shas,
+                ),
+            )
+        )
+
+    for f in manifest["files"]:
+        dirname = os.path.dirname(f["name"])
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(f["name"], "wb") as out:
+            for sha in f["chunks"]:
+                with open(paths[sha], "rb") as chunk:
+                    out.write(chunk.read())
+        os.chmod(f["name"], f["mode"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tar", choices=("gzip", "xz", "zstd"))
+    parser.add_argument("url")
+    args = parser.parse_args()
+    if args.tar:
+        extract_tar(args.url, args.tar)
+    else:
+        assemble_delta(args.url)
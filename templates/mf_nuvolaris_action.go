@@ -1,15 +1,41 @@
 package main
 
 import (
+	"bytes"
 	"fmt"
+	"io"
 	"os"
 	"os/exec"
+	"path/filepath"
 	"strings"
+	"sync"
+	"time"
 )
 
 func Main(args map[string]interface{}) map[string]interface{} {
 	env := copyEnvironment()
 
+	// warm up invocations only keep the container busy, so that concurrent ones
+	// make OpenWhisk start as many containers for the coming tasks
+	if args["warmup"] != nil {
+		time.Sleep(time.Duration(args["warmup"].(float64)) * time.Millisecond)
+		return map[string]interface{}{
+			"mf_process_status": "warmup",
+		}
+	}
+
+	if args["spec"] != nil {
+		if args["environment_variables"] != nil {
+			envVars := args["environment_variables"].(map[string]interface{})
+			for k, v := range envVars {
+				env[k] = v.(string)
+			}
+		}
+		result := runSpec(args["spec"].(map[string]interface{}), env)
+		fmt.Println(result)
+		return result
+	}
+
 	if args["command"] != nil {
 		args_c := args["command"].([]interface{})
 
@@ -79,3 +105,218 @@ func parseArguments(args_c []interface{}) string {
 	}
 	return command
 }
+
+// syncBuffer collects the output of the processes run by a launcher spec,
+// written concurrently
+type syncBuffer struct {
+	mu  sync.Mutex
+	buf bytes.Buffer
+}
+
+func (b *syncBuffer) Write(p []byte) (int, error) {
+	b.mu.Lock()
+	defer b.mu.Unlock()
+	return b.buf.Write(p)
+}
+
+func (b *syncBuffer) String() string {
+	b.mu.Lock()
+	defer b.mu.Unlock()
+	return b.buf.String()
+}
+
+// expand resolves $VAR and ${VAR} references, as a shell would expand a single word
+func expand(value string, env map[string]string) string {
+	return os.Expand(value, func(k string) string { return env[k] })
+}
+
+func asList(v interface{}) []interface{} {
+	if l, ok := v.([]interface{}); ok {
+		return l
+	}
+	return nil
+}
+
+func toStrings(values []interface{}, env map[string]string, raw bool) []string {
+	var result []string
+	for _, v := range values {
+		s := v.(string)
+		if !raw {
+			s = expand(s, env)
+		}
+		result = append(result, s)
+	}
+	return result
+}
+
+// mflog writes the same structured line of the mflog bash function of metaflow
+func mflog(msg string, env map[string]string, out *syncBuffer) {
+	ts := time.Now().UTC().Format("2006-01-02T15:04:05.000000")
+	f, err := os.OpenFile(env["MFLOG_STDOUT"], os.O_APPEND|os.O_CREATE|os.O_WRONLY, 0644)
+	if err == nil {
+		fmt.Fprintf(f, "[MFLOG|0|%sZ|task|%s]%s\n", ts, ts, msg)
+		f.Close()
+	}
+	out.Write([]byte(msg + "\n"))
+}
+
+func exitCode(err error, out *syncBuffer) int {
+	if err == nil {
+		return 0
+	}
+	if exitErr, ok := err.(*exec.ExitError); ok {
+		return exitErr.ExitCode()
+	}
+	// the process could not be started
+	fmt.Fprintln(out, err)
+	return 127
+}
+
+func newCommand(argv []string, env map[string]string, dir string) *exec.Cmd {
+	cmd := exec.Command(argv[0], argv[1:]...)
+	cmd.Dir = dir
+	cmd.Env = prepareEnvironment(env)
+	return cmd
+}
+
+func runPhase(phase map[string]interface{}, env map[string]string, dir string, out *syncBuffer) int {
+	raw, _ := phase["raw"].(bool)
+	cmd := newCommand(toStrings(asList(phase["argv"]), env, raw), env, dir)
+
+	if tee, ok := phase["tee"].(map[string]interface{}); ok {
+		// the step output goes through the mflog tee processes, as bash_capture_logs does
+		stdout, err := cmd.StdoutPipe()
+		if err != nil {
+			return exitCode(err, out)
+		}
+		stderr, err := cmd.StderrPipe()
+		if err != nil {
+			return exitCode(err, out)
+		}
+		var tees []*exec.Cmd
+		for _, stream := range []struct {
+			name string
+			pipe io.Reader
+		}{{"stdout", stdout}, {"stderr", stderr}} {
+			teeCmd := newCommand(toStrings(asList(tee[stream.name]), env, false), env, dir)
+			teeCmd.Stdin = stream.pipe
+			teeCmd.Stdout = out
+			teeCmd.Stderr = out
+			tees = append(tees, teeCmd)
+		}
+		if err := cmd.Start(); err != nil {
+			return exitCode(err, out)
+		}
+		for _, teeCmd := range tees {
+			if err := teeCmd.Start(); err != nil {
+				// nobody would read the output of the step
+				cmd.Process.Kill()
+				fmt.Fprintln(out, err)
+			}
+		}
+		code := exitCode(cmd.Wait(), out)
+		for _, teeCmd := range tees {
+			if teeCmd.Process != nil {
+				teeCmd.Wait()
+			}
+		}
+		return code
+	}
+
+	if variable, ok := phase["prepend_stdout_to"].(string); ok {
+		var stdout bytes.Buffer
+		cmd.Stdout = &stdout
+		cmd.Stderr = out
+		code := exitCode(cmd.Run(), out)
+		if code == 0 {
+			value := strings.TrimSpace(stdout.String())
+			if env[variable] != "" {
+				value = value + ":" + env[variable]
+			}
+			env[variable] = value
+		}
+		return code
+	}
+
+	cmd.Stdout = out
+	cmd.Stderr = out
+	return exitCode(cmd.Run(), out)
+}
+
+// runSpec runs the phases of a launcher spec (see Nuvolaris._launcher_spec) without going through bash
+func runSpec(spec map[string]interface{}, env map[string]string) map[string]interface{} {
+	dir, _ := os.Getwd()
+	env["PWD"] = dir
+	if specEnv, ok := spec["env"].(map[string]interface{}); ok {
+		for k, v := range specEnv {
+			env[k] = expand(v.(string), env)
+		}
+	}
+
+	out := &syncBuffer{}
+	code := 0
+	var timings []interface{}
+	for _, p := range asList(spec["phases"]) {
+		phase := p.(map[string]interface{})
+		always, _ := phase["always"].(bool)
+		if code != 0 && !always {
+			continue
+		}
+		start := time.Now()
+		for _, path := range toStrings(asList(phase["rmtree"]), env, false) {
+			os.RemoveAll(filepath.Join(dir, path))
+		}
+		for _, path := range toStrings(asList(phase["mkdir"]), env, false) {
+			os.MkdirAll(filepath.Join(dir, path), 0755)
+		}
+		if msg, ok := phase["log"].(string); ok {
+			mflog(msg, env, out)
+		}
+		if chdir, ok := phase["chdir"].(string); ok {
+			// never os.Chdir, the container serves the next activations too
+			dir = filepath.Join(dir, chdir)
+		}
+
+		phaseCode := 0
+		attempts := 0
+		if len(asList(phase["argv"])) > 0 {
+			retries := 0
+			if r, ok := phase["retries"].(float64); ok {
+				retries = int(r)
+			}
+			delay := 0.0
+			if d, ok := phase["retry_delay"].(float64); ok {
+				delay = d
+			}
+			for attempts = 1; attempts <= retries+1; attempts++ {
+				phaseCode = runPhase(phase, env, dir, out)
+				if phaseCode == 0 || attempts > retries {
+					break
+				}
+				time.Sleep(time.Duration(delay * float64(time.Second)))
+			}
+		}
+		timings = append(timings, map[string]interface{}{
+			"name":     phase["name"],
+			"duration": time.Since(start).Milliseconds(),
+			"ret_code": phaseCode,
+			"attempts": attempts,
+		})
+		if code == 0 {
+			code = phaseCode
+		}
+	}
+
+	result := map[string]interface{}{
+		"mf_process_status":   "success",
+		"mf_process_ret_code": code,
+		"mf_process_stdout":   out.String(),
+		"mf_process_stderr":   "",
+		"mf_phases":           timings,
+	}
+	if code != 0 {
+		result["mf_process_status"] = "failed"
+		result["mf_process_stderr"] = fmt.Sprintf("exit status %d", code)
+	}
+	return result
+}
@@ -16,34 +16,141 @@
 # under the License.
 #
 #
-# Generic @nuvolaris.io action capable of exdcuting a metaflow launching command in a subprocess
+# Generic @nuvolaris.io action capable of exdcuting a metaflow launching command in a subprocess.
+# It is the python native counterpart of mf_nuvolaris_action.go and it is deployed when a step
+# is decorated with @nuvolaris(kind="python"), so that no go compilation happens on action creation.
 #
 import subprocess
-import json
 import os
-import sys
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+
+_ENV_REF = re.compile(r"\$\{(\w+)\}|\$(\w+)")
+
+def expand(value, env):
+    # $VAR and ${VAR} references, as a shell would expand a single word
+    return _ENV_REF.sub(lambda m: env.get(m.group(1) or m.group(2), ""), value)
+
+def mflog(msg, env, out):
+    # same structured line written by the mflog bash function of metaflow
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")
+    with open(env["MFLOG_STDOUT"], "a") as f:
+        f.write("[MFLOG|0|%sZ|task|%s]%s\n" % (ts, ts, msg))
+    out.write((msg + "\n").encode("utf-8"))
+
+def run_phase(phase, env, cwd, out):
+    argv = phase["argv"] if phase.get("raw") else [expand(a, env) for a in phase["argv"]]
+    if phase.get("tee"):
+        # the step output goes through the mflog tee processes, as bash_capture_logs does
+        step = subprocess.Popen(argv, env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        tees = [
+            subprocess.Popen([expand(a, env) for a in phase["tee"][stream]], env=env, cwd=cwd, stdin=pipe, stdout=out, stderr=out)
+            for stream, pipe in (("stdout", step.stdout), ("stderr", step.stderr))
+        ]
+        step.stdout.close()
+        step.stderr.close()
+        code = step.wait()
+        for tee in tees:
+            tee.wait()
+        return code
+    if phase.get("prepend_stdout_to"):
+        cp = subprocess.run(argv, env=env, cwd=cwd, stdout=subprocess.PIPE, stderr=out)
+        if cp.returncode == 0:
+            var = phase["prepend_stdout_to"]
+            value = cp.stdout.decode("utf-8").strip()
+            env[var] = value + (":" + env[var] if env.get(var) else "")
+        return cp.returncode
+    return subprocess.run(argv, env=env, cwd=cwd, stdout=out, stderr=subprocess.STDOUT).returncode
+
+def run_spec(spec, env):
+    """ Runs the phases of a launcher spec (see Nuvolaris._launcher_spec) without going through bash """
+    cwd = os.getcwd()
+    env["PWD"] = cwd
+    for k, v in spec.get("env", {}).items():
+        env[k] = expand(v, env)
+
+    code = 0
+    timings = []
+    # unbuffered and in append mode, it is shared with the phase processes
+    fd, out_path = tempfile.mkstemp()
+    os.close(fd)
+    with open(out_path, "ab", buffering=0) as out:
+        for phase in spec["phases"]:
+            if code != 0 and not phase.get("always"):
+                continue
+            start = time.time()
+            for path in phase.get("rmtree", []):
+                shutil.rmtree(os.path.join(cwd, path), ignore_errors=True)
+            for path in phase.get("mkdir", []):
+                os.makedirs(os.path.join(cwd, path), exist_ok=True)
+            if phase.get("log"):
+                mflog(phase["log"], env, out)
+            if phase.get("chdir"):
+                # never os.chdir, the container serves the next activations too
+                cwd = os.path.join(cwd, phase["chdir"])
+            phase_code = 0
+            attempts = 0
+            if phase.get("argv"):
+                for attempts in range(1, phase.get("retries", 0) + 2):
+                    try:
+                        phase_code = run_phase(phase, env, cwd, out)
+                    except OSError as e:
+                        out.write(("%s: %s\n" % (phase["name"], e)).encode("utf-8"))
+                        phase_code = 127
+                    if phase_code == 0 or attempts > phase.get("retries", 0):
+                        break
+                    time.sleep(phase.get("retry_delay", 0))
+            timings.append({"name": phase["name"], "duration": int((time.time() - start) * 1000), "ret_code": phase_code, "attempts": attempts})
+            if code == 0:
+                code = phase_code
+    with open(out_path, "rb") as f:
+        output = f.read().decode("utf-8", errors="replace")
+    os.remove(out_path)
+
+    return {
+        "mf_process_status": "success" if code == 0 else "failed",
+        "mf_process_ret_code": code,
+        "mf_process_stdout": output,
+        "mf_process_stderr": "" if code == 0 else "exit status %d" % code,
+        "mf_phases": timings
+    }
 
 def main(args):
+    # warm up invocations only keep the container busy, so that concurrent ones
+    # make OpenWhisk start as many containers for the coming tasks
+    if args.get('warmup'):
+        time.sleep(args['warmup'] / 1000)
+        return { "mf_process_status": "warmup" }
+
     env = os.environ.copy()
-    if( args['environment_variables']):        
+    if args.get('environment_variables'):
         for k,v in args['environment_variables'].items():
-            #os.environ[k]=v
             env[k]=v
 
-    env["DEFAULT_PYTHON_EXECUTABLE"]=sys.executable
+    # we add python environment variable required by mf
+    env["DEFAULT_PYTHON_EXECUTABLE"]="python3"
+
+    if args.get('spec'):
+        result = run_spec(args['spec'], env)
+        print(result)
+        return result
 
-    if ( args['command']) :
-        print(args['command'])
-        cp = subprocess.run(args['command'], env=env)
-        return { 
-            "mf_process_status": cp.returncode == 0 and "success" or "failed",
+    if args.get('command'):
+        # the command is received already tokenized, as the go launcher does we join it back
+        # and let bash evaluate it
+        command = " ".join(args['command'])
+        print(command)
+        cp = subprocess.run(["/bin/bash", "-c", command], env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        result = {
+            "mf_process_status": "success" if cp.returncode == 0 else "failed",
             "mf_process_ret_code": cp.returncode,
-            "mf_process_stderr": cp.stderr,
-            "mf_process_stdout": cp.stdout
+            "mf_process_stdout": cp.stdout.decode("utf-8", errors="replace"),
+            "mf_process_stderr": "" if cp.returncode == 0 else "exit status %d" % cp.returncode
         }
-
+        print(result)
+        return result
     else:
         return { "mf_process_status": "failed" }
-
-    
-    
\ No newline at end of file